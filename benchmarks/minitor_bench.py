@@ -0,0 +1,459 @@
+"""Benchmarks for the Minitor check loop
+
+Generates synthetic configs using local commands and a local HTTP stub server,
+then measures check throughput, scheduling jitter, the latency from a failed
+check to its alert, and startup time. Results are written as JSON so they can
+be compared between runs.
+
+Usage:
+
+    python benchmarks/minitor_bench.py --sizes 100,1000 --output results.json
+"""
+import json
+import logging
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from itertools import chain
+from time import monotonic
+from unittest.mock import patch
+
+import yaml
+
+from minitor.config_cache import ConfigCache
+from minitor.main import async_call_output
+from minitor.main import call_output
+from minitor.main import ENGINE_ASYNCIO
+from minitor.main import ENGINE_THREAD
+from minitor.main import Minitor
+from minitor.main import Monitor
+from minitor.main import Scheduler
+from minitor.spawn_helper import SpawnHelper
+
+
+# Formatted with each monitor's index so that no two monitors share a command,
+# which would let them share results rather than run their own checks
+COMMANDS = (
+    ["true", "{index}"],
+    ["false", "{index}"],
+    # Sleeps for 10ms, plus less than a millisecond
+    ["sleep", "0.01{index:06d}"],
+)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+@contextmanager
+def stub_server():
+    """Runs a local HTTP server for http probes"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    thread = threading.Thread(
+        target=server.serve_forever,
+        kwargs={"poll_interval": 0.01},
+        daemon=True,
+    )
+    thread.start()
+    try:
+        yield "http://127.0.0.1:{}/".format(server.server_address[1])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * pct / 100), len(values) - 1)]
+
+
+def summarize(values):
+    """Returns summary statistics for a list of seconds"""
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": statistics.mean(values),
+        "p50": percentile(values, 50),
+        "p99": percentile(values, 99),
+        "max": max(values),
+    }
+
+
+def cpu_seconds():
+    """Returns CPU seconds used by this process and its children"""
+    usage = [
+        resource.getrusage(who)
+        for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)
+    ]
+    return sum(u.ru_utime + u.ru_stime for u in usage)
+
+
+def peak_rss_kb():
+    """Returns the peak RSS of this process in KiB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes rather than KiB
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def generate_config(size, url=None, probe_ratio=0.0, check_interval=30, **monitor):
+    """Returns a config with size monitors cycling through unique COMMANDS
+
+    A fraction of monitors, set by probe_ratio, use an http probe against url
+    """
+    probes = int(size * probe_ratio) if url else 0
+    monitors = []
+    for i in range(size):
+        settings = dict(
+            {"name": "Monitor {}".format(i), "check_interval": check_interval},
+            **monitor
+        )
+        if i < probes:
+            settings["http"] = {"url": url}
+        else:
+            settings["command"] = [
+                arg.format(index=i) for arg in COMMANDS[i % len(COMMANDS)]
+            ]
+        monitors.append(settings)
+    return {
+        "check_interval": check_interval,
+        "alerts": {"noop": {"command": ["true"]}},
+        "monitors": monitors,
+    }
+
+
+def write_config(config):
+    """Writes config to a temporary YAML file and returns its path"""
+    with tempfile.NamedTemporaryFile("w", suffix=".yml", delete=False) as f:
+        yaml.safe_dump(config, f)
+    return f.name
+
+
+def load_minitor(config, engine=ENGINE_THREAD, max_concurrency=1):
+    """Returns a Minitor set up from config by way of a YAML file"""
+    path = write_config(config)
+    try:
+        minitor = Minitor()
+        minitor._setup(path)
+        minitor.engine = engine
+        minitor.max_concurrency = max_concurrency
+        minitor._validate_monitors()
+    finally:
+        os.unlink(path)
+    return minitor
+
+
+@contextmanager
+def measure(result):
+    """Records wall time and CPU time into result"""
+    start_cpu, start = cpu_seconds(), monotonic()
+    yield
+    result["seconds"] = monotonic() - start
+    result["cpu_seconds"] = cpu_seconds() - start_cpu
+    result["peak_rss_kb"] = peak_rss_kb()
+
+
+def bench_throughput(size, url, args):
+    """Measures how quickly a single pass over all monitors completes"""
+    config = generate_config(size, url=url, probe_ratio=args.probe_ratio)
+    start = monotonic()
+    minitor = load_minitor(config, args.engine, args.max_concurrency)
+    result = {"setup_seconds": monotonic() - start}
+    with measure(result):
+        minitor._check()
+    result["checks_per_second"] = size / result["seconds"]
+    return result
+
+
+def run_loop(minitor, duration):
+    """Drives the Minitor scheduling loop for duration seconds
+
+    This mirrors Minitor._loop, but stops after the duration
+    """
+    scheduler = Scheduler(minitor.monitors, spread=minitor.spread_checks)
+    end = monotonic() + duration
+    while True:
+        remaining = end - monotonic()
+        if remaining <= 0:
+            break
+        minitor._wait(min(minitor._time_until_next(scheduler), remaining))
+        due = minitor._pop_due(scheduler)
+        minitor._check(due)
+        scheduler.reschedule(due)
+
+
+def bench_jitter(size, url, args):
+    """Measures how far each check strays from its scheduled interval"""
+    interval = args.jitter_interval
+    config = generate_config(
+        size, url=url, probe_ratio=args.probe_ratio, check_interval=interval
+    )
+    minitor = load_minitor(config, args.engine, args.max_concurrency)
+
+    starts = {}
+    run_command = Monitor.run_command
+    run_command_async = Monitor.run_command_async
+
+    def timed_run_command(monitor):
+        starts.setdefault(monitor.name, []).append(monotonic())
+        return run_command(monitor)
+
+    async def timed_run_command_async(monitor):
+        starts.setdefault(monitor.name, []).append(monotonic())
+        return await run_command_async(monitor)
+
+    result = {"check_interval": interval}
+    with patch.object(Monitor, "run_command", timed_run_command), patch.object(
+        Monitor, "run_command_async", timed_run_command_async
+    ):
+        with measure(result):
+            run_loop(minitor, args.duration)
+
+    jitter = [
+        abs((later - earlier) - interval)
+        for times in starts.values()
+        for earlier, later in zip(times, times[1:])
+    ]
+    result["jitter"] = summarize(jitter)
+    result["checks"] = sum(len(times) for times in starts.values())
+    # Checks started in the busiest second shows how bursty the load is
+    per_second = {}
+    for start in chain.from_iterable(starts.values()):
+        per_second[int(start)] = per_second.get(int(start), 0) + 1
+    result["max_checks_per_second"] = max(per_second.values(), default=0)
+    return result
+
+
+def bench_alert_latency(size, args):
+    """Measures time from a failed check being handled to its alert command
+
+    The alert is timed when its command is started, so time spent waiting in
+    the alert dispatcher's queue is included when --alert-workers is set.
+    """
+    config = generate_config(size, alert_after=1, alert_down=["timed"])
+    config["alerts"]["timed"] = {"command": ["true", "{monitor_name}"]}
+    for monitor in config["monitors"]:
+        monitor["command"] = ["false"]
+    minitor = load_minitor(config, args.engine, args.max_concurrency)
+    minitor.alert_workers = args.alert_workers
+
+    failed_at = {}
+    latencies = []
+    handle_result = Monitor.handle_result
+
+    def timed_handle_result(monitor, output, ex):
+        failed_at[monitor.name] = monotonic()
+        return handle_result(monitor, output, ex)
+
+    def time_alert(command):
+        # Only alert commands start with true, since every check fails
+        if command[0] == "true":
+            latencies.append(monotonic() - failed_at[command[1]])
+
+    def timed_call_output(command, **kwargs):
+        time_alert(command)
+        return call_output(command, **kwargs)
+
+    async def timed_async_call_output(command, **kwargs):
+        time_alert(command)
+        return await async_call_output(command, **kwargs)
+
+    result = {}
+    with patch.object(Monitor, "handle_result", timed_handle_result), patch(
+        "minitor.main.call_output", timed_call_output
+    ), patch("minitor.main.async_call_output", timed_async_call_output):
+        with measure(result):
+            minitor._check()
+            if minitor._alert_dispatcher is not None:
+                minitor._alert_dispatcher.join()
+    result["latency"] = summarize(latencies)
+    return result
+
+
+def time_setup(path, cache=None):
+    """Returns seconds taken to set up a Minitor from the config at path"""
+    minitor = Minitor()
+    minitor._config_cache = cache
+    start = monotonic()
+    minitor._setup(path)
+    minitor._validate_monitors()
+    return monotonic() - start
+
+
+def bench_startup(size, args):
+    """Measures loading config with and without the config cache"""
+    path = write_config(generate_config(size))
+    cache = ConfigCache("{}.cache.json".format(path))
+    try:
+        return {
+            "no_cache_seconds": time_setup(path),
+            "cold_cache_seconds": time_setup(path, cache),
+            "warm_cache_seconds": time_setup(path, cache),
+        }
+    finally:
+        os.unlink(path)
+        os.unlink(cache.path)
+
+
+def time_spawns(call, count):
+    """Returns the seconds taken by each of count calls to run `true`"""
+    times = []
+    for _ in range(count):
+        start = monotonic()
+        call(["true"])
+        times.append(monotonic() - start)
+    return times
+
+
+def bench_spawn(size, args):
+    """Measures starting commands directly and through the spawn helper
+
+    The helper is started before the monitors are loaded, as Minitor does, so
+    only the direct path pays for the size of this process.
+    """
+    helper = SpawnHelper()
+    helper.start()
+    try:
+        minitor = load_minitor(generate_config(size))
+        result = {"monitors": len(minitor.monitors), "rss_kb": peak_rss_kb()}
+        for name, call in (("direct", call_output), ("helper", helper.call_output)):
+            with measure(result.setdefault(name, {})):
+                times = time_spawns(call, args.spawn_count)
+            result[name]["latency"] = summarize(times)
+    finally:
+        helper.stop()
+    return result
+
+
+def time_import(statement, repeat=5):
+    """Returns the fastest time to run an import in a new interpreter"""
+    times = []
+    for _ in range(repeat):
+        start = monotonic()
+        subprocess.check_call([sys.executable, "-c", statement])
+        times.append(monotonic() - start)
+    return min(times)
+
+
+def bench_import():
+    """Measures how long it takes to start an interpreter and import Minitor
+
+    Importing every optional dependency shows the cost avoided by importing
+    them lazily.
+    """
+    return {
+        "minitor_seconds": time_import("import minitor.main"),
+        "all_dependencies_seconds": time_import(
+            "import minitor.main, prometheus_client, yamlenv"
+        ),
+    }
+
+
+def parse_args(args=None):
+    parser = ArgumentParser(description="Benchmark the Minitor check loop")
+    parser.add_argument(
+        "--sizes",
+        default="100,1000",
+        help="Comma separated numbers of monitors to benchmark",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=(ENGINE_THREAD, ENGINE_ASYNCIO),
+        default=ENGINE_THREAD,
+    )
+    parser.add_argument("--max-concurrency", type=int, default=1)
+    parser.add_argument(
+        "--alert-workers",
+        type=int,
+        default=0,
+        help="Threads that issue alerts when measuring alert latency",
+    )
+    parser.add_argument(
+        "--probe-ratio",
+        type=float,
+        default=0.25,
+        help="Fraction of monitors that use an http probe against a stub server",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=5,
+        help="Seconds to run the loop when measuring jitter",
+    )
+    parser.add_argument(
+        "--jitter-interval",
+        type=int,
+        default=1,
+        help="Check interval used when measuring jitter",
+    )
+    parser.add_argument(
+        "--spawn-count",
+        type=int,
+        default=200,
+        help="Commands to start each way when comparing the spawn helper",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        default="bench-results.json",
+        help="Path to write JSON results to",
+    )
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+    # Keep logging out of the measurements
+    logging.disable(logging.CRITICAL)
+
+    results = {
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "engine": args.engine,
+        "max_concurrency": args.max_concurrency,
+        "alert_workers": args.alert_workers,
+        "probe_ratio": args.probe_ratio,
+        "import": bench_import(),
+        "sizes": {},
+    }
+    with stub_server() as url:
+        for size in (int(size) for size in args.sizes.split(",")):
+            print("Benchmarking {} monitors".format(size), file=sys.stderr)
+            results["sizes"][size] = {
+                "throughput": bench_throughput(size, url, args),
+                "jitter": bench_jitter(size, url, args),
+                "alert_latency": bench_alert_latency(size, args),
+                "startup": bench_startup(size, args),
+                "spawn": bench_spawn(size, args),
+            }
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print("Results written to {}".format(args.output), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
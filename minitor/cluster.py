@@ -0,0 +1,163 @@
+"""Splits Monitors between Minitor nodes that share a config
+
+Each node serves a heartbeat endpoint on its metrics HTTP server and polls
+the endpoints of its peers. Monitors are assigned to the live nodes using
+consistent hashing, so when a node joins or leaves only the Monitors it owns
+move to another node.
+"""
+import hashlib
+import json
+import logging
+from bisect import bisect
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
+from time import monotonic
+from time import sleep
+from urllib.error import URLError
+from urllib.request import urlopen
+
+
+CLUSTER_PATH = "/cluster"
+DEFAULT_HEARTBEAT_INTERVAL = 2
+# Number of points on the ring for each node
+DEFAULT_REPLICAS = 64
+
+
+def _hash(value):
+    digest = hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class HashRing(object):
+    """Consistent hash ring that assigns keys to nodes
+
+    Each node is placed at many points on the ring so that keys are spread
+    evenly between nodes.
+    """
+
+    def __init__(self, nodes, replicas=DEFAULT_REPLICAS):
+        self.nodes = frozenset(nodes)
+        points = sorted(
+            (_hash("{}#{}".format(node, i)), node)
+            for node in self.nodes
+            for i in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def owner(self, key):
+        """Returns the node that owns key or None if there are no nodes"""
+        if not self._hashes:
+            return None
+        index = bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[index]
+
+
+class Cluster(object):
+    """Tracks which nodes are alive and which node owns each Monitor
+
+    Nodes are identified by the host:port address of their metrics server.
+    A peer is considered alive while it has answered a heartbeat within the
+    last timeout seconds. Until the first heartbeat, the node is not ready and
+    should leave every Monitor alone, since it doesn't know its peers yet.
+    """
+
+    def __init__(
+        self,
+        node,
+        peers,
+        interval=DEFAULT_HEARTBEAT_INTERVAL,
+        timeout=None,
+        logger=None,
+        clock=monotonic,
+    ):
+        self.node = node
+        self.peers = [peer for peer in peers if peer != node]
+        self.interval = interval
+        self.timeout = timeout if timeout is not None else interval * 3
+        self._clock = clock
+        # Time each peer last answered a heartbeat
+        self._last_seen = {}
+        self._ring = HashRing([node])
+        self.ready = False
+        self._executor = None
+        if logger is None:
+            self._logger = logging.getLogger(self.__class__.__name__)
+        else:
+            self._logger = logger.getChild(self.__class__.__name__)
+
+    def live_nodes(self):
+        """Returns the nodes that are currently alive, including this one"""
+        now = self._clock()
+        return {self.node} | {
+            peer
+            for peer, last_seen in list(self._last_seen.items())
+            if now - last_seen <= self.timeout
+        }
+
+    @property
+    def nodes(self):
+        """Returns the nodes that Monitors are assigned to or None if not ready"""
+        return self._ring.nodes if self.ready else None
+
+    def owns(self, name):
+        """Returns True if this node should check the named Monitor"""
+        return self._ring.owner(name) == self.node
+
+    def _poll(self, peer):
+        """Returns True if peer answered a heartbeat"""
+        try:
+            with urlopen(
+                "http://{}{}".format(peer, CLUSTER_PATH), timeout=self.interval
+            ) as response:
+                return json.load(response).get("node") == peer
+        except (OSError, URLError, ValueError) as e:
+            self._logger.debug("No heartbeat from %s: %s", peer, e)
+            return False
+
+    def heartbeat(self):
+        """Polls every peer and updates the live nodes
+
+        Peers are polled at once so that unreachable peers do not delay the
+        heartbeats of the others past the timeout.
+        """
+        if self.peers:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=len(self.peers),
+                    thread_name_prefix="minitor-heartbeat",
+                )
+            answered = self._executor.map(self._poll, self.peers)
+            for peer, is_alive in zip(self.peers, answered):
+                if is_alive:
+                    self._last_seen[peer] = self._clock()
+        self._update_ring()
+        self.ready = True
+
+    def _update_ring(self):
+        nodes = self.live_nodes()
+        if nodes != self._ring.nodes:
+            self._logger.warning("Live cluster nodes: %s", ", ".join(sorted(nodes)))
+            self._ring = HashRing(nodes)
+
+    def _run(self):
+        # Give peers started at the same time a chance to answer the first one
+        sleep(self.interval)
+        while True:
+            self.heartbeat()
+            sleep(self.interval)
+
+    def start(self):
+        """Starts sending heartbeats in a background thread"""
+        Thread(target=self._run, name="minitor-cluster", daemon=True).start()
+
+    def wsgi_app(self, environ, start_response):
+        """Answers heartbeats from peers"""
+        body = json.dumps(
+            {"node": self.node, "live_nodes": sorted(self.live_nodes())}
+        ).encode("utf-8")
+        start_response(
+            "200 OK",
+            [("Content-Type", "application/json"), ("Content-Length", str(len(body)))],
+        )
+        return [body]
@@ -0,0 +1,85 @@
+"""Caches parsed config so that it is not parsed again until it changes"""
+import hashlib
+import json
+import logging
+import os
+import re
+
+
+CACHE_VERSION = 1
+# The cached config has env vars interpolated, which often include secrets
+CACHE_MODE = 0o600
+# Matches the names of environment variables interpolated by yamlenv
+ENV_VAR_RE = re.compile(r"\$\{([^:}-]+)")
+
+
+def config_key(contents, environ=None):
+    """Returns a key for config contents and the env vars it references
+
+    Interpolated values are part of the parsed config, so any change to a
+    referenced variable must also change the key.
+    """
+    if environ is None:
+        environ = os.environ
+    names = sorted(set(ENV_VAR_RE.findall(contents)))
+    digest = hashlib.sha256(str(CACHE_VERSION).encode("utf-8"))
+    digest.update(contents.encode("utf-8"))
+    digest.update(
+        json.dumps({name: environ.get(name) for name in names}).encode("utf-8")
+    )
+    return digest.hexdigest()
+
+
+class ConfigCache(object):
+    """Stores the most recently parsed config in a file as JSON
+
+    JSON is much faster to load than YAML with env interpolation. Configs that
+    would not survive encoding as JSON unchanged are not cached. Since values
+    from env vars are cached as well, the file is only readable by its owner.
+    """
+
+    def __init__(self, path, logger=None):
+        self.path = path
+        if logger is None:
+            self._logger = logging.getLogger(self.__class__.__name__)
+        else:
+            self._logger = logger.getChild(self.__class__.__name__)
+
+    def load(self, key):
+        """Returns the cached config for a key or None if not cached"""
+        try:
+            with open(self.path, "r") as f:
+                cached = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            self._logger.warning("Could not read config cache %s: %s", self.path, e)
+            return None
+
+        if not isinstance(cached, dict) or cached.get("key") != key:
+            return None
+        return cached.get("config")
+
+    def save(self, key, config):
+        """Caches config for a key. Returns True if written"""
+        try:
+            encoded = json.dumps(config)
+        except (TypeError, ValueError) as e:
+            self._logger.debug("Not caching config: %s", e)
+            return False
+        if json.loads(encoded) != config:
+            self._logger.debug("Not caching config that changes as JSON")
+            return False
+
+        tmp_path = "{}.tmp".format(self.path)
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, CACHE_MODE)
+            with open(fd, "w") as f:
+                # The mode is only used when creating the file, so set it again
+                os.fchmod(f.fileno(), CACHE_MODE)
+                f.write('{{"key": {}, "config": {}}}'.format(json.dumps(key), encoded))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            self._logger.warning("Could not write config cache %s: %s", self.path, e)
+            return False
+        return True
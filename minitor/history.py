@@ -0,0 +1,72 @@
+"""Keeps the results of recent checks for each Monitor"""
+import struct
+
+
+STATUSES = ("success", "failure", "timeout")
+# Stored in place of an exit code for checks that did not have one
+NO_EXIT_CODE = -(2**31)
+# Timestamp, duration, status index, and exit code of each result
+RECORD = struct.Struct("=ddbi")
+
+
+class ResultHistory(object):
+    """Fixed size ring buffer of recent check results
+
+    Results are packed into a single array of bytes, allocated up front,
+    rather than stored as objects so that keeping a history for every Monitor
+    stays cheap.
+    """
+
+    __slots__ = ("size", "_records", "_next", "_count")
+
+    def __init__(self, size):
+        self.size = size
+        self._records = bytearray(RECORD.size * size)
+        # Index that the next result is written to
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, status, duration=None, exit_code=None):
+        """Adds a result, replacing the oldest one if full
+
+        Timestamps are seconds since the epoch.
+        """
+        RECORD.pack_into(
+            self._records,
+            self._next * RECORD.size,
+            timestamp,
+            float("nan") if duration is None else duration,
+            STATUSES.index(status),
+            NO_EXIT_CODE if exit_code is None else exit_code,
+        )
+        self._next = (self._next + 1) % self.size
+        self._count = min(self._count + 1, self.size)
+
+    def entries(self):
+        """Returns results, oldest first, as tuples of timestamp, status,
+        duration, and exit code"""
+        first = (self._next - self._count) % self.size
+        entries = []
+        for i in range(self._count):
+            timestamp, duration, status, exit_code = RECORD.unpack_from(
+                self._records, (first + i) % self.size * RECORD.size
+            )
+            entries.append(
+                (
+                    timestamp,
+                    STATUSES[status],
+                    None if duration != duration else duration,
+                    None if exit_code == NO_EXIT_CODE else exit_code,
+                )
+            )
+        return entries
+
+    def load(self, entries):
+        """Replaces the results with entries from another history"""
+        self._next = 0
+        self._count = 0
+        for entry in entries[-self.size :]:
+            self.append(*entry)
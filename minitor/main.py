@@ -1,31 +1,90 @@
+import hashlib
 import logging
+import os
+import re
+import select
+import selectors
+import shlex
+import signal
+import socket
 import subprocess
 import sys
 from argparse import ArgumentParser
+from concurrent.futures import as_completed
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from heapq import heappop
+from heapq import heappush
 from itertools import chain
+from itertools import count
+from queue import Full
+from queue import Queue
 from subprocess import CalledProcessError
-from subprocess import check_output
+from subprocess import SubprocessError
+from subprocess import TimeoutExpired
+from threading import Lock
+from threading import Thread
+from threading import Timer
+from time import monotonic
 from time import sleep
+from time import time
 
-import yamlenv
-from prometheus_client import Counter
-from prometheus_client import Gauge
-from prometheus_client import start_http_server
+from minitor.config_cache import config_key
+from minitor.config_cache import ConfigCache
+from minitor.history import ResultHistory
+from minitor.probes import build_probe
+from minitor.probes import PROBE_TYPES
+from minitor.state import StateStore
+from minitor.templates import CommandTemplate
 
 
 DEFAULT_METRICS_PORT = 8080
+DEFAULT_MAX_CONCURRENCY = 1
+DEFAULT_ALERT_QUEUE_SIZE = 1000
+DEFAULT_MAX_OUTPUT = 64 * 1024
+DEFAULT_WATCH_INTERVAL = 5
+DEFAULT_STATE_INTERVAL = 30
+DEFAULT_HISTORY_SIZE = 10
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf"))
+READ_SIZE = 32 * 1024
+ENGINE_THREAD = "thread"
+ENGINE_ASYNCIO = "asyncio"
+STATUS_SUCCESS = "success"
+STATUS_FAILURE = "failure"
+STATUS_TIMEOUT = "timeout"
+# Factor that the interval of a Monitor with a max_interval grows by after
+# each successful check
+INTERVAL_GROWTH = 1.5
+# Offset from the monotonic clock to the wall clock, fixed at startup so that
+# conversions between the two are stable
+_WALL_CLOCK_OFFSET = time() - monotonic()
+# Monitor settings that hold lists of names shared between Monitors
+INTERNED_SETTINGS = ("alerts", "alert_down", "alert_up", "depends_on")
+# Alert name tuples shared between Monitors, keyed by themselves
+_alert_lists = {}
+# Command keys shared between Monitors, keyed by themselves
+_command_keys = {}
+# Shell commands made only of these characters run the same in exec form.
+# Newlines are left out since they separate commands
+SHELL_SAFE_RE = re.compile(r"[\w \t@%+=:,./'\"-]*")
 logging.basicConfig(
     level=logging.ERROR, format="%(asctime)s %(levelname)s %(name)s %(message)s"
 )
 logging.getLogger(__name__).addHandler(logging.NullHandler())
 
 
+def load_yaml(contents):
+    """Loads config from a YAML string with env interpolation"""
+    # Imported here so that a cached config can be loaded without it
+    import yamlenv
+
+    return yamlenv.load(contents)
+
+
 def read_yaml(path):
     """Loads config from a YAML file with env interpolation"""
     with open(path, "r") as yaml:
-        contents = yaml.read()
-        return yamlenv.load(contents)
+        return load_yaml(yaml.read())
 
 
 def validate_monitor_settings(settings):
@@ -37,8 +96,15 @@ def validate_monitor_settings(settings):
     name = settings.get("name")
     if not name:
         raise InvalidMonitorException("Invalid name for monitor")
-    if not settings.get("command"):
+    check_types = [key for key in chain(("command",), PROBE_TYPES) if settings.get(key)]
+    if not check_types:
         raise InvalidMonitorException("Invalid command for monitor {}".format(name))
+    if len(check_types) > 1:
+        raise InvalidMonitorException(
+            "Monitor {} should only have one of: {}".format(
+                name, ", ".join(check_types)
+            )
+        )
 
     type_assertions = (
         ("check_interval", int),
@@ -66,25 +132,369 @@ def validate_monitor_settings(settings):
                 "Invalid value for {}: {}. Value cannot be 0".format(name, key)
             )
 
+    if not is_valid_timeout(settings.get("timeout")):
+        raise InvalidMonitorException(
+            "Invalid value for {}: timeout. Expected a positive number".format(name)
+        )
+    if not is_valid_max_output(settings.get("max_output")):
+        raise InvalidMonitorException(
+            "Invalid value for {}: max_output. Expected a positive int".format(name)
+        )
+    if not is_valid_history_size(settings.get("history_size", 0)):
+        raise InvalidMonitorException(
+            "Invalid value for {}: history_size. Expected a non-negative int".format(
+                name
+            )
+        )
+
+    depends_on = settings.get("depends_on", [])
+    if not isinstance(depends_on, list) or not all(
+        isinstance(parent, str) for parent in depends_on
+    ):
+        raise InvalidMonitorException(
+            "Invalid value for {}: depends_on. Expected a list of monitor names".format(
+                name
+            )
+        )
+
+    check_interval = settings["check_interval"]
+    min_interval = settings.get("min_interval", check_interval)
+    max_interval = settings.get("max_interval", check_interval)
+    for key, val in (("min_interval", min_interval), ("max_interval", max_interval)):
+        if not is_valid_timeout(val):
+            raise InvalidMonitorException(
+                "Invalid value for {}: {}. Expected a positive number".format(name, key)
+            )
+    if not min_interval <= check_interval <= max_interval:
+        raise InvalidMonitorException(
+            "Invalid intervals for {}. Expected min_interval <= check_interval "
+            "<= max_interval".format(name)
+        )
+
+
+def is_valid_timeout(timeout):
+    """Timeouts are optional, but must be a positive number if provided"""
+    if timeout is None:
+        return True
+    if isinstance(timeout, bool) or not isinstance(timeout, (int, float)):
+        return False
+    return timeout > 0
+
+
+def is_valid_max_output(max_output):
+    """Output limits are optional, but must be a positive int if provided"""
+    if max_output is None:
+        return True
+    if isinstance(max_output, bool) or not isinstance(max_output, int):
+        return False
+    return max_output > 0
+
+
+def is_valid_history_size(history_size):
+    """History sizes must be an int, and 0 disables history"""
+    if isinstance(history_size, bool) or not isinstance(history_size, int):
+        return False
+    return history_size >= 0
+
 
 def maybe_decode(bstr, encoding="utf-8"):
     try:
-        return bstr.decode(encoding)
+        # Output may be truncated in the middle of a character
+        return bstr.decode(encoding, errors="replace")
     except TypeError:
         return bstr
 
 
-def call_output(*popenargs, **kwargs):
-    """Similar to check_output, but instead returns output and exception"""
+def monotonic_to_datetime(timestamp):
+    """Converts a time from the monotonic clock to a datetime"""
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp + _WALL_CLOCK_OFFSET)
+
+
+def datetime_to_monotonic(dt):
+    """Converts a datetime to a time on the monotonic clock"""
+    if dt is None:
+        return None
+    return dt.timestamp() - _WALL_CLOCK_OFFSET
+
+
+def intern_alerts(alerts):
+    """Returns a tuple of alert names shared by all equal lists of alerts"""
+    alerts = tuple(alerts)
+    return _alert_lists.setdefault(alerts, alerts)
+
+
+def command_key(command, timeout=None, max_output=None):
+    """Returns a key that is equal for commands that run the same way
+
+    Shell commands that use no shell features are split into the arguments
+    that the shell would run so that they match the same command in exec form.
+    Other shell commands are keyed by how the shell is started.
+    """
+    args = command
+    if isinstance(command, str):
+        args = None
+        if SHELL_SAFE_RE.fullmatch(command):
+            try:
+                args = shlex.split(command)
+            except ValueError:
+                pass
+        # Leading assignments set variables for the shell
+        if not args or "=" in args[0]:
+            args = ("/bin/sh", "-c", command)
+    key = (tuple(args), timeout, max_output)
+    return _command_keys.setdefault(key, key)
+
+
+def prune_interned(monitors):
+    """Keeps only the shared name lists and command keys that Monitors use
+
+    Otherwise entries for Monitors removed by reloads would be kept forever.
+    """
+    global _alert_lists, _command_keys
+    alert_lists = {}
+    command_keys = {}
+    for monitor in monitors:
+        for key in INTERNED_SETTINGS:
+            names = monitor.settings.get(key)
+            if names is not None:
+                alert_lists[names] = names
+        if monitor.command_key is not None:
+            command_keys[monitor.command_key] = monitor.command_key
+    _alert_lists = alert_lists
+    _command_keys = command_keys
+
+
+def dependency_groups(monitors):
+    """Returns the group of each Monitor name
+
+    Monitors linked by depends_on, directly or through other Monitors, share
+    a group named after the least of their names. Groups are kept together
+    when Monitors are split between workers or nodes. Unknown names are
+    ignored here and reported by validation.
+    """
+    groups = {monitor.name: monitor.name for monitor in monitors}
+
+    def find(name):
+        while groups[name] != name:
+            groups[name] = groups[groups[name]]
+            name = groups[name]
+        return name
+
+    for monitor in monitors:
+        for parent in monitor.settings.get("depends_on", ()):
+            if parent in groups:
+                a, b = find(monitor.name), find(parent)
+                groups[max(a, b)] = min(a, b)
+    return {name: find(name) for name in groups}
+
+
+def exit_on_sigterm():
+    """Exits through SystemExit on SIGTERM so that state is saved first"""
+
+    def handler(signum, frame):
+        raise SystemExit(128 + signum)
+
+    signal.signal(signal.SIGTERM, handler)
+
+
+def kill_process_group(pid):
+    """Kills a process group, ignoring it if it has already exited"""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+class OutputBuffer(object):
+    """Keeps only the last `limit` bytes of a command's output"""
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.truncated = 0
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer += data
+        if self.limit is not None and len(self._buffer) > self.limit:
+            drop = len(self._buffer) - self.limit
+            del self._buffer[:drop]
+            self.truncated += drop
+
+    def getvalue(self):
+        if not self.truncated:
+            return bytes(self._buffer)
+        marker = "[... {} bytes truncated ...]\n".format(self.truncated)
+        return marker.encode("utf-8") + self._buffer
+
+
+def _read_output(proc, output, timeout=None):
+    """Reads a process's stdout into output until it closes
+
+    Raises TimeoutExpired if it is still open after timeout seconds
+    """
+    deadline = None if timeout is None else monotonic() + timeout
+    fd = proc.stdout.fileno()
+    with selectors.DefaultSelector() as selector:
+        selector.register(fd, selectors.EVENT_READ)
+        while True:
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    raise TimeoutExpired(proc.args, timeout)
+            if not selector.select(remaining):
+                continue
+            chunk = os.read(fd, READ_SIZE)
+            if not chunk:
+                break
+            output.write(chunk)
+
+    if deadline is not None:
+        proc.wait(timeout=max(deadline - monotonic(), 0))
+    else:
+        proc.wait()
+
+
+def call_output(*popenargs, timeout=None, max_output=None, **kwargs):
+    """Similar to check_output, but instead returns output and exception
+
+    Output is read as it is written and only the last max_output bytes are
+    kept. If the command does not complete within timeout seconds, its entire
+    process group is killed and a TimeoutExpired is returned as the exception.
+    """
+    if spawn_helper is not None and len(popenargs) == 1 and set(kwargs) <= {"shell"}:
+        return spawn_helper.call_output(
+            popenargs[0],
+            shell=kwargs.get("shell", False),
+            timeout=timeout,
+            max_output=max_output,
+        )
+
     # So we can capture complete output, redirect sderr to stdout
     kwargs.setdefault("stderr", subprocess.STDOUT)
-    output, ex = None, None
-    try:
-        output = check_output(*popenargs, **kwargs)
-    except CalledProcessError as e:
-        output, ex = e.output, e
+    kwargs["stdout"] = subprocess.PIPE
+    if timeout is not None:
+        # Start a new session so children of shell commands can be killed too
+        kwargs["start_new_session"] = True
+
+    ex = None
+    buffer = OutputBuffer(max_output)
+    with subprocess.Popen(*popenargs, **kwargs) as proc:
+        try:
+            _read_output(proc, buffer, timeout=timeout)
+        except TimeoutExpired:
+            kill_process_group(proc.pid)
+            _read_output(proc, buffer)
+            ex = TimeoutExpired(proc.args, timeout, output=buffer.getvalue())
+        else:
+            if proc.returncode:
+                ex = CalledProcessError(
+                    proc.returncode, proc.args, output=buffer.getvalue()
+                )
 
-    output = output.rstrip(b"\n")
+    output = buffer.getvalue().rstrip(b"\n")
+    return output, ex
+
+
+class RateLimiter(object):
+    """Spaces events evenly so that they happen at most rate times a second
+
+    Safe to use from multiple threads and from an event loop. A rate of None
+    does not limit anything.
+    """
+
+    def __init__(self, rate=None, clock=monotonic):
+        self.rate = rate
+        self._clock = clock
+        self._next = 0.0
+        self._lock = Lock()
+
+    def reserve(self):
+        """Reserves the next free slot and returns seconds until it starts"""
+        if not self.rate:
+            return 0
+        with self._lock:
+            now = self._clock()
+            slot = max(self._next, now)
+            self._next = slot + 1 / self.rate
+        return slot - now
+
+    def acquire(self):
+        """Blocks until the next free slot"""
+        delay = self.reserve()
+        if delay > 0:
+            sleep(delay)
+
+    async def acquire_async(self):
+        """Waits on the event loop until the next free slot"""
+        import asyncio
+
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+# Limits how quickly check and alert commands are started by this process
+spawn_limiter = RateLimiter()
+# Starts commands from a separate small process when enabled
+spawn_helper = None
+
+
+def phase_offset(name):
+    """Returns a fraction of an interval that is fixed for each name
+
+    Used to spread the first checks of Monitors across their intervals.
+    """
+    digest = hashlib.blake2b(name.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2**64
+
+
+async def _read_output_async(proc, output):
+    """Reads an asyncio process's stdout into output until it exits"""
+    while True:
+        chunk = await proc.stdout.read(READ_SIZE)
+        if not chunk:
+            break
+        output.write(chunk)
+    await proc.wait()
+
+
+async def async_call_output(args, shell=False, timeout=None, max_output=None):
+    """Similar to call_output, but runs the command as an asyncio subprocess"""
+    import asyncio
+
+    if spawn_helper is not None:
+        return await asyncio.wrap_future(
+            spawn_helper.submit(
+                args, shell=shell, timeout=timeout, max_output=max_output
+            )
+        )
+
+    kwargs = {
+        "stdout": subprocess.PIPE,
+        "stderr": subprocess.STDOUT,
+        "start_new_session": timeout is not None,
+    }
+    if shell:
+        proc = await asyncio.create_subprocess_shell(args, **kwargs)
+    else:
+        proc = await asyncio.create_subprocess_exec(*args, **kwargs)
+
+    ex = None
+    buffer = OutputBuffer(max_output)
+    try:
+        await asyncio.wait_for(_read_output_async(proc, buffer), timeout)
+    except asyncio.TimeoutError:
+        kill_process_group(proc.pid)
+        await _read_output_async(proc, buffer)
+        ex = TimeoutExpired(args, timeout, output=buffer.getvalue())
+    else:
+        if proc.returncode:
+            ex = CalledProcessError(proc.returncode, args, output=buffer.getvalue())
+
+    output = buffer.getvalue().rstrip(b"\n")
     return output, ex
 
 
@@ -105,7 +515,50 @@ class MinitorAlert(Exception):
 class Monitor(object):
     """Primary configuration item for Minitor"""
 
-    def __init__(self, config, counter=None, logger=None):
+    # Monitors are kept small so that a single process can hold many of them
+    __slots__ = (
+        "settings",
+        "name",
+        "command",
+        "alert_down",
+        "alert_up",
+        "check_interval",
+        "min_interval",
+        "max_interval",
+        "interval",
+        "alert_after",
+        "alert_every",
+        "timeout",
+        "max_output",
+        "probe",
+        "command_key",
+        "parents",
+        "group",
+        "alert_count",
+        "last_check_time",
+        "last_duration",
+        "_last_output",
+        "last_status",
+        "last_success_time",
+        "total_failure_count",
+        "history",
+        "_check_counters",
+        "_duration",
+        "_logger",
+    )
+
+    # Attributes that track the results of checks rather than configuration
+    STATE_ATTRS = (
+        "interval",
+        "alert_count",
+        "last_check_time",
+        "_last_output",
+        "last_status",
+        "last_success_time",
+        "total_failure_count",
+    )
+
+    def __init__(self, config, counter=None, logger=None, duration_histogram=None):
         """Accepts a dictionary of configuration items to override defaults"""
         settings = {
             "alerts": ["log"],
@@ -116,46 +569,132 @@ class Monitor(object):
         settings.update(config)
         validate_monitor_settings(settings)
 
+        # Share name lists so that each Monitor does not hold its own copy
+        for key in INTERNED_SETTINGS:
+            if key in settings:
+                settings[key] = intern_alerts(settings[key])
+
+        self.settings = settings
         self.name = settings["name"]
-        self.command = settings["command"]
-        self.alert_down = settings.get("alert_down", [])
+        self.command = settings.get("command")
+        self.alert_down = settings.get("alert_down", ())
         if not self.alert_down:
-            self.alert_down = settings.get("alerts", [])
-        self.alert_up = settings.get("alert_up", [])
+            self.alert_down = settings.get("alerts", ())
+        self.alert_up = settings.get("alert_up", ())
         self.check_interval = settings.get("check_interval")
+        self.min_interval = settings.get("min_interval", self.check_interval)
+        self.max_interval = settings.get("max_interval", self.check_interval)
+        # Seconds between checks, adapted between min_interval and max_interval
+        self.interval = self.check_interval
         self.alert_after = settings.get("alert_after")
         self.alert_every = settings.get("alert_every")
+        self.timeout = settings.get("timeout")
+        self.max_output = settings.get("max_output", DEFAULT_MAX_OUTPUT)
+        try:
+            self.probe = build_probe(settings, timeout=self.timeout)
+        except ValueError as e:
+            raise InvalidMonitorException(
+                "Invalid probe for monitor {}: {}".format(self.name, e)
+            )
+        # Used to find Monitors that can share the results of their commands
+        self.command_key = None
+        if self.probe is None:
+            self.command_key = command_key(self.command, self.timeout, self.max_output)
+        # Monitors named in depends_on, linked once all Monitors are loaded
+        self.parents = ()
+        self.group = self.name
 
         self.alert_count = 0
-        self.last_check = None
+        # Times of the last check and success on the monotonic clock
+        self.last_check_time = None
+        self.last_duration = None
         self.last_output = None
-        self.last_success = None
+        self.last_status = None
+        self.last_success_time = None
         self.total_failure_count = 0
-
-        self._counter = counter
+        # Results of recent checks, if enabled
+        self.history = None
+        history_size = settings.get("history_size", 0)
+        if history_size:
+            self.history = ResultHistory(history_size)
+
+        # Bind labels once rather than resolving them on every check
+        self._check_counters = None
+        if counter is not None:
+            self._check_counters = {
+                (status, is_alert): counter.labels(
+                    monitor=self.name,
+                    status=status,
+                    is_alert=is_alert,
+                )
+                for status in (STATUS_SUCCESS, STATUS_FAILURE, STATUS_TIMEOUT)
+                for is_alert in (False, True)
+            }
+        self._duration = None
+        if duration_histogram is not None:
+            self._duration = duration_histogram.labels(monitor=self.name)
+        # All Monitors share one logger rather than registering one each
         if logger is None:
-            self._logger = logging.getLogger(
-                "{}({})".format(self.__class__.__name__, self.name)
-            )
+            self._logger = logging.getLogger(self.__class__.__name__)
         else:
-            self._logger = logger.getChild(
-                "{}({})".format(self.__class__.__name__, self.name)
-            )
-
-    def _count_check(self, is_success=True, is_alert=False):
-        if self._counter is not None:
-            self._counter.labels(
-                monitor=self.name,
-                status=("success" if is_success else "failure"),
-                is_alert=is_alert,
-            ).inc()
+            self._logger = logger.getChild(self.__class__.__name__)
+
+    @property
+    def last_output(self):
+        """Output from the last check, decoded when first accessed"""
+        if isinstance(self._last_output, bytes):
+            self._last_output = maybe_decode(self._last_output)
+        return self._last_output
+
+    @last_output.setter
+    def last_output(self, output):
+        self._last_output = output
+
+    @property
+    def last_check(self):
+        """Datetime of the last check"""
+        return monotonic_to_datetime(self.last_check_time)
+
+    @last_check.setter
+    def last_check(self, dt):
+        self.last_check_time = datetime_to_monotonic(dt)
+
+    @property
+    def last_success(self):
+        """Datetime of the last successful check"""
+        return monotonic_to_datetime(self.last_success_time)
+
+    @last_success.setter
+    def last_success(self, dt):
+        self.last_success_time = datetime_to_monotonic(dt)
+
+    def copy_state(self, other):
+        """Copies the state of checks from another Monitor"""
+        for attr in self.STATE_ATTRS:
+            setattr(self, attr, getattr(other, attr))
+        self.interval = self.clamp_interval(self.interval)
+        if self.history is not None and other.history is not None:
+            self.history.load(other.history.entries())
+
+    def clamp_interval(self, interval):
+        """Returns interval limited to this Monitor's min and max intervals"""
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def _count_check(self, status=STATUS_SUCCESS, is_alert=False):
+        if self._check_counters is not None:
+            self._check_counters[(status, is_alert)].inc()
+
+    def seconds_since_check(self):
+        """Returns seconds since the last check or NaN if never checked"""
+        if self.last_check_time is None:
+            return float("nan")
+        return monotonic() - self.last_check_time
 
     def should_check(self):
         """Determines if this Monitor should run it's check command"""
-        if not self.last_check:
+        if self.last_check_time is None:
             return True
-        since_last_check = (datetime.now() - self.last_check).total_seconds()
-        return since_last_check >= self.check_interval
+        return self.seconds_since_check() >= self.interval
 
     def check(self):
         """Returns None if skipped, False if failed, and True if successful
@@ -165,28 +704,94 @@ class Monitor(object):
         if not self.should_check():
             return None
 
-        output, ex = call_output(
-            self.command,
-            shell=isinstance(self.command, str),
-        )
-        output = maybe_decode(output)
-        self._logger.debug(output)
-        self.last_check = datetime.now()
+        output, ex = self.run_command()
+        return self.handle_result(output, ex)
+
+    def run_command(self):
+        """Runs the check command and returns the output and exception
+
+        This does not modify any state on the Monitor so that it is safe to
+        call from a worker thread. Only the duration of the check is recorded.
+        """
+        if self.probe is None:
+            spawn_limiter.acquire()
+        start = monotonic()
+        if self.probe is not None:
+            result = self.probe.run()
+        else:
+            result = call_output(
+                self.command,
+                shell=isinstance(self.command, str),
+                timeout=self.timeout,
+                max_output=self.max_output,
+            )
+        self._record_duration(monotonic() - start)
+        return result
+
+    async def run_command_async(self):
+        """Runs the check command without blocking the event loop"""
+        import asyncio
+
+        if self.probe is None:
+            await spawn_limiter.acquire_async()
+        start = monotonic()
+        if self.probe is not None:
+            # Probes use blocking sockets, so run them in the default executor
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(None, self.probe.run)
+        else:
+            result = await async_call_output(
+                self.command,
+                shell=isinstance(self.command, str),
+                timeout=self.timeout,
+                max_output=self.max_output,
+            )
+        self._record_duration(monotonic() - start)
+        return result
+
+    def _record_duration(self, duration):
+        self.last_duration = duration
+        if self._duration is not None:
+            self._duration.observe(duration)
+
+    def handle_result(self, output, ex):
+        """Updates state from the result of a check command
+
+        Returns False if failed and True if successful. Will raise an
+        exception if should alert
+        """
+        self.last_check_time = monotonic()
+        # Decoding is deferred until the output is actually used
         self.last_output = output
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._logger.debug("%s: %s", self.name, self.last_output)
+
+        if ex is None:
+            self.last_status = STATUS_SUCCESS
+        elif isinstance(ex, TimeoutExpired):
+            self._logger.debug("%s: Timed out after %ss", self.name, ex.timeout)
+            self.last_status = STATUS_TIMEOUT
+        else:
+            self.last_status = STATUS_FAILURE
+        if self.history is not None:
+            self.history.append(
+                self.last_check_time + _WALL_CLOCK_OFFSET,
+                self.last_status,
+                self.last_duration,
+                0 if ex is None else getattr(ex, "returncode", None),
+            )
 
-        is_success = None
+        is_success = ex is None
         try:
-            if ex is None:
-                is_success = True
+            if is_success:
                 self.success()
             else:
-                is_success = False
                 self.failure()
         except MinitorAlert:
-            self._count_check(is_success=is_success, is_alert=True)
+            self._count_check(status=self.last_status, is_alert=True)
             raise
 
-        self._count_check(is_success=is_success)
+        self._count_check(status=self.last_status)
         return is_success
 
     def success(self):
@@ -197,9 +802,14 @@ class Monitor(object):
                 "{} check is up again!".format(self.name),
                 self,
             )
+        if self.total_failure_count or self.interval < self.check_interval:
+            self.interval = self.check_interval
+        else:
+            # Check stable Monitors less often, up to max_interval
+            self.interval = min(self.interval * INTERVAL_GROWTH, self.max_interval)
         self.total_failure_count = 0
         self.alert_count = 0
-        self.last_success = datetime.now()
+        self.last_success_time = monotonic()
         if back_up:
             raise back_up
 
@@ -208,8 +818,14 @@ class Monitor(object):
         self.total_failure_count += 1
         # Ensure we've hit the  minimum number of failures to alert
         if self.total_failure_count < self.alert_after:
+            # Check again soon to confirm the failure
+            self.interval = self.min_interval
             return
 
+        # Once confirmed, failures are counted at the configured interval so
+        # that alert_every is not affected by min_interval
+        self.interval = self.check_interval
+
         failure_count = self.total_failure_count - self.alert_after
         if self.alert_every > 0:
             # Otherwise, we should check against our alert_every
@@ -233,16 +849,112 @@ class Monitor(object):
         """Indicates if the monitor is already alerting failures"""
         return self.alert_count == 0
 
+    def dependency_down(self):
+        """Returns a Monitor this depends on, directly or not, that is down
+
+        Returns None if all of them are up.
+        """
+        for parent in self.parents:
+            if not parent.is_up():
+                return parent
+            down = parent.dependency_down()
+            if down is not None:
+                return down
+        return None
+
 
 class Alert(object):
-    def __init__(self, name, config, counter=None, logger=None):
+    # Variables available to alert commands and how to get each one
+    TEMPLATE_FIELDS = {
+        "alert_count": lambda alert, message, monitor: monitor.alert_count,
+        "alert_message": lambda alert, message, monitor: message,
+        "failure_count": lambda alert, message, monitor: monitor.total_failure_count,
+        "last_output": lambda alert, message, monitor: monitor.last_output,
+        "last_status": lambda alert, message, monitor: monitor.last_status,
+        "last_success": lambda alert, message, monitor: alert._format_datetime(
+            monitor.last_success
+        ),
+        "monitor_count": lambda alert, message, monitor: 1,
+        "monitor_name": lambda alert, message, monitor: monitor.name,
+        "monitor_names": lambda alert, message, monitor: monitor.name,
+    }
+    # Values used to check that a command can be formatted when loaded
+    TEMPLATE_SAMPLE = {
+        "alert_count": 1,
+        "alert_message": "",
+        "failure_count": 1,
+        "last_output": "",
+        "last_status": STATUS_FAILURE,
+        "last_success": "Never",
+        "monitor_count": 1,
+        "monitor_name": "",
+        "monitor_names": "",
+    }
+    # Variables always kept for alerts that are coalesced
+    COALESCE_FIELDS = frozenset(("alert_message", "monitor_name"))
+
+    def __init__(
+        self, name, config, counter=None, logger=None, duration_histogram=None
+    ):
         """An alert must be named and have a config dict"""
+        self.config = config
         self.name = name
         self.command = config.get("command")
         if not self.command:
             raise InvalidAlertException("Invalid alert {}".format(self.name))
+        # Parsed once so that mistakes are found when the config is loaded
+        try:
+            self._template = CommandTemplate(self.command, self.TEMPLATE_FIELDS)
+            self._template.render(self.TEMPLATE_SAMPLE)
+        except (TypeError, ValueError) as e:
+            raise InvalidAlertException(
+                "Invalid command for alert {}: {}".format(self.name, e)
+            )
+        self._fields = self._template.fields | self.COALESCE_FIELDS
+        self.max_output = config.get("max_output", DEFAULT_MAX_OUTPUT)
+        if not is_valid_max_output(self.max_output):
+            raise InvalidAlertException(
+                "Invalid max_output for alert {}. Expected a positive int".format(
+                    self.name
+                )
+            )
+        self.timeout = config.get("timeout")
+        if not is_valid_timeout(self.timeout):
+            raise InvalidAlertException(
+                "Invalid timeout for alert {}. Expected a positive number".format(
+                    self.name
+                )
+            )
+        self.retries = config.get("retries", 0)
+        if isinstance(self.retries, bool) or not isinstance(self.retries, int):
+            raise InvalidAlertException(
+                "Invalid retries for alert {}. Expected an int".format(self.name)
+            )
+        self.coalesce_window = config.get("coalesce_window", 0)
+        if (
+            isinstance(self.coalesce_window, bool)
+            or not isinstance(self.coalesce_window, (int, float))
+            or self.coalesce_window < 0
+        ):
+            raise InvalidAlertException(
+                "Invalid coalesce_window for alert {}. Expected a number".format(
+                    self.name
+                )
+            )
+        self.retry_backoff = config.get("retry_backoff", 1)
+        if not isinstance(self.retry_backoff, (int, float)) or self.retry_backoff < 0:
+            raise InvalidAlertException(
+                "Invalid retry_backoff for alert {}. Expected a number".format(
+                    self.name
+                )
+            )
 
         self._counter = counter
+        # Counters bound to the labels for each Monitor this has alerted for
+        self._alert_counters = {}
+        self._duration = None
+        if duration_histogram is not None:
+            self._duration = duration_histogram.labels(alert=self.name)
         if logger is None:
             self._logger = logging.getLogger(
                 "{}({})".format(self.__class__.__name__, self.name)
@@ -252,22 +964,25 @@ class Alert(object):
                 "{}({})".format(self.__class__.__name__, self.name)
             )
 
+    def _record_duration(self, start):
+        if self._duration is not None:
+            self._duration.observe(monotonic() - start)
+
     def _count_alert(self, monitor):
         """Increments the alert counter"""
-        if self._counter is not None:
-            self._counter.labels(
+        if self._counter is None:
+            return
+        counter = self._alert_counters.get(monitor)
+        if counter is None:
+            counter = self._alert_counters[monitor] = self._counter.labels(
                 alert=self.name,
                 monitor=monitor,
-            ).inc()
+            )
+        counter.inc()
 
     def _formated_command(self, **kwargs):
         """Formats command array or string with kwargs from Monitor"""
-        if isinstance(self.command, str):
-            return self.command.format(**kwargs)
-        args = []
-        for arg in self.command:
-            args.append(arg.format(**kwargs))
-        return args
+        return self._template.render(kwargs)
 
     def _format_datetime(self, dt):
         """Formats a datetime for an alert"""
@@ -275,36 +990,486 @@ class Alert(object):
             return "Never"
         return dt.isoformat()
 
+    def _monitor_kwargs(self, message, monitor):
+        """Returns the template variables used by the command for a monitor"""
+        return {
+            field: self.TEMPLATE_FIELDS[field](self, message, monitor)
+            for field in self._fields
+        }
+
+    def _monitor_command(self, message, monitor):
+        """Returns the alert command formatted for the provided monitor"""
+        return self._formated_command(**self._monitor_kwargs(message, monitor))
+
+    def _coalesced_command(self, events):
+        """Returns the alert command formatted for many monitors at once
+
+        Monitor specific variables are taken from the most recent event.
+        """
+        names = list(dict.fromkeys(event["monitor_name"] for event in events))
+        kwargs = dict(events[-1])
+        kwargs.update(
+            alert_message="\n".join(event["alert_message"] for event in events),
+            monitor_count=len(names),
+            monitor_name=", ".join(names),
+            monitor_names=", ".join(names),
+        )
+        return self._formated_command(**kwargs)
+
+    def _handle_output(self, output, ex):
+        """Logs the output of an alert command and raises any exception"""
+        self._logger.error(maybe_decode(output))
+        if ex is not None:
+            raise ex
+
+    def _retry_delay(self, attempt, ex):
+        """Returns seconds to wait before retrying or None if out of retries"""
+        if attempt >= self.retries:
+            return None
+        delay = self.retry_backoff * 2**attempt
+        self._logger.warning("Alert failed, retrying in %ss: %s", delay, ex)
+        return delay
+
+    def send(self, command):
+        """Calls an already formatted alert command, retrying on failure"""
+        for attempt in count():
+            spawn_limiter.acquire()
+            start = monotonic()
+            output, ex = call_output(
+                command,
+                shell=isinstance(self.command, str),
+                timeout=self.timeout,
+                max_output=self.max_output,
+            )
+            self._record_duration(start)
+            delay = None if ex is None else self._retry_delay(attempt, ex)
+            if delay is None:
+                break
+            sleep(delay)
+        self._handle_output(output, ex)
+
+    async def send_async(self, command):
+        """Calls an already formatted alert command on the event loop"""
+        import asyncio
+
+        for attempt in count():
+            await spawn_limiter.acquire_async()
+            start = monotonic()
+            output, ex = await async_call_output(
+                command,
+                shell=isinstance(self.command, str),
+                timeout=self.timeout,
+                max_output=self.max_output,
+            )
+            self._record_duration(start)
+            delay = None if ex is None else self._retry_delay(attempt, ex)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+        self._handle_output(output, ex)
+
     def alert(self, message, monitor):
         """Calls the alert command for the provided monitor"""
         self._count_alert(monitor.name)
-        output, ex = call_output(
-            self._formated_command(
-                alert_count=monitor.alert_count,
-                alert_message=message,
-                failure_count=monitor.total_failure_count,
-                last_output=monitor.last_output,
-                last_success=self._format_datetime(monitor.last_success),
-                monitor_name=monitor.name,
+        self.send(self._monitor_command(message, monitor))
+
+    async def alert_async(self, message, monitor):
+        """Calls the alert command without blocking the event loop"""
+        self._count_alert(monitor.name)
+        await self.send_async(self._monitor_command(message, monitor))
+
+
+class AlertDispatcher(object):
+    """Delivers alerts from a bounded queue using dedicated worker threads
+
+    Alert commands are formatted when they are submitted so that they reflect
+    the state of the Monitor at the time of the alert.
+    """
+
+    def __init__(
+        self,
+        workers,
+        queue_size=DEFAULT_ALERT_QUEUE_SIZE,
+        logger=None,
+        latency_histogram=None,
+        failure_counter=None,
+    ):
+        self.workers = workers
+        self._queue = Queue(maxsize=queue_size)
+        self._threads = []
+        self._latency_histogram = latency_histogram
+        self._failure_counter = failure_counter
+        if logger is None:
+            self._logger = logging.getLogger(self.__class__.__name__)
+        else:
+            self._logger = logger.getChild(self.__class__.__name__)
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def start(self):
+        """Starts the worker threads"""
+        for i in range(self.workers - len(self._threads)):
+            thread = Thread(
+                target=self._work,
+                name="minitor-alert-{}".format(len(self._threads)),
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def join(self):
+        """Blocks until all queued alerts have been delivered or have failed"""
+        self._queue.join()
+
+    def submit(self, alert, message, monitor):
+        """Queues an alert for a monitor. Returns False if the queue is full"""
+        alert._count_alert(monitor.name)
+        return self.submit_command(alert, alert._monitor_command(message, monitor))
+
+    def submit_command(self, alert, command):
+        """Queues an already formatted alert command"""
+        try:
+            self._queue.put_nowait((alert, command, monotonic()))
+        except Full:
+            self._logger.error("Alert queue is full. Dropping %s", alert.name)
+            self._count_failure(alert, "dropped")
+            return False
+        return True
+
+    def _count_failure(self, alert, reason):
+        if self._failure_counter is not None:
+            self._failure_counter.labels(alert=alert.name, reason=reason).inc()
+
+    def _work(self):
+        while True:
+            alert, command, queued_at = self._queue.get()
+            try:
+                alert.send(command)
+            except (SubprocessError, OSError, ValueError) as ex:
+                self._logger.error("Alert %s failed: %s", alert.name, ex)
+                self._count_failure(alert, "error")
+            finally:
+                if self._latency_histogram is not None:
+                    self._latency_histogram.labels(alert=alert.name).observe(
+                        monotonic() - queued_at
+                    )
+                self._queue.task_done()
+
+
+class AlertCoalescer(object):
+    """Buffers alerts during a window so they are issued once for many monitors
+
+    The first alert for an Alert is issued immediately and opens a window
+    lasting the Alert's coalesce_window. Alerts that arrive during the window
+    are buffered and issued together as a single command when it closes.
+    """
+
+    def __init__(self, send_command):
+        self._send_command = send_command
+        self._lock = Lock()
+        # Buffered template variables by Alert name for each open window
+        self._pending = {}
+        self._timers = {}
+
+    def add(self, alert, message, monitor):
+        """Returns True if buffered or False if it should be issued now"""
+        with self._lock:
+            if alert.name not in self._pending:
+                self._open_window(alert)
+                return False
+            alert._count_alert(monitor.name)
+            self._pending[alert.name].append(alert._monitor_kwargs(message, monitor))
+            return True
+
+    def _open_window(self, alert):
+        self._pending[alert.name] = []
+        timer = Timer(alert.coalesce_window, self.flush, args=(alert,))
+        timer.daemon = True
+        self._timers[alert.name] = timer
+        timer.start()
+
+    def flush(self, alert):
+        """Issues any buffered alerts for an Alert"""
+        with self._lock:
+            timer = self._timers.pop(alert.name, None)
+            if timer is not None:
+                timer.cancel()
+            events = self._pending.pop(alert.name, [])
+            if events:
+                # Keep coalescing while alerts keep arriving
+                self._open_window(alert)
+
+        if events:
+            self._send_command(alert, alert._coalesced_command(events))
+
+
+class Scheduler(object):
+    """Orders Monitors by the deadline of their next check
+
+    Deadlines are kept on a monotonic clock so that they are not affected by
+    changes to the system time. Each deadline is computed from the previous
+    deadline rather than from when the check actually ran so that lateness
+    does not accumulate as drift.
+
+    Entries are replaced rather than removed from the heap when a Monitor is
+    rescheduled, and the old entry is skipped once it reaches the top.
+    """
+
+    def __init__(self, monitors=(), clock=monotonic, spread=False):
+        self._clock = clock
+        # Offset first checks by a phase fixed for each Monitor name
+        self.spread = spread
+        self._queue = []
+        # Current heap entry for each Monitor name
+        self._entries = {}
+        # Used to break ties between equal deadlines without comparing Monitors
+        self._counter = count()
+        # How late, in seconds, the most recent batch of checks was started
+        self.lag = 0.0
+
+        now = clock()
+        for monitor in monitors:
+            self.schedule(monitor, now + self._initial_delay(monitor))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def schedule(self, monitor, deadline, interval=None):
+        """Schedules a Monitor to be checked at the provided deadline
+
+        The interval is the one that the deadline was computed with, if any.
+        """
+        old_entry = self._entries.get(monitor.name)
+        if old_entry is not None:
+            old_entry[2] = None
+        entry = [deadline, next(self._counter), monitor, interval]
+        self._entries[monitor.name] = entry
+        heappush(self._queue, entry)
+
+    def reschedule(self, monitors):
+        """Moves the next checks of Monitors whose interval has changed
+
+        Called after checking Monitors returned by pop_due so that a new
+        interval applies from the check that caused it.
+        """
+        now = self._clock()
+        for monitor in monitors:
+            entry = self._entries.get(monitor.name)
+            if entry is None or entry[3] is None or entry[3] == monitor.interval:
+                continue
+            deadline = entry[0] - entry[3]
+            self.schedule(
+                monitor,
+                self._next_deadline(deadline, monitor.interval, now),
+                monitor.interval,
+            )
+
+    def check_now(self, monitors):
+        """Moves the next checks of Monitors to now"""
+        now = self._clock()
+        for monitor in monitors:
+            self.schedule(monitor, now)
+
+    def update(self, monitors):
+        """Replaces the scheduled Monitors, keeping existing deadlines by name"""
+        entries = self._entries
+        now = self._clock()
+        self._queue = []
+        self._entries = {}
+        for monitor in monitors:
+            entry = entries.get(monitor.name)
+            if entry is None:
+                self.schedule(monitor, now + self._initial_delay(monitor))
+            else:
+                self.schedule(monitor, entry[0], entry[3])
+
+    def _drop_replaced(self):
+        while self._queue and self._queue[0][2] is None:
+            heappop(self._queue)
+
+    def time_until_next(self):
+        """Returns seconds until the next check is due or None if empty"""
+        self._drop_replaced()
+        if not self._queue:
+            return None
+        return max(self._queue[0][0] - self._clock(), 0)
+
+    def pop_due(self):
+        """Returns all Monitors that are due and schedules their next check"""
+        now = self._clock()
+        due = []
+        self._drop_replaced()
+        while self._queue and self._queue[0][0] <= now:
+            deadline, _, monitor, _ = heappop(self._queue)
+            if not due:
+                self.lag = now - deadline
+            due.append(monitor)
+            self.schedule(
+                monitor,
+                self._next_deadline(deadline, monitor.interval, now),
+                monitor.interval,
+            )
+            self._drop_replaced()
+        return due
+
+    def _initial_delay(self, monitor):
+        """Returns seconds until the first check, resuming from any last_check"""
+        if monitor.last_check_time is None:
+            if self.spread:
+                return phase_offset(monitor.name) * monitor.interval
+            return 0
+        since_last_check = monitor.seconds_since_check()
+        return min(max(monitor.interval - since_last_check, 0), monitor.interval)
+
+    def _next_deadline(self, deadline, interval, now):
+        """Returns the next deadline after now that is in phase with the last"""
+        deadline += interval
+        if deadline <= now:
+            # Skip any missed deadlines rather than running them all at once
+            deadline += ((now - deadline) // interval + 1) * interval
+        return deadline
+
+
+class MinitorCollector(object):
+    """Collects metrics from the current state of Minitor when scraped
+
+    Nothing is recorded while checking, so the cost of these metrics does not
+    grow with the number of checks.
+    """
+
+    def __init__(self, minitor):
+        self._minitor = minitor
+
+    def describe(self):
+        return self._families()
+
+    def _families(self):
+        from prometheus_client.core import GaugeMetricFamily
+
+        return (
+            GaugeMetricFamily(
+                "minitor_monitor_up_count",
+                "Currently responsive monitors",
+                labels=["monitor"],
+            ),
+            GaugeMetricFamily(
+                "minitor_monitor_seconds_since_check",
+                "Seconds since the monitor was last checked",
+                labels=["monitor"],
+            ),
+            GaugeMetricFamily(
+                "minitor_monitor_failure_count",
+                "Number of consecutive failed checks for the monitor",
+                labels=["monitor"],
+            ),
+            GaugeMetricFamily(
+                "minitor_monitor_interval_seconds",
+                "Current interval between checks of the monitor",
+                labels=["monitor"],
+            ),
+            GaugeMetricFamily(
+                "minitor_monitor_dependency_down",
+                "Whether a monitor that the monitor depends on is down",
+                labels=["monitor"],
+            ),
+            GaugeMetricFamily(
+                "minitor_alert_queue_depth",
+                "Number of alerts waiting to be delivered",
             ),
-            shell=isinstance(self.command, str),
         )
-        self._logger.error(maybe_decode(output))
-        if ex is not None:
-            raise ex
+
+    def collect(self):
+        (
+            up,
+            since_check,
+            failures,
+            interval,
+            dependency_down,
+            queue_depth,
+        ) = self._families()
+        # Monitors owned by other nodes in a cluster are reported by those nodes
+        for monitor in self._minitor._owned_monitors():
+            labels = [monitor.name]
+            up.add_metric(labels, int(monitor.is_up()))
+            since_check.add_metric(labels, monitor.seconds_since_check())
+            failures.add_metric(labels, monitor.total_failure_count)
+            interval.add_metric(labels, monitor.interval)
+            dependency_down.add_metric(
+                labels, int(monitor.dependency_down() is not None)
+            )
+        dispatcher = self._minitor._alert_dispatcher
+        queue_depth.add_metric([], dispatcher.qsize() if dispatcher else 0)
+        return (up, since_check, failures, interval, dependency_down, queue_depth)
 
 
 class Minitor(object):
+    # Attributes loaded from the config file that are restored if a reload fails
+    CONFIG_ATTRS = (
+        "check_interval",
+        "max_concurrency",
+        "timeout",
+        "max_output",
+        "alert_workers",
+        "alert_queue_size",
+        "spread_checks",
+        "max_spawn_rate",
+        "history_size",
+        "monitors",
+        "alerts",
+    )
+
     monitors = None
     alerts = None
     state = None
+    config_path = None
+    watch_config = False
     check_interval = None
+    max_concurrency = DEFAULT_MAX_CONCURRENCY
+    timeout = None
+    max_output = DEFAULT_MAX_OUTPUT
+    alert_workers = 0
+    alert_queue_size = DEFAULT_ALERT_QUEUE_SIZE
+    spread_checks = True
+    max_spawn_rate = None
+    history_size = DEFAULT_HISTORY_SIZE
+    engine = ENGINE_THREAD
 
     def __init__(self):
         self._logger = logging.getLogger(self.__class__.__name__)
+        self._executor = None
+        self._alert_dispatcher = None
+        self._alert_failure_counter = None
+        self._alert_latency_histogram = None
+        self._alert_coalescer = AlertCoalescer(self._send_alert_command)
         self._alert_counter = None
         self._monitor_counter = None
-        self._monitor_status_gauge = None
+        self._scheduler_lag_gauge = None
+        self._check_duration_histogram = None
+        self._alert_duration_histogram = None
+        self._pass_duration_gauge = None
+        self._shared_check_counter = None
+        self._max_concurrency_arg = None
+        self._reload_requested = False
+        self._config_stat = None
+        self._wake_fd = None
+        self._wake_write_fd = None
+        self._state_store = None
+        self._config_cache = None
+        self._cluster = None
+        self._http_app = None
+        # Monitors that depend on each Monitor, directly or not, by name
+        self._dependents = {}
+        # Names of Monitors whose down alerts were held back by a dependency
+        self._suppressed = set()
+        # Alerts of dependent Monitors waiting for the rest of their batch
+        self._held_alerts = []
+        # Keys of commands used by more than one Monitor
+        self._shared_keys = set()
+        # The last result of each shared command, when it finished, and its duration
+        self._shared_results = {}
+        self._state_interval = DEFAULT_STATE_INTERVAL
+        self._last_state_save = None
 
     def _parse_args(self, args=None):
         """Parses command line arguments and returns them"""
@@ -331,6 +1496,109 @@ class Minitor(object):
             default=DEFAULT_METRICS_PORT,
             help="Port to use when serving metrics",
         )
+        parser.add_argument(
+            "--max-concurrency",
+            "-j",
+            dest="max_concurrency",
+            type=int,
+            default=None,
+            help=(
+                "Maximum number of checks to run in parallel. Overrides the "
+                "`max_concurrency` value from the config file"
+            ),
+        )
+        parser.add_argument(
+            "--engine",
+            "-e",
+            dest="engine",
+            choices=(ENGINE_THREAD, ENGINE_ASYNCIO),
+            default=ENGINE_THREAD,
+            help=(
+                "Engine used to run checks and alerts. `thread` uses a pool of "
+                "threads and `asyncio` uses a single event loop"
+            ),
+        )
+        parser.add_argument(
+            "--watch-config",
+            "-w",
+            dest="watch_config",
+            action="store_true",
+            help=(
+                "Reload the config file when it changes. It can also be reloaded "
+                "by sending SIGHUP"
+            ),
+        )
+        parser.add_argument(
+            "--state-file",
+            "-s",
+            dest="state_file",
+            default=None,
+            help=(
+                "Path to a file used to save the state of monitors so it can be "
+                "restored when Minitor restarts"
+            ),
+        )
+        parser.add_argument(
+            "--state-interval",
+            dest="state_interval",
+            type=float,
+            default=DEFAULT_STATE_INTERVAL,
+            help="Minimum seconds between saving the state of monitors",
+        )
+        parser.add_argument(
+            "--workers",
+            "-W",
+            dest="workers",
+            type=int,
+            default=0,
+            help=(
+                "Number of worker processes to split monitors between. By "
+                "default, all monitors are checked in a single process"
+            ),
+        )
+        parser.add_argument(
+            "--cluster-peers",
+            dest="cluster_peers",
+            default=None,
+            help=(
+                "Comma separated host:port metrics addresses of other Minitor "
+                "nodes to split monitors with. Requires --metrics"
+            ),
+        )
+        parser.add_argument(
+            "--cluster-node",
+            dest="cluster_node",
+            default=None,
+            help=(
+                "host:port address that peers use to reach this node's metrics "
+                "server. Defaults to this host's name and the metrics port"
+            ),
+        )
+        parser.add_argument(
+            "--cluster-interval",
+            dest="cluster_interval",
+            type=float,
+            default=None,
+            help="Seconds between heartbeats to cluster peers (default 2)",
+        )
+        parser.add_argument(
+            "--config-cache",
+            dest="config_cache",
+            default=None,
+            help=(
+                "Path to a file used to cache the parsed config so that it is "
+                "only parsed again when it or referenced env vars change"
+            ),
+        )
+        parser.add_argument(
+            "--spawn-helper",
+            dest="spawn_helper",
+            action="store_true",
+            help=(
+                "Start check and alert commands from a small helper process "
+                "rather than forking Minitor"
+            ),
+        )
         parser.add_argument(
             "--verbose",
             "-v",
@@ -340,17 +1608,116 @@ class Minitor(object):
                 "level is ERROR. Level increases with each `v`",
             ),
         )
-        return parser.parse_args(args)
+        args = parser.parse_args(args)
+        if args.max_concurrency is not None and args.max_concurrency <= 0:
+            parser.error("--max-concurrency must be a positive number")
+        if args.cluster_peers and not args.metrics:
+            parser.error("--cluster-peers requires --metrics")
+        if args.cluster_peers and args.workers:
+            parser.error("--cluster-peers cannot be used with --workers")
+        return args
+
+    def _read_config(self, config_path):
+        """Returns the config and the cache key to save it under if not cached"""
+        if self._config_cache is None:
+            return read_yaml(config_path), None
+
+        with open(config_path, "r") as f:
+            contents = f.read()
+        key = config_key(contents)
+        config = self._config_cache.load(key)
+        if config is not None:
+            self._logger.debug("Loaded config from cache")
+            return config, None
+        return load_yaml(contents), key
 
     def _setup(self, config_path):
         """Load all setup from YAML file at provided path"""
-        config = read_yaml(config_path)
+        config, cache_key = self._read_config(config_path)
         self.check_interval = config.get("check_interval", 30)
+        self.max_concurrency = config.get("max_concurrency", DEFAULT_MAX_CONCURRENCY)
+        if (
+            isinstance(self.max_concurrency, bool)
+            or not isinstance(self.max_concurrency, int)
+            or self.max_concurrency <= 0
+        ):
+            raise InvalidMonitorException(
+                "Invalid max_concurrency {}. Expected a positive int".format(
+                    self.max_concurrency
+                )
+            )
+        self.alert_workers = config.get("alert_workers", 0)
+        if (
+            isinstance(self.alert_workers, bool)
+            or not isinstance(self.alert_workers, int)
+            or self.alert_workers < 0
+        ):
+            raise InvalidMonitorException(
+                "Invalid alert_workers {}. Expected a non-negative int".format(
+                    self.alert_workers
+                )
+            )
+        self.alert_queue_size = config.get("alert_queue_size", DEFAULT_ALERT_QUEUE_SIZE)
+        if (
+            isinstance(self.alert_queue_size, bool)
+            or not isinstance(self.alert_queue_size, int)
+            or self.alert_queue_size <= 0
+        ):
+            raise InvalidMonitorException(
+                "Invalid alert_queue_size {}. Expected a positive int".format(
+                    self.alert_queue_size
+                )
+            )
+        self.spread_checks = config.get("spread_checks", True)
+        if not isinstance(self.spread_checks, bool):
+            raise InvalidMonitorException(
+                "Invalid spread_checks {}. Expected true or false".format(
+                    self.spread_checks
+                )
+            )
+        self.max_spawn_rate = config.get("max_spawn_rate")
+        if self.max_spawn_rate is not None and (
+            isinstance(self.max_spawn_rate, bool)
+            or not isinstance(self.max_spawn_rate, (int, float))
+            or self.max_spawn_rate <= 0
+        ):
+            raise InvalidMonitorException(
+                "Invalid max_spawn_rate {}. Expected a positive number".format(
+                    self.max_spawn_rate
+                )
+            )
+        self.timeout = config.get("timeout")
+        if not is_valid_timeout(self.timeout):
+            raise InvalidMonitorException(
+                "Invalid global timeout {}. Expected a positive number".format(
+                    self.timeout
+                )
+            )
+        self.max_output = config.get("max_output", DEFAULT_MAX_OUTPUT)
+        if not is_valid_max_output(self.max_output):
+            raise InvalidMonitorException(
+                "Invalid global max_output {}. Expected a positive int".format(
+                    self.max_output
+                )
+            )
+
+        self.history_size = config.get("history_size", DEFAULT_HISTORY_SIZE)
+        if not is_valid_history_size(self.history_size):
+            raise InvalidMonitorException(
+                "Invalid global history_size {}. Expected a non-negative int".format(
+                    self.history_size
+                )
+            )
+
+        # Global values are used as the defaults for monitors and alerts
+        alert_defaults = {"timeout": self.timeout, "max_output": self.max_output}
+        monitor_defaults = self._monitor_defaults()
         self.monitors = [
             Monitor(
-                mon,
+                dict(monitor_defaults, **mon),
                 counter=self._monitor_counter,
                 logger=self._logger,
+                duration_histogram=self._check_duration_histogram,
             )
             for mon in config.get("monitors", [])
         ]
@@ -367,24 +1734,145 @@ class Minitor(object):
             {
                 alert_name: Alert(
                     alert_name,
-                    alert,
+                    dict(alert_defaults, **alert),
                     counter=self._alert_counter,
                     logger=self._logger,
+                    duration_histogram=self._alert_duration_histogram,
                 )
                 for alert_name, alert in config.get("alerts", {}).items()
             }
         )
 
+        # Only cache config once Monitors and Alerts have validated it
+        if cache_key is not None:
+            self._config_cache.save(cache_key, config)
+
+    def _monitor_defaults(self):
+        """Returns the global values used as defaults for every Monitor"""
+        return {
+            "timeout": self.timeout,
+            "max_output": self.max_output,
+            "check_interval": self.check_interval,
+            "history_size": self.history_size,
+        }
+
+    def _reload(self):
+        """Reloads the config file, keeping unchanged Monitors and Alerts
+
+        Returns True if the new config was applied. If it is invalid, the
+        previous config is restored.
+        """
+        previous = {attr: getattr(self, attr) for attr in self.CONFIG_ATTRS}
+        try:
+            self._setup(self.config_path)
+            self._apply_args()
+            self._validate_monitors()
+        except Exception as e:
+            self._logger.error("Invalid config. Keeping previous config: %s", e)
+            for attr, value in previous.items():
+                setattr(self, attr, value)
+            prune_interned(self.monitors)
+            return False
+
+        self._apply_spawn_rate()
+
+        # Keep the existing objects for unchanged Alerts and Monitors
+        for name, alert in self.alerts.items():
+            previous_alert = previous["alerts"].get(name)
+            if previous_alert is not None and previous_alert.config == alert.config:
+                self.alerts[name] = previous_alert
+
+        previous_monitors = {monitor.name: monitor for monitor in previous["monitors"]}
+        added, changed = 0, 0
+        for i, monitor in enumerate(self.monitors):
+            previous_monitor = previous_monitors.pop(monitor.name, None)
+            if previous_monitor is None:
+                added += 1
+            elif previous_monitor.settings == monitor.settings:
+                self.monitors[i] = previous_monitor
+            else:
+                monitor.copy_state(previous_monitor)
+                changed += 1
+        self._link_dependencies()
+        self._find_shared_commands()
+        prune_interned(self.monitors)
+
+        if previous["max_concurrency"] != self.max_concurrency and self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+        self._logger.info(
+            "Reloaded config. %d added, %d changed, %d removed",
+            added,
+            changed,
+            len(previous_monitors),
+        )
+        return True
+
+    def _request_reload(self, *args):
+        """Signal handler that wakes the loop to reload the config"""
+        self._reload_requested = True
+        if self._wake_write_fd is not None:
+            try:
+                os.write(self._wake_write_fd, b"\0")
+            except BlockingIOError:
+                # A wake up is already pending
+                pass
+
+    def _stat_config(self):
+        """Returns values used to detect changes to the config file"""
+        try:
+            stat = os.stat(self.config_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _should_reload(self):
+        """Returns True if a reload was requested or the config file changed"""
+        should_reload, self._reload_requested = self._reload_requested, False
+        if self.watch_config:
+            config_stat = self._stat_config()
+            if config_stat is not None and config_stat != self._config_stat:
+                self._config_stat = config_stat
+                should_reload = True
+        return should_reload
+
+    def _init_reload(self):
+        """Reloads the config on SIGHUP and wakes the loop when requested"""
+        self._wake_fd, self._wake_write_fd = os.pipe()
+        os.set_blocking(self._wake_fd, False)
+        os.set_blocking(self._wake_write_fd, False)
+        self._config_stat = self._stat_config()
+        signal.signal(signal.SIGHUP, self._request_reload)
+
+    def _drain_wake(self):
+        try:
+            os.read(self._wake_fd, 512)
+        except BlockingIOError:
+            pass
+
+    def _wait(self, timeout):
+        """Sleeps until timeout or until a reload is requested"""
+        if self._wake_fd is None:
+            sleep(timeout)
+            return
+        ready, _, _ = select.select([self._wake_fd], [], [], timeout)
+        if ready:
+            self._drain_wake()
+
+    async def _wait_async(self, wake, timeout):
+        """Sleeps until timeout or until the wake event is set"""
+        import asyncio
+
+        try:
+            await asyncio.wait_for(wake.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        wake.clear()
+
     def _validate_monitors(self):
         """Validates monitors are valid against other config values"""
         for monitor in self.monitors:
-            # Validate that the interval is valid
-            if monitor.check_interval < self.check_interval:
-                raise InvalidMonitorException(
-                    "Monitor {} check interval is lower global value {}".format(
-                        monitor.name, self.check_interval
-                    )
-                )
             # Validate that the the alerts for the monitor exist
             for alert in chain(monitor.alert_down, monitor.alert_up):
                 if alert not in self.alerts:
@@ -394,7 +1882,87 @@ class Minitor(object):
                         )
                     )
 
+        names = {monitor.name for monitor in self.monitors}
+        for monitor in self.monitors:
+            for parent in monitor.settings.get("depends_on", ()):
+                if parent not in names:
+                    raise InvalidMonitorException(
+                        "Monitor {} depends on an unknown monitor: {}".format(
+                            monitor.name, parent
+                        )
+                    )
+        self._validate_no_cycles()
+        self._link_dependencies()
+        self._find_shared_commands()
+
+    def _validate_no_cycles(self):
+        """Raises if any Monitor depends on itself, directly or not"""
+        depends_on = {
+            monitor.name: monitor.settings.get("depends_on", ())
+            for monitor in self.monitors
+        }
+        # Names are visiting while on the current path and done once cleared
+        visiting, done = set(), set()
+
+        def visit(name, path):
+            if name in done:
+                return
+            if name in visiting:
+                cycle = path[path.index(name) :] + [name]
+                raise InvalidMonitorException(
+                    "Monitors depend on each other: {}".format(" -> ".join(cycle))
+                )
+            visiting.add(name)
+            for parent in depends_on[name]:
+                visit(parent, path + [name])
+            visiting.discard(name)
+            done.add(name)
+
+        for name in depends_on:
+            visit(name, [])
+
+    def _find_shared_commands(self):
+        """Finds commands that more than one Monitor runs"""
+        seen = set()
+        self._shared_keys = set()
+        for monitor in self.monitors:
+            key = monitor.command_key
+            if key is not None:
+                if key in seen:
+                    self._shared_keys.add(key)
+                seen.add(key)
+        self._shared_results = {
+            key: result
+            for key, result in self._shared_results.items()
+            if key in self._shared_keys
+        }
+
+    def _link_dependencies(self):
+        """Links each Monitor to the Monitors it depends on"""
+        monitors = {monitor.name: monitor for monitor in self.monitors}
+        groups = dependency_groups(self.monitors)
+        self._dependents = {}
+        for monitor in self.monitors:
+            monitor.parents = tuple(
+                monitors[parent] for parent in monitor.settings.get("depends_on", ())
+            )
+            monitor.group = groups[monitor.name]
+
+        def add_dependent(parent, child):
+            for grandparent in parent.parents:
+                add_dependent(grandparent, child)
+            self._dependents.setdefault(parent.name, set()).add(child)
+
+        for monitor in self.monitors:
+            for parent in monitor.parents:
+                add_dependent(parent, monitor)
+
     def _init_metrics(self):
+        # Only imported when metrics are enabled to keep startup fast
+        from prometheus_client import Counter
+        from prometheus_client import Gauge
+        from prometheus_client import Histogram
+
         self._alert_counter = Counter(
             "minitor_alert_total",
             "Number of Minitor alerts",
@@ -405,42 +1973,474 @@ class Minitor(object):
             "Number of Minitor checks",
             ["monitor", "status", "is_alert"],
         )
-        self._monitor_status_gauge = Gauge(
-            "minitor_monitor_up_count",
-            "Currently responsive monitors",
+        # Gauges set while checking are reported per process with --workers
+        self._scheduler_lag_gauge = Gauge(
+            "minitor_scheduler_lag_seconds",
+            "Seconds the most recent checks started after they were due",
+            multiprocess_mode="liveall",
+        )
+        self._alert_failure_counter = Counter(
+            "minitor_alert_failure_total",
+            "Number of Minitor alerts that failed or were dropped",
+            ["alert", "reason"],
+        )
+        self._alert_latency_histogram = Histogram(
+            "minitor_alert_delivery_seconds",
+            "Seconds from queueing an alert until it was delivered",
+            ["alert"],
+        )
+        self._check_duration_histogram = Histogram(
+            "minitor_check_duration_seconds",
+            "Seconds taken to run check commands",
             ["monitor"],
+            buckets=DURATION_BUCKETS,
+        )
+        self._alert_duration_histogram = Histogram(
+            "minitor_alert_duration_seconds",
+            "Seconds taken to run alert commands",
+            ["alert"],
+            buckets=DURATION_BUCKETS,
+        )
+        self._pass_duration_gauge = Gauge(
+            "minitor_pass_duration_seconds",
+            "Seconds taken to run the most recent batch of due checks",
+            multiprocess_mode="liveall",
         )
+        self._shared_check_counter = Counter(
+            "minitor_check_shared_total",
+            "Number of checks that used the result of an identical command "
+            "rather than running it",
+        )
+
+    def _serve_metrics(self, port, registry=None):
+        """Serves metrics from registry, or the default registry, on port"""
+        from prometheus_client import make_wsgi_app
+        from prometheus_client import REGISTRY
+
+        from minitor.server import RoutingApp
+        from minitor.server import start_server
+        from minitor.status import STATUS_PATH
+        from minitor.status import StatusApp
+
+        if registry is None:
+            registry = REGISTRY
+        # Metrics for the current Monitors are read from them when scraped
+        registry.register(MinitorCollector(self))
+        self._http_app = RoutingApp(make_wsgi_app(registry))
+        if self._cluster is not None:
+            from minitor.cluster import CLUSTER_PATH
+
+            self._http_app.add_route(CLUSTER_PATH, self._cluster.wsgi_app)
+        self._http_app.add_route(STATUS_PATH, StatusApp(self))
+        start_server(port, self._http_app)
 
     def _loop(self):
+        if self.engine == ENGINE_ASYNCIO:
+            import asyncio
+
+            asyncio.run(self._loop_async())
+            return
+
+        scheduler = Scheduler(self.monitors, spread=self.spread_checks)
+        while True:
+            self._wait(self._time_until_next(scheduler))
+            if self._should_reload() and self._reload():
+                scheduler.update(self.monitors)
+            due = self._pop_due(scheduler)
+            if due:
+                down = self._down_parents(due)
+                start = monotonic()
+                self._check(due)
+                self._track_pass(start)
+                scheduler.reschedule(due)
+                self._recheck_dependents(scheduler, down)
+            self._maybe_save_state()
+
+    async def _loop_async(self):
+        import asyncio
+
+        wake = asyncio.Event()
+        if self._wake_fd is not None:
+
+            def on_wake():
+                self._drain_wake()
+                wake.set()
+
+            asyncio.get_running_loop().add_reader(self._wake_fd, on_wake)
+
+        scheduler = Scheduler(self.monitors, spread=self.spread_checks)
         while True:
-            self._check()
-            sleep(self.check_interval)
+            await self._wait_async(wake, self._time_until_next(scheduler))
+            if self._should_reload() and self._reload():
+                scheduler.update(self.monitors)
+            due = self._pop_due(scheduler)
+            if due:
+                down = self._down_parents(due)
+                start = monotonic()
+                await self._check_async(due)
+                self._track_pass(start)
+                scheduler.reschedule(due)
+                self._recheck_dependents(scheduler, down)
+            self._maybe_save_state()
+
+    def _track_pass(self, start):
+        """Tracks how long a batch of checks took to complete"""
+        if self._pass_duration_gauge:
+            self._pass_duration_gauge.set(monotonic() - start)
+
+    def _maybe_save_state(self, force=False):
+        """Saves the state of monitors if the state interval has passed"""
+        if self._state_store is None:
+            return
+        now = monotonic()
+        if (
+            not force
+            and self._last_state_save is not None
+            and now - self._last_state_save < self._state_interval
+        ):
+            return
+        self._last_state_save = now
+        try:
+            self._state_store.save(self.monitors)
+        except OSError as e:
+            self._logger.error("Could not save state: %s", e)
+
+    def _time_until_next(self, scheduler):
+        """Returns how long to wait before the next Monitor is due"""
+        wait = scheduler.time_until_next()
+        if wait is None:
+            # Nothing is scheduled, so fall back to the global interval
+            wait = self.check_interval
+        if self.watch_config:
+            wait = min(wait, DEFAULT_WATCH_INTERVAL)
+        return wait
+
+    def _pop_due(self, scheduler):
+        """Returns all due Monitors from the scheduler and tracks its lag"""
+        due = scheduler.pop_due()
+        if due:
+            self._logger.debug("Scheduler lag: %.3fs", scheduler.lag)
+            if self._scheduler_lag_gauge:
+                self._scheduler_lag_gauge.set(scheduler.lag)
+        if due and self._cluster is not None:
+            # Monitors owned by other nodes are left to them
+            due = [monitor for monitor in due if self._is_owned(monitor)]
+        if due and self._dependents:
+            due = [monitor for monitor in due if not self._skip_dependent(monitor)]
+        return due
+
+    def _is_owned(self, monitor):
+        """Returns True if this node checks and reports a Monitor"""
+        cluster = self._cluster
+        return cluster is None or (cluster.ready and cluster.owns(monitor.group))
+
+    def _owned_monitors(self):
+        """Returns the Monitors that this node checks and reports"""
+        monitors = self.monitors or []
+        if self._cluster is None:
+            return monitors
+        return [monitor for monitor in monitors if self._is_owned(monitor)]
+
+    def _skip_dependent(self, monitor):
+        """Returns True if a Monitor is skipped because a dependency is down"""
+        parent = monitor.dependency_down()
+        if parent is None:
+            return False
+        self._logger.debug("%s: Skipped while %s is down", monitor.name, parent.name)
+        return True
+
+    def _down_parents(self, monitors):
+        """Returns the Monitors that others depend on and that are down"""
+        return [
+            monitor
+            for monitor in monitors
+            if monitor.name in self._dependents and not monitor.is_up()
+        ]
 
-    def _check(self):
-        """The main run loop"""
-        for monitor in self.monitors:
+    def _recheck_dependents(self, scheduler, parents):
+        """Checks the dependents of any parents that are back up right away"""
+        for parent in parents:
+            if parent.is_up():
+                scheduler.check_now(self._dependents[parent.name])
+
+    def _get_alert_dispatcher(self, alert):
+        """Returns a started dispatcher for an alert or None to issue it inline
+
+        Alerts that retry always use a dispatcher, with one worker if
+        alert_workers is not set, so that waiting to retry never holds up checks.
+        """
+        if self.alert_workers <= 0 and not alert.retries:
+            return None
+        workers = max(self.alert_workers, 1)
+        if self._alert_dispatcher is None:
+            self._alert_dispatcher = AlertDispatcher(
+                workers,
+                queue_size=self.alert_queue_size,
+                logger=self._logger,
+                latency_histogram=self._alert_latency_histogram,
+                failure_counter=self._alert_failure_counter,
+            )
+        self._alert_dispatcher.workers = max(self._alert_dispatcher.workers, workers)
+        self._alert_dispatcher.start()
+        return self._alert_dispatcher
+
+    def _get_executor(self):
+        """Returns a thread pool for running checks or None if serial"""
+        if self.max_concurrency <= 1:
+            return None
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_concurrency,
+                thread_name_prefix="minitor-check",
+            )
+        return self._executor
+
+    def _check(self, monitors=None):
+        """Runs checks for the provided Monitors or all that should be checked"""
+        if monitors is None:
+            monitors = [monitor for monitor in self.monitors if monitor.should_check()]
+
+        if self.engine == ENGINE_ASYNCIO:
+            import asyncio
+
+            asyncio.run(self._check_async(monitors))
+            return
+
+        runners, shared = self._share_results(monitors)
+        for monitor, result in shared:
+            self._handle_check(monitor, lambda: monitor.handle_result(*result))
+        executor = self._get_executor()
+        if executor is None:
+            for monitor, sharing in runners.items():
+                self._handle_shared_result(monitor, sharing, monitor.run_command())
+        else:
+            # Only the commands are run in the pool. Results are handled here,
+            # on the calling thread, so that Monitor state, alerts, and metrics
+            # are never updated concurrently.
+            futures = {
+                executor.submit(monitor.run_command): monitor for monitor in runners
+            }
+            for future in as_completed(futures):
+                monitor = futures[future]
+                self._handle_shared_result(monitor, runners[monitor], future.result())
+
+        for minitor_alert in self._release_held_alerts():
+            self._handle_minitor_alert(minitor_alert)
+
+    def _share_results(self, monitors):
+        """Splits Monitors by whether they need to run their commands
+
+        Returns a dict of the Monitors that should run their commands, each
+        with a list of other due Monitors that will share its result. Also
+        returns a list of Monitors and the results they can use right away,
+        from commands that another Monitor ran within their interval.
+        """
+        runners = {}
+        shared = []
+        if not self._shared_keys:
+            for monitor in monitors:
+                runners[monitor] = []
+            return runners, shared
+
+        now = monotonic()
+        running = {}
+        saved = 0
+        for monitor in monitors:
+            key = monitor.command_key
+            if key not in self._shared_keys:
+                runners[monitor] = []
+                continue
+            runner = running.get(key)
+            if runner is not None:
+                runners[runner].append(monitor)
+                saved += 1
+                continue
+            finished, result, duration = self._shared_results.get(
+                key, (None, None, None)
+            )
+            if finished is not None and now - finished < monitor.interval:
+                monitor.last_duration = duration
+                shared.append((monitor, result))
+                saved += 1
+                continue
+            running[key] = monitor
+            runners[monitor] = []
+
+        if saved:
+            self._logger.debug("Shared results with %d checks", saved)
+            if self._shared_check_counter is not None:
+                self._shared_check_counter.inc(saved)
+        return runners, shared
+
+    def _save_shared_result(self, runner, result):
+        """Keeps the result of a command that other Monitors also run"""
+        if runner.command_key in self._shared_keys:
+            self._shared_results[runner.command_key] = (
+                monotonic(),
+                result,
+                runner.last_duration,
+            )
+
+    def _handle_shared_result(self, runner, sharing, result):
+        """Handles the result of a command for every Monitor sharing it"""
+        self._save_shared_result(runner, result)
+        for monitor in sharing:
+            monitor.last_duration = runner.last_duration
+        for monitor in chain((runner,), sharing):
+            self._handle_check(monitor, lambda: monitor.handle_result(*result))
+
+    async def _check_async(self, monitors=None):
+        """Runs checks concurrently on the event loop"""
+        import asyncio
+
+        if monitors is None:
+            monitors = [monitor for monitor in self.monitors if monitor.should_check()]
+
+        semaphore = asyncio.Semaphore(max(self.max_concurrency, 1))
+        runners, shared = self._share_results(monitors)
+
+        async def handle(monitor, result):
             try:
-                result = monitor.check()
-                if result is not None:
-                    self._logger.info(
-                        "%s: %s", monitor.name, "SUCCESS" if result else "FAILURE"
-                    )
+                self._log_result(monitor, monitor.handle_result(*result))
             except MinitorAlert as minitor_alert:
                 self._logger.warning(minitor_alert)
+                if self._hold_alert(minitor_alert):
+                    return
+                if not self._suppress_alert(minitor_alert):
+                    await self._handle_minitor_alert_async(minitor_alert)
+
+        async def check(runner):
+            async with semaphore:
+                result = await runner.run_command_async()
+            self._save_shared_result(runner, result)
+            for monitor in runners[runner]:
+                monitor.last_duration = runner.last_duration
+            for monitor in chain((runner,), runners[runner]):
+                await handle(monitor, result)
+
+        for monitor, result in shared:
+            await handle(monitor, result)
+        await asyncio.gather(*(check(runner) for runner in runners))
+
+        for minitor_alert in self._release_held_alerts():
+            await self._handle_minitor_alert_async(minitor_alert)
+
+    def _handle_check(self, monitor, check):
+        """Calls the provided check for a monitor and handles the result"""
+        try:
+            self._log_result(monitor, check())
+        except MinitorAlert as minitor_alert:
+            self._logger.warning(minitor_alert)
+            if self._hold_alert(minitor_alert):
+                return
+            if not self._suppress_alert(minitor_alert):
                 self._handle_minitor_alert(minitor_alert)
 
-            # Track the status of the Monitor
-            if self._monitor_status_gauge:
-                self._monitor_status_gauge.labels(
-                    monitor=monitor.name,
-                ).set(int(monitor.is_up()))
+    def _hold_alert(self, minitor_alert):
+        """Holds the alert of a Monitor with dependencies until its batch ends
 
-    def _handle_minitor_alert(self, minitor_alert):
-        """Issues all alerts for a provided monitor"""
+        Results within a batch are handled in the order checks finish, so a
+        dependency's result may not have been handled yet. Returns True if held.
+        """
+        if not minitor_alert.monitor.parents:
+            return False
+        self._held_alerts.append(minitor_alert)
+        return True
+
+    def _release_held_alerts(self):
+        """Returns held alerts that should be issued once a batch has ended"""
+        held, self._held_alerts = self._held_alerts, []
+        return [
+            minitor_alert
+            for minitor_alert in held
+            if not self._suppress_alert(minitor_alert)
+        ]
+
+    def _suppress_alert(self, minitor_alert):
+        """Returns True if alerts should be held back for a dependency
+
+        Down alerts are held back while a Monitor's dependency is down, and so
+        is the up alert that follows them.
+        """
+        monitor = minitor_alert.monitor
+        if monitor.is_up():
+            if monitor.name in self._suppressed:
+                self._suppressed.discard(monitor.name)
+                self._logger.info("%s: Suppressed up alert", monitor.name)
+                return True
+            return False
+
+        parent = monitor.dependency_down()
+        if parent is None:
+            self._suppressed.discard(monitor.name)
+            return False
+        self._suppressed.add(monitor.name)
+        self._logger.info(
+            "%s: Suppressed alert while %s is down", monitor.name, parent.name
+        )
+        return True
+
+    def _log_result(self, monitor, result):
+        """Logs the result of a check if it was not skipped"""
+        if result is not None:
+            self._logger.info("%s: %s", monitor.name, monitor.last_status.upper())
+
+    def _alerts_for(self, minitor_alert):
+        """Returns the Alerts that should be issued for a MinitorAlert"""
         monitor = minitor_alert.monitor
         alerts = monitor.alert_up if monitor.is_up() else monitor.alert_down
-        for alert in alerts:
-            self.alerts[alert].alert(str(minitor_alert), monitor)
+        return [self.alerts[alert] for alert in alerts]
+
+    def _handle_minitor_alert(self, minitor_alert):
+        """Issues all alerts for a provided monitor"""
+        message, monitor = str(minitor_alert), minitor_alert.monitor
+        for alert in self._alerts_for(minitor_alert):
+            if alert.coalesce_window and self._alert_coalescer.add(
+                alert, message, monitor
+            ):
+                continue
+            dispatcher = self._get_alert_dispatcher(alert)
+            if dispatcher is not None:
+                dispatcher.submit(alert, message, monitor)
+                continue
+            try:
+                alert.alert(message, monitor)
+            except (SubprocessError, OSError, ValueError) as ex:
+                self._handle_alert_failure(alert, ex)
+
+    async def _handle_minitor_alert_async(self, minitor_alert):
+        """Issues all alerts for a provided monitor on the event loop"""
+        message, monitor = str(minitor_alert), minitor_alert.monitor
+        for alert in self._alerts_for(minitor_alert):
+            if alert.coalesce_window and self._alert_coalescer.add(
+                alert, message, monitor
+            ):
+                continue
+            dispatcher = self._get_alert_dispatcher(alert)
+            if dispatcher is not None:
+                dispatcher.submit(alert, message, monitor)
+                continue
+            try:
+                await alert.alert_async(message, monitor)
+            except (SubprocessError, OSError, ValueError) as ex:
+                self._handle_alert_failure(alert, ex)
+
+    def _send_alert_command(self, alert, command):
+        """Issues an already formatted alert command, such as a coalesced one"""
+        dispatcher = self._get_alert_dispatcher(alert)
+        if dispatcher is not None:
+            dispatcher.submit_command(alert, command)
+            return
+        try:
+            alert.send(command)
+        except (SubprocessError, OSError, ValueError) as ex:
+            self._handle_alert_failure(alert, ex)
+
+    def _handle_alert_failure(self, alert, ex):
+        """Logs a failed alert so that remaining alerts are still issued"""
+        self._logger.error("Alert %s failed: %s", alert.name, ex)
+        if self._alert_failure_counter is not None:
+            self._alert_failure_counter.labels(alert=alert.name, reason="error").inc()
 
     def _set_log_level(self, verbose):
         """Sets the log level for the class using the provided verbose count"""
@@ -455,17 +2455,89 @@ class Minitor(object):
         """Runs Minitor in a loop"""
         args = self._parse_args(args)
 
+        if args.workers:
+            from minitor.workers import Coordinator
+
+            Coordinator(self, args).run()
+            return
+
+        exit_on_sigterm()
+        self._start(args)
+        try:
+            self._loop()
+        finally:
+            self._maybe_save_state(force=True)
+
+    def _start(self, args, serve_metrics=True):
+        """Sets up from parsed command line arguments before looping"""
         if args.verbose:
             self._set_log_level(args.verbose)
 
+        # Started first, while this process is as small as it will be
+        if args.spawn_helper:
+            self._start_spawn_helper()
+
+        if args.cluster_peers:
+            self._init_cluster(args)
+
         if args.metrics:
             self._init_metrics()
-            start_http_server(args.metrics_port)
-
-        self._setup(args.config_path)
+            if serve_metrics:
+                self._serve_metrics(args.metrics_port)
+
+        if args.config_cache:
+            self._config_cache = ConfigCache(args.config_cache, logger=self._logger)
+
+        self.config_path = args.config_path
+        self.watch_config = args.watch_config
+        self._max_concurrency_arg = args.max_concurrency
+        self._setup(self.config_path)
+        self._apply_args()
+        self.engine = args.engine
         self._validate_monitors()
+        self._apply_spawn_rate()
+        self._init_reload()
+
+        if args.state_file:
+            self._state_interval = args.state_interval
+            self._state_store = StateStore(args.state_file, logger=self._logger)
+            restored = self._state_store.restore(self.monitors)
+            self._logger.info("Restored state for %d monitors", restored)
+
+    def _start_spawn_helper(self):
+        """Starts a helper process that starts commands for this process"""
+        global spawn_helper
+        from minitor.spawn_helper import SpawnHelper
+
+        spawn_helper = SpawnHelper(logger=self._logger)
+        spawn_helper.start()
+
+    def _init_cluster(self, args):
+        """Joins a cluster that splits Monitors between nodes"""
+        from minitor.cluster import Cluster
+
+        node = args.cluster_node or "{}:{}".format(
+            socket.gethostname(), args.metrics_port
+        )
+        kwargs = {}
+        if args.cluster_interval is not None:
+            kwargs["interval"] = args.cluster_interval
+        self._cluster = Cluster(
+            node,
+            [peer.strip() for peer in args.cluster_peers.split(",") if peer.strip()],
+            logger=self._logger,
+            **kwargs
+        )
+        self._cluster.start()
+
+    def _apply_spawn_rate(self):
+        """Limits how quickly commands are started to the configured rate"""
+        spawn_limiter.rate = self.max_spawn_rate
 
-        self._loop()
+    def _apply_args(self):
+        """Applies command line arguments that override the config file"""
+        if self._max_concurrency_arg is not None:
+            self.max_concurrency = self._max_concurrency_arg
 
 
 def main(args=None):
@@ -0,0 +1,401 @@
+"""Checks that run inside the Minitor process rather than as a command
+
+Probes return the same output and exception pair as `call_output` so that
+their results can be handled by a Monitor in the same way as a command.
+"""
+import os
+import select
+import signal
+import socket
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from subprocess import TimeoutExpired
+from threading import Lock
+from time import monotonic
+from urllib.parse import urlsplit
+from weakref import WeakValueDictionary
+
+
+# Connection errors that may be caused by the server closing an idle
+# keep-alive connection. Requests failing with these, or with an
+# HTTPException, are retried once.
+STALE_CONNECTION_ERRORS = (
+    BrokenPipeError,
+    ConnectionResetError,
+    ConnectionAbortedError,
+)
+
+# Used to resolve names since getaddrinfo does not support timeouts
+_resolver = None
+# Seconds to wait for a co-process to answer when no timeout is set
+DEFAULT_PERSISTENT_TIMEOUT = 30
+READ_SIZE = 32 * 1024
+# Longest reply line accepted from a co-process, in bytes
+MAX_REPLY_SIZE = 64 * 1024
+# Running co-processes by command, shared by every probe that uses them
+_coprocesses = WeakValueDictionary()
+
+
+class ProbeFailure(Exception):
+    """Raised when a probe runs but the result is unsuccessful"""
+
+    pass
+
+
+class Probe(object):
+    """Base class for in process checks"""
+
+    probe_type = None
+
+    def __init__(self, settings, timeout=None):
+        if not isinstance(settings, dict):
+            raise ValueError(
+                "Expected {} settings to be a mapping".format(self.probe_type)
+            )
+        self.timeout = timeout
+
+    def __str__(self):
+        return "{}({})".format(self.probe_type, self.target)
+
+    @property
+    def target(self):
+        raise NotImplementedError()
+
+    def probe(self):
+        """Runs the probe and returns a summary. Raises on failure"""
+        raise NotImplementedError()
+
+    def run(self):
+        """Runs the probe and returns output and exception like `call_output`"""
+        start = monotonic()
+        ex = None
+        try:
+            summary = self.probe()
+        except socket.timeout:
+            summary = "{} timed out".format(self.target)
+            ex = TimeoutExpired(str(self), self.timeout, output=summary)
+        except (OSError, ProbeFailure) as e:
+            summary = "{} failed: {}".format(self.target, str(e) or type(e).__name__)
+            ex = ProbeFailure(summary)
+
+        summary = "{} in {:.3f}s".format(summary, monotonic() - start)
+        return summary.encode("utf-8"), ex
+
+
+class HttpProbe(Probe):
+    """Makes an HTTP request and checks the response status
+
+    The connection is kept open between checks so that it can be reused.
+    """
+
+    probe_type = "http"
+
+    def __init__(self, settings, timeout=None):
+        super().__init__(settings, timeout=timeout)
+        self.url = settings.get("url")
+        if not self.url:
+            raise ValueError("Expected a url for http probe")
+        parts = urlsplit(self.url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError("Invalid url for http probe: {}".format(self.url))
+
+        self.method = settings.get("method", "GET")
+        self.expect_status = settings.get("expect_status")
+        if isinstance(self.expect_status, int):
+            self.expect_status = [self.expect_status]
+        if self.expect_status is not None and not all(
+            isinstance(status, int) for status in self.expect_status
+        ):
+            raise ValueError("Expected integer values for expect_status")
+
+        # Imported here since http.client also imports ssl, which is slow
+        from http.client import HTTPConnection
+        from http.client import HTTPSConnection
+
+        self._connection_class = (
+            HTTPSConnection if parts.scheme == "https" else HTTPConnection
+        )
+        self._netloc = parts.netloc
+        self._path = parts.path or "/"
+        if parts.query:
+            self._path += "?" + parts.query
+        self._connection = None
+
+    @property
+    def target(self):
+        return self.url
+
+    def _get_connection(self):
+        if self._connection is None:
+            self._connection = self._connection_class(
+                self._netloc,
+                timeout=self.timeout,
+            )
+        return self._connection
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _request(self):
+        connection = self._get_connection()
+        try:
+            connection.request(self.method, self._path)
+            response = connection.getresponse()
+            # Drain the body so that the connection can be reused
+            response.read()
+        except Exception:
+            self.close()
+            raise
+
+        if response.will_close:
+            self.close()
+        return response
+
+    def _is_expected(self, status):
+        if self.expect_status is None:
+            return status < 400
+        return status in self.expect_status
+
+    def probe(self):
+        from http.client import HTTPException
+
+        reused = self._connection is not None
+        try:
+            try:
+                response = self._request()
+            except STALE_CONNECTION_ERRORS + (HTTPException,):
+                if not reused:
+                    raise
+                # The server may have closed the idle connection, so try again
+                response = self._request()
+        except HTTPException as e:
+            raise ProbeFailure(str(e) or type(e).__name__)
+
+        summary = "HTTP {} {} from {}".format(
+            response.status, response.reason, self.url
+        )
+        if not self._is_expected(response.status):
+            raise ProbeFailure(summary)
+        return summary
+
+
+class TcpProbe(Probe):
+    """Checks that a TCP connection can be established"""
+
+    probe_type = "tcp"
+
+    def __init__(self, settings, timeout=None):
+        super().__init__(settings, timeout=timeout)
+        self.host = settings.get("host")
+        self.port = settings.get("port")
+        if not self.host:
+            raise ValueError("Expected a host for tcp probe")
+        if not isinstance(self.port, int) or not 0 < self.port < 65536:
+            raise ValueError("Invalid port for tcp probe: {}".format(self.port))
+
+    @property
+    def target(self):
+        return "{}:{}".format(self.host, self.port)
+
+    def probe(self):
+        with socket.create_connection((self.host, self.port), timeout=self.timeout):
+            pass
+        return "Connected to {}".format(self.target)
+
+
+class DnsProbe(Probe):
+    """Checks that a name can be resolved"""
+
+    probe_type = "dns"
+
+    def __init__(self, settings, timeout=None):
+        super().__init__(settings, timeout=timeout)
+        self.name = settings.get("name")
+        if not self.name:
+            raise ValueError("Expected a name for dns probe")
+
+    @property
+    def target(self):
+        return self.name
+
+    def _resolve(self):
+        global _resolver
+        if _resolver is None:
+            _resolver = ThreadPoolExecutor(thread_name_prefix="minitor-dns")
+        future = _resolver.submit(socket.getaddrinfo, self.name, None)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise socket.timeout()
+
+    def probe(self):
+        addresses = sorted({info[4][0] for info in self._resolve()})
+        return "Resolved {} to {}".format(self.name, ", ".join(addresses))
+
+
+class Coprocess(object):
+    """A command that is kept running to answer check requests
+
+    Each request is written to the command's stdin as a line. The command
+    answers each one with a line on stdout that starts with an exit status,
+    where 0 is a success, followed by any output. Lines are limited to
+    MAX_REPLY_SIZE bytes. Requests are sent one at a time. If the command
+    exits or takes too long to answer, it is killed and started again for
+    the next request.
+    """
+
+    def __init__(self, command):
+        self.command = command
+        # Number of times the command has been started
+        self.starts = 0
+        self._lock = Lock()
+        self._proc = None
+        self._buffer = b""
+
+    def __del__(self):
+        self.stop()
+
+    def _start(self):
+        self._proc = subprocess.Popen(
+            self.command,
+            shell=isinstance(self.command, str),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            # Allows killing any children along with the command
+            start_new_session=True,
+        )
+        self._buffer = b""
+        self.starts += 1
+
+    def stop(self):
+        """Kills the command if running and returns its exit code"""
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return None
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        proc.stdin.close()
+        proc.stdout.close()
+        return proc.wait()
+
+    def _read_line(self, timeout):
+        deadline = monotonic() + timeout
+        fd = self._proc.stdout.fileno()
+        while b"\n" not in self._buffer:
+            remaining = deadline - monotonic()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                raise TimeoutExpired(self.command, timeout)
+            data = os.read(fd, READ_SIZE)
+            if not data:
+                raise EOFError()
+            self._buffer += data
+            if len(self._buffer) > MAX_REPLY_SIZE and b"\n" not in self._buffer:
+                raise ProbeFailure(
+                    "Invalid co-process response: longer than {} bytes".format(
+                        MAX_REPLY_SIZE
+                    )
+                )
+        line, _, self._buffer = self._buffer.partition(b"\n")
+        return line
+
+    def request(self, request, timeout):
+        """Sends a request and returns output and exception like `call_output`"""
+        with self._lock:
+            try:
+                if self._proc is None or self._proc.poll() is not None:
+                    self.stop()
+                    self._start()
+                self._proc.stdin.write(request.encode("utf-8") + b"\n")
+                self._proc.stdin.flush()
+                line = self._read_line(timeout)
+            except TimeoutExpired as e:
+                self.stop()
+                return b"", e
+            except ProbeFailure as e:
+                # The rest of the reply can't be told apart from the next one
+                self.stop()
+                return str(e).encode("utf-8"), e
+            except (OSError, EOFError, ValueError) as e:
+                returncode = self.stop()
+                summary = "Co-process failed: {}".format(
+                    "exited with {}".format(returncode)
+                    if returncode is not None
+                    else str(e) or type(e).__name__
+                )
+                return summary.encode("utf-8"), ProbeFailure(summary)
+
+        status, _, output = line.partition(b" ")
+        try:
+            status = int(status)
+        except ValueError:
+            summary = "Invalid co-process response: {!r}".format(line)
+            return summary.encode("utf-8"), ProbeFailure(summary)
+        if status != 0:
+            return output, ProbeFailure("Check failed with status {}".format(status))
+        return output, None
+
+
+def get_coprocess(command):
+    """Returns the running Coprocess for a command, shared between callers"""
+    key = command if isinstance(command, str) else tuple(command)
+    coprocess = _coprocesses.get(key)
+    if coprocess is None:
+        coprocess = _coprocesses[key] = Coprocess(command)
+    return coprocess
+
+
+class PersistentProbe(Probe):
+    """Sends a request to a command that is kept running between checks
+
+    This avoids starting a new process, and any interpreter it runs, for
+    every check. Probes with the same command share one Coprocess.
+    """
+
+    probe_type = "persistent"
+
+    def __init__(self, settings, timeout=None):
+        super().__init__(settings, timeout=timeout)
+        self.command = settings.get("command")
+        if not self.command or not isinstance(self.command, (str, list)):
+            raise ValueError("Expected a command for persistent probe")
+        self.command = (
+            self.command
+            if isinstance(self.command, str)
+            else [str(arg) for arg in self.command]
+        )
+        self.request = settings.get("request", "")
+        if not isinstance(self.request, str) or "\n" in self.request:
+            raise ValueError("Expected a single line request for persistent probe")
+        self.coprocess = get_coprocess(self.command)
+
+    @property
+    def target(self):
+        if isinstance(self.command, str):
+            return self.command
+        return " ".join(self.command)
+
+    def run(self):
+        timeout = self.timeout or DEFAULT_PERSISTENT_TIMEOUT
+        return self.coprocess.request(self.request, timeout)
+
+
+PROBE_TYPES = {
+    probe_class.probe_type: probe_class
+    for probe_class in (HttpProbe, TcpProbe, DnsProbe, PersistentProbe)
+}
+
+
+def build_probe(settings, timeout=None):
+    """Returns a Probe for the first probe type in settings or None
+
+    Raises ValueError if the probe settings are invalid
+    """
+    for probe_type, probe_class in PROBE_TYPES.items():
+        if settings.get(probe_type) is not None:
+            return probe_class(settings[probe_type], timeout=timeout)
+    return None
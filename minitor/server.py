@@ -0,0 +1,49 @@
+"""HTTP server for metrics and other endpoints that Minitor serves"""
+from socketserver import ThreadingMixIn
+from threading import Thread
+from wsgiref.simple_server import make_server
+from wsgiref.simple_server import WSGIRequestHandler
+from wsgiref.simple_server import WSGIServer
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    """Handles each request in its own thread"""
+
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    """Does not log every request"""
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RoutingApp(object):
+    """WSGI app that dispatches on the first segment of the request path
+
+    Requests that do not match a route are handled by the default app.
+    """
+
+    def __init__(self, default_app):
+        self.default_app = default_app
+        self.routes = {}
+
+    def add_route(self, path, app):
+        """Handles requests for path, and anything below it, with app"""
+        self.routes[path] = app
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        route = "/" + path.lstrip("/").split("/", 1)[0]
+        app = self.routes.get(route, self.default_app)
+        return app(environ, start_response)
+
+
+def start_server(port, app, addr="0.0.0.0"):
+    """Serves app on port from a background thread and returns the server"""
+    server = make_server(
+        addr, port, app, server_class=ThreadingWSGIServer, handler_class=QuietHandler
+    )
+    Thread(target=server.serve_forever, name="minitor-http", daemon=True).start()
+    return server
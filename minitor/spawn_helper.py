@@ -0,0 +1,178 @@
+"""Starts commands from a small helper process on behalf of Minitor
+
+Starting a command forks the process that starts it. Once Minitor holds many
+Monitors, that can cost more than the command itself on small hosts. The
+helper is started while Minitor is still small and runs commands sent to it
+over a pipe, returning the same output and exception as `call_output`.
+
+Run as `python -m minitor.spawn_helper` to serve requests on stdin and stdout.
+"""
+import logging
+import pickle
+import signal
+import struct
+import subprocess
+import sys
+from concurrent.futures import Future
+from itertools import count
+from subprocess import SubprocessError
+from threading import Lock
+from threading import Thread
+
+
+HEADER = struct.Struct("!I")
+
+
+def write_frame(stream, obj):
+    """Writes obj to stream prefixed with its length"""
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    stream.write(HEADER.pack(len(data)) + data)
+    stream.flush()
+
+
+def read_frame(stream):
+    """Returns the next obj written by write_frame or None if closed"""
+    header = stream.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    (size,) = HEADER.unpack(header)
+    data = stream.read(size)
+    if len(data) < size:
+        return None
+    return pickle.loads(data)
+
+
+class SpawnHelper(object):
+    """Sends commands to a helper process to run
+
+    Requests are tagged with an id so that any number can run at once. If the
+    helper exits, waiting requests fail and it is started again for the next
+    request.
+    """
+
+    def __init__(self, logger=None):
+        self._lock = Lock()
+        self._ids = count()
+        # Waiting requests by id, along with the process running them
+        self._pending = {}
+        self._proc = None
+        if logger is None:
+            self._logger = logging.getLogger(self.__class__.__name__)
+        else:
+            self._logger = logger.getChild(self.__class__.__name__)
+
+    def start(self):
+        """Starts the helper process"""
+        self._proc = subprocess.Popen(
+            [sys.executable, "-m", "minitor.spawn_helper"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        Thread(
+            target=self._read,
+            args=(self._proc,),
+            name="minitor-spawn-helper",
+            daemon=True,
+        ).start()
+        self._logger.debug("Started spawn helper with pid %d", self._proc.pid)
+
+    def stop(self):
+        """Stops the helper process, which exits once its stdin is closed"""
+        with self._lock:
+            proc, self._proc = self._proc, None
+        if proc is not None:
+            proc.stdin.close()
+            proc.wait()
+
+    def submit(self, args, shell=False, timeout=None, max_output=None):
+        """Runs a command in the helper and returns a Future of its result"""
+        future = Future()
+        with self._lock:
+            if self._proc is None or self._proc.poll() is not None:
+                self._logger.warning("Starting spawn helper")
+                self.start()
+            request_id = next(self._ids)
+            self._pending[request_id] = (self._proc, future)
+            try:
+                write_frame(
+                    self._proc.stdin, (request_id, args, shell, timeout, max_output)
+                )
+            except (OSError, ValueError) as e:
+                del self._pending[request_id]
+                future.set_result((b"", OSError("Spawn helper failed: {}".format(e))))
+        return future
+
+    def call_output(self, args, shell=False, timeout=None, max_output=None):
+        """Runs a command in the helper and returns its output and exception"""
+        return self.submit(
+            args, shell=shell, timeout=timeout, max_output=max_output
+        ).result()
+
+    def _read(self, proc):
+        """Resolves requests as their results are returned"""
+        while True:
+            try:
+                response = read_frame(proc.stdout)
+            except (OSError, ValueError, pickle.UnpicklingError):
+                response = None
+            if response is None:
+                break
+            request_id, result, error = response
+            with self._lock:
+                _, future = self._pending.pop(request_id, (None, None))
+            if future is None:
+                continue
+            if error is not None:
+                # Raised just as it would be when starting the command here
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        # Fail anything still waiting on this process
+        with self._lock:
+            if self._proc is proc:
+                self._proc = None
+            lost = [
+                request_id
+                for request_id, (request_proc, _) in self._pending.items()
+                if request_proc is proc
+            ]
+            futures = [self._pending.pop(request_id)[1] for request_id in lost]
+        for future in futures:
+            future.set_result((b"", OSError("Spawn helper exited")))
+
+
+def serve(requests, responses):
+    """Runs each request from requests in its own thread until closed"""
+    # Imported here so that only the helper process needs it
+    from minitor.main import call_output
+
+    lock = Lock()
+
+    def run(request_id, args, shell, timeout, max_output):
+        result, error = None, None
+        try:
+            # Commands must not read requests meant for the helper
+            result = call_output(
+                args,
+                shell=shell,
+                timeout=timeout,
+                max_output=max_output,
+                stdin=subprocess.DEVNULL,
+            )
+        except (OSError, ValueError, SubprocessError) as e:
+            error = e
+        with lock:
+            write_frame(responses, (request_id, result, error))
+
+    while True:
+        request = read_frame(requests)
+        if request is None:
+            break
+        Thread(target=run, args=request, daemon=True).start()
+
+
+if __name__ == "__main__":
+    # Minitor stops the helper by closing its stdin, so ignore interrupts
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    serve(sys.stdin.buffer, sys.stdout.buffer)
@@ -0,0 +1,146 @@
+"""Persists the state of Monitors between runs of Minitor"""
+import json
+import logging
+import os
+from datetime import datetime
+
+
+STATE_VERSION = 1
+# Maximum number of characters of the last output to keep for each Monitor
+STATE_MAX_OUTPUT = 1024
+
+
+def _dump_datetime(dt):
+    return None if dt is None else dt.isoformat()
+
+
+def _load_datetime(value):
+    return None if value is None else datetime.fromisoformat(value)
+
+
+def dump_monitor_state(monitor, max_output=STATE_MAX_OUTPUT):
+    """Returns the state of a Monitor as a dict that can be encoded as JSON
+
+    The last output is truncated to max_output characters unless it is None
+    """
+    last_output = monitor.last_output
+    if (
+        max_output is not None
+        and last_output is not None
+        and len(last_output) > max_output
+    ):
+        last_output = last_output[-max_output:]
+    state = {
+        "alert_count": monitor.alert_count,
+        "last_check": _dump_datetime(monitor.last_check),
+        "last_duration": monitor.last_duration,
+        "last_output": last_output,
+        "last_status": monitor.last_status,
+        "last_success": _dump_datetime(monitor.last_success),
+        "total_failure_count": monitor.total_failure_count,
+        "interval": monitor.interval,
+    }
+    if monitor.history is not None:
+        state["history"] = monitor.history.entries()
+    return state
+
+
+def load_monitor_state(monitor, state):
+    """Restores the state of a Monitor from a dict made by dump_monitor_state"""
+    monitor.alert_count = state["alert_count"]
+    monitor.last_check = _load_datetime(state["last_check"])
+    # Not saved by older versions
+    monitor.last_duration = state.get("last_duration")
+    monitor.last_output = state["last_output"]
+    monitor.last_status = state["last_status"]
+    monitor.last_success = _load_datetime(state["last_success"])
+    monitor.total_failure_count = state["total_failure_count"]
+    # Not saved by older versions, and limits may have changed since saved
+    monitor.interval = monitor.clamp_interval(
+        state.get("interval", monitor.check_interval)
+    )
+    if monitor.history is not None and "history" in state:
+        monitor.history.load([tuple(entry) for entry in state["history"]])
+
+
+class StateStore(object):
+    """Saves snapshots of Monitor state to a file and restores them
+
+    Snapshots are written to a temporary file and renamed over the previous
+    snapshot so that a crash never leaves a partial file. The encoded state of
+    each Monitor is cached and only re-encoded after it has been checked again.
+    """
+
+    def __init__(self, path, max_output=STATE_MAX_OUTPUT, logger=None):
+        self.path = path
+        self.max_output = max_output
+        # Encoded state by Monitor name along with the last_check it encodes
+        self._entries = {}
+        if logger is None:
+            self._logger = logging.getLogger(self.__class__.__name__)
+        else:
+            self._logger = logger.getChild(self.__class__.__name__)
+
+    def load(self):
+        """Returns saved states by Monitor name"""
+        try:
+            with open(self.path, "r") as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            self._logger.error("Could not read state from %s: %s", self.path, e)
+            return {}
+
+        if snapshot.get("version") != STATE_VERSION:
+            self._logger.warning("Ignoring state with unknown version")
+            return {}
+        return snapshot.get("monitors", {})
+
+    def restore(self, monitors):
+        """Restores saved state to Monitors. Returns the number restored"""
+        states = self.load()
+        restored = 0
+        for monitor in monitors:
+            state = states.get(monitor.name)
+            if state is None:
+                continue
+            try:
+                load_monitor_state(monitor, state)
+            except (KeyError, TypeError, ValueError) as e:
+                self._logger.error("Invalid state for %s: %s", monitor.name, e)
+                continue
+            restored += 1
+        return restored
+
+    def save(self, monitors):
+        """Writes a snapshot if any Monitor changed. Returns True if written"""
+        changed = False
+        entries = {}
+        for monitor in monitors:
+            entry = self._entries.get(monitor.name)
+            if entry is None or entry[0] != monitor.last_check_time:
+                entry = (
+                    monitor.last_check_time,
+                    json.dumps(dump_monitor_state(monitor, self.max_output)),
+                )
+                changed = True
+            entries[monitor.name] = entry
+
+        if not changed and entries.keys() == self._entries.keys():
+            return False
+
+        contents = '{{"version": {}, "monitors": {{{}}}}}'.format(
+            STATE_VERSION,
+            ", ".join(
+                "{}: {}".format(json.dumps(name), encoded)
+                for name, (_, encoded) in entries.items()
+            ),
+        )
+        tmp_path = "{}.tmp".format(self.path)
+        with open(tmp_path, "w") as f:
+            f.write(contents)
+        os.replace(tmp_path, self.path)
+
+        self._entries = entries
+        return True
@@ -0,0 +1,132 @@
+"""Serves the state and recent results of Monitors as JSON"""
+import json
+from datetime import datetime
+from threading import Lock
+
+
+STATUS_PATH = "/status"
+
+
+def _dump_timestamp(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat()
+
+
+def _dump_datetime(dt):
+    return None if dt is None else dt.isoformat()
+
+
+def monitor_status(monitor, detail=False):
+    """Returns the state of a Monitor as a dict that can be encoded as JSON
+
+    With detail, the last output and recent results are included as well.
+    """
+    dependency = monitor.dependency_down()
+    status = {
+        "name": monitor.name,
+        "up": monitor.is_up(),
+        "last_status": monitor.last_status,
+        "last_check": _dump_datetime(monitor.last_check),
+        "last_success": _dump_datetime(monitor.last_success),
+        "last_duration": monitor.last_duration,
+        "alert_count": monitor.alert_count,
+        "total_failure_count": monitor.total_failure_count,
+        "interval": monitor.interval,
+        "dependency_down": None if dependency is None else dependency.name,
+    }
+    if detail:
+        status["last_output"] = monitor.last_output
+        status["history"] = [
+            {
+                "time": _dump_timestamp(timestamp),
+                "status": result_status,
+                "duration": duration,
+                "exit_code": exit_code,
+            }
+            for timestamp, result_status, duration, exit_code in (
+                monitor.history.entries() if monitor.history is not None else ()
+            )
+        ]
+    return status
+
+
+class StatusApp(object):
+    """WSGI app for /status and /status/<monitor>
+
+    Responses are encoded once and cached until a Monitor is checked, the
+    config is reloaded, or cluster nodes change, so polling them adds little
+    work for Minitor. Only Monitors that this node owns are included.
+    """
+
+    def __init__(self, minitor):
+        self.minitor = minitor
+        self._lock = Lock()
+        # The Monitors and check times that the cached responses were made from
+        self._monitors = None
+        self._checked = None
+        self._nodes = None
+        self._by_name = {}
+        self._index = None
+        self._details = {}
+
+    def _refresh(self):
+        """Drops cached responses if any Monitor has changed"""
+        monitors = self.minitor.monitors or []
+        checked = sum(monitor.last_check_time or 0 for monitor in monitors)
+        cluster = self.minitor._cluster
+        nodes = None if cluster is None else cluster.nodes
+        if (
+            monitors is self._monitors
+            and checked == self._checked
+            and nodes == self._nodes
+        ):
+            return
+        self._monitors = monitors
+        self._checked = checked
+        self._nodes = nodes
+        self._by_name = {
+            monitor.name: monitor for monitor in self.minitor._owned_monitors()
+        }
+        self._index = None
+        self._details = {}
+
+    def index(self):
+        """Returns the encoded state of all Monitors"""
+        with self._lock:
+            self._refresh()
+            if self._index is None:
+                self._index = json.dumps(
+                    {"monitors": [monitor_status(m) for m in self._by_name.values()]}
+                ).encode("utf-8")
+            return self._index
+
+    def detail(self, name):
+        """Returns the encoded state of a Monitor or None if there is none"""
+        with self._lock:
+            self._refresh()
+            body = self._details.get(name)
+            if body is None:
+                monitor = self._by_name.get(name)
+                if monitor is None:
+                    return None
+                body = json.dumps(monitor_status(monitor, detail=True)).encode("utf-8")
+                self._details[name] = body
+            return body
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")[len(STATUS_PATH) :].strip("/")
+        if not path:
+            body, code = self.index(), "200 OK"
+        else:
+            # WSGI servers pass the path as bytes decoded with latin-1
+            name = path.encode("latin-1").decode("utf-8", errors="replace")
+            body, code = self.detail(name), "200 OK"
+            if body is None:
+                body = json.dumps({"error": "Unknown monitor {}".format(name)}).encode(
+                    "utf-8"
+                )
+                code = "404 Not Found"
+        start_response(
+            code,
+            [("Content-Type", "application/json"), ("Content-Length", str(len(body)))],
+        )
+        return [body]
@@ -0,0 +1,233 @@
+"""Alert command templates that are parsed once when config is loaded"""
+import re
+import shlex
+from string import Formatter
+
+
+_formatter = Formatter()
+# Characters that keep their meaning inside double quotes in a shell
+DOUBLE_QUOTED_SPECIAL_RE = re.compile(r'([\\"$`])')
+
+QUOTE_NONE = None
+QUOTE_SINGLE = "'"
+QUOTE_DOUBLE = '"'
+# Shell contexts that fields are escaped for. The contents of command
+# substitutions and subshells are parsed like a separate command.
+CONTEXT_SUBSTITUTION = "$("
+CONTEXT_SUBSHELL = "("
+# Shell contexts that fields can't be escaped for, with how to describe them
+CONTEXT_BACKTICK = "`"
+CONTEXT_ARITHMETIC = "$(("
+CONTEXT_ANSI_C = "$'"
+CONTEXT_COMMENT = "#"
+CONTEXT_HEREDOC = "<<"
+UNSAFE_CONTEXTS = {
+    CONTEXT_BACKTICK: "inside backticks",
+    CONTEXT_ARITHMETIC: "inside $((...))",
+    CONTEXT_ANSI_C: "inside $'...'",
+    CONTEXT_COMMENT: "in a comment",
+    CONTEXT_HEREDOC: "after a here-document",
+}
+# Unquoted characters that end a word, so a following # starts a comment
+WORD_BREAKS = frozenset(" \t\n;&|()<>")
+
+
+class ShellScanner(object):
+    """Follows the shell syntax of a command to find the context of each field
+
+    Only as much of the shell grammar is followed as is needed to escape
+    values: quotes, command substitutions, and subshells. Contexts that a
+    value can't be escaped for are recognized so that fields in them can be
+    rejected.
+    """
+
+    def __init__(self):
+        self.contexts = []
+        # Whether the last character was an unquoted backslash
+        self.escaped = False
+        self.word_start = True
+
+    @property
+    def quoting(self):
+        """Returns the shell quoting in effect at the current point"""
+        if self.contexts and self.contexts[-1] in (QUOTE_SINGLE, QUOTE_DOUBLE):
+            return self.contexts[-1]
+        return QUOTE_NONE
+
+    def unsafe_context(self):
+        """Returns a description of why a value can't be escaped here or None"""
+        if self.escaped:
+            return "right after a backslash"
+        for context in self.contexts:
+            if context in UNSAFE_CONTEXTS:
+                return UNSAFE_CONTEXTS[context]
+        return None
+
+    def field(self):
+        """Moves past a value substituted at the current point"""
+        self.word_start = False
+
+    def feed(self, text):
+        """Moves past literal text of the command"""
+        contexts = self.contexts
+        i = 0
+        while i < len(text):
+            char = text[i]
+            top = contexts[-1] if contexts else None
+            word_start, self.word_start = self.word_start, False
+            if self.escaped:
+                self.escaped = False
+            elif top == QUOTE_SINGLE:
+                if char == "'":
+                    contexts.pop()
+            elif top == CONTEXT_COMMENT:
+                if char == "\n":
+                    contexts.pop()
+                    self.word_start = True
+            elif top == CONTEXT_HEREDOC:
+                # The rest of the command is not followed past a here-document
+                pass
+            elif char == "\\":
+                self.escaped = True
+            elif top == CONTEXT_ANSI_C:
+                if char == "'":
+                    contexts.pop()
+            elif top == QUOTE_DOUBLE and char == '"':
+                contexts.pop()
+            elif top == CONTEXT_BACKTICK and char == "`":
+                contexts.pop()
+            elif text.startswith(CONTEXT_ARITHMETIC, i):
+                contexts.append(CONTEXT_ARITHMETIC)
+                i += 2
+            elif text.startswith(CONTEXT_SUBSTITUTION, i):
+                contexts.append(CONTEXT_SUBSTITUTION)
+                self.word_start = True
+                i += 1
+            elif char == "`":
+                contexts.append(CONTEXT_BACKTICK)
+                self.word_start = True
+            elif top == QUOTE_DOUBLE:
+                pass
+            elif text.startswith(CONTEXT_ANSI_C, i):
+                contexts.append(CONTEXT_ANSI_C)
+                i += 1
+            elif char in (QUOTE_SINGLE, QUOTE_DOUBLE):
+                contexts.append(char)
+            elif text.startswith(CONTEXT_HEREDOC, i):
+                contexts.append(CONTEXT_HEREDOC)
+            elif char == "#" and word_start:
+                contexts.append(CONTEXT_COMMENT)
+            elif char == "(":
+                contexts.append(CONTEXT_SUBSHELL)
+                self.word_start = True
+            elif char == ")" and top in (CONTEXT_SUBSTITUTION, CONTEXT_SUBSHELL):
+                contexts.pop()
+                self.word_start = True
+            elif char == ")" and top == CONTEXT_ARITHMETIC:
+                contexts.pop()
+                if text.startswith(")", i + 1):
+                    i += 1
+                self.word_start = True
+            elif char in WORD_BREAKS:
+                self.word_start = True
+            i += 1
+
+
+def shell_escape(value, state=QUOTE_NONE):
+    """Escapes value to be used literally at a point in a shell command
+
+    The escaping depends on whether that point is inside single quotes,
+    double quotes, or neither.
+    """
+    if state == QUOTE_SINGLE:
+        return value.replace("'", "'\"'\"'")
+    if state == QUOTE_DOUBLE:
+        return DOUBLE_QUOTED_SPECIAL_RE.sub(r"\\\1", value)
+    return shlex.quote(value)
+
+
+class Template(object):
+    """A format string parsed into literal text and the fields it references
+
+    Fields may only be plain names from the provided set, optionally with a
+    conversion and format spec. When shell is True, substituted values are
+    escaped so that the shell sees them as literal text, and fields where
+    that isn't possible are rejected.
+    """
+
+    def __init__(self, source, fields, shell=False):
+        self.source = source
+        self.shell = shell
+        self._parts = []
+        names = set()
+        scanner = ShellScanner() if shell else None
+        try:
+            parsed = list(_formatter.parse(source))
+        except ValueError as e:
+            raise ValueError("Invalid template {!r}: {}".format(source, e))
+        for literal, name, spec, conversion in parsed:
+            state = QUOTE_NONE
+            if scanner is not None:
+                scanner.feed(literal)
+                state = scanner.quoting
+            if name is None:
+                self._parts.append((literal, None, None, None, None))
+                continue
+            if name not in fields:
+                raise ValueError(
+                    "Unknown field {{{}}} in template {!r}. Expected one of: {}".format(
+                        name, source, ", ".join(sorted(fields))
+                    )
+                )
+            if "{" in spec:
+                raise ValueError(
+                    "Nested fields are not supported in template {!r}".format(source)
+                )
+            if scanner is not None:
+                unsafe = scanner.unsafe_context()
+                if unsafe is not None:
+                    raise ValueError(
+                        "Field {{{}}} can't be escaped {} in template {!r}".format(
+                            name, unsafe, source
+                        )
+                    )
+                scanner.field()
+            names.add(name)
+            self._parts.append((literal, name, spec, conversion, state))
+        self.fields = frozenset(names)
+
+    def render(self, values):
+        """Returns the template with values substituted for its fields"""
+        pieces = []
+        for literal, name, spec, conversion, state in self._parts:
+            pieces.append(literal)
+            if name is None:
+                continue
+            value = values[name]
+            if conversion:
+                value = _formatter.convert_field(value, conversion)
+            value = format(value, spec)
+            if self.shell:
+                value = shell_escape(value, state)
+            pieces.append(value)
+        return "".join(pieces)
+
+
+class CommandTemplate(object):
+    """An alert command in exec or shell form with a Template for each part"""
+
+    def __init__(self, command, fields):
+        self.shell = isinstance(command, str)
+        if self.shell:
+            self._templates = [Template(command, fields, shell=True)]
+        else:
+            self._templates = [Template(str(arg), fields) for arg in command]
+        self.fields = frozenset().union(
+            *(template.fields for template in self._templates)
+        )
+
+    def render(self, values):
+        """Returns the command with values substituted"""
+        if self.shell:
+            return self._templates[0].render(values)
+        return [template.render(values) for template in self._templates]
@@ -0,0 +1,286 @@
+"""Splits Monitors between worker processes
+
+A coordinator process starts a worker process for each shard of Monitors.
+Workers run checks and send the results to the coordinator, which issues all
+alerts, saves state, and serves metrics merged from every process.
+"""
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+import zlib
+from argparse import Namespace
+from queue import Empty
+
+from minitor.main import DEFAULT_WATCH_INTERVAL
+from minitor.main import dependency_groups
+from minitor.main import exit_on_sigterm
+from minitor.main import Minitor
+from minitor.main import MinitorAlert
+from minitor.main import spawn_limiter
+from minitor.state import dump_monitor_state
+from minitor.state import load_monitor_state
+
+
+# Seconds the coordinator waits for results before checking on its workers
+POLL_INTERVAL = 1
+# Seconds to wait for a worker to exit when stopping
+STOP_TIMEOUT = 5
+
+EVENT_ALERT = "alert"
+EVENT_STATE = "state"
+
+
+def shard_for(name, shards):
+    """Returns the shard for a Monitor name that is stable between processes"""
+    return zlib.crc32(name.encode("utf-8")) % shards
+
+
+class ShardStateReporter(object):
+    """Sends the state of checked Monitors to the coordinator
+
+    Used by workers in place of a StateStore so that the coordinator always
+    has the state needed to restart a worker.
+    """
+
+    def __init__(self, events):
+        self._events = events
+        # The last_check_time of each Monitor when its state was last sent
+        self._sent = {}
+
+    def save(self, monitors):
+        """Sends the state of Monitors checked since the last call"""
+        states = {}
+        for monitor in monitors:
+            if self._sent.get(monitor.name) != monitor.last_check_time:
+                self._sent[monitor.name] = monitor.last_check_time
+                states[monitor.name] = dump_monitor_state(monitor)
+        if not states:
+            return False
+        self._events.put((EVENT_STATE, states))
+        return True
+
+
+class WorkerMinitor(Minitor):
+    """Checks one shard of Monitors and sends results to the coordinator"""
+
+    def __init__(self, shard, shards, events):
+        super().__init__()
+        self.shard = shard
+        self.shards = shards
+        self._events = events
+        self._parent_pid = os.getppid()
+        self._state_store = ShardStateReporter(events)
+        self._state_interval = 0
+
+    def _setup(self, config_path):
+        super()._setup(config_path)
+        # Monitors that depend on each other are kept in the same shard
+        groups = dependency_groups(self.monitors)
+        self.monitors = [
+            monitor
+            for monitor in self.monitors
+            if shard_for(groups[monitor.name], self.shards) == self.shard
+        ]
+
+    def _apply_spawn_rate(self):
+        # Share the configured rate between all workers
+        spawn_limiter.rate = None
+        if self.max_spawn_rate is not None:
+            spawn_limiter.rate = self.max_spawn_rate / self.shards
+
+    def _handle_minitor_alert(self, minitor_alert):
+        """Sends the alert to the coordinator to be issued"""
+        monitor = minitor_alert.monitor
+        self._events.put(
+            (
+                EVENT_ALERT,
+                monitor.name,
+                str(minitor_alert),
+                dump_monitor_state(monitor, max_output=None),
+            )
+        )
+
+    async def _handle_minitor_alert_async(self, minitor_alert):
+        self._handle_minitor_alert(minitor_alert)
+
+    def _time_until_next(self, scheduler):
+        # Wake up periodically to notice if the coordinator has exited
+        return min(super()._time_until_next(scheduler), DEFAULT_WATCH_INTERVAL)
+
+    def _maybe_save_state(self, force=False):
+        if os.getppid() != self._parent_pid:
+            raise SystemExit("Coordinator has exited")
+        super()._maybe_save_state(force=force)
+
+
+def run_worker(args, shard, states, events):
+    """Runs a worker process for a shard of Monitors"""
+    # The coordinator stops its workers, so leave interrupts to it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    minitor = WorkerMinitor(shard, args.workers, events)
+    minitor._start(args, serve_metrics=False)
+    for monitor in minitor.monitors:
+        state = states.get(monitor.name)
+        if state is not None:
+            load_monitor_state(monitor, state)
+    minitor._loop()
+
+
+class Coordinator(object):
+    """Runs Monitors in worker processes and issues their alerts
+
+    The coordinator keeps its own copy of every Monitor, updated from the
+    results sent by workers. These copies are used to issue alerts, report
+    metrics, save state, and restart workers that exit without losing the
+    state of their shard.
+    """
+
+    def __init__(self, minitor, args):
+        self.minitor = minitor
+        self.args = args
+        self.workers = args.workers
+        self._logger = minitor._logger.getChild(self.__class__.__name__)
+        # Spawn rather than fork since the coordinator runs threads
+        self._context = multiprocessing.get_context("spawn")
+        self._events = self._context.Queue()
+        self._processes = {}
+        self._monitors = {}
+        self._metrics_dir = None
+        # Only the coordinator saves state and watches the config file
+        self._worker_args = Namespace(
+            **dict(vars(args), state_file=None, watch_config=False)
+        )
+
+    def _init_metrics(self):
+        """Returns a registry that merges metrics from every process
+
+        This must be called before prometheus_client is imported so that all
+        processes use its multiprocess mode.
+        """
+        if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+            self._metrics_dir = tempfile.mkdtemp(prefix="minitor-metrics-")
+            os.environ["PROMETHEUS_MULTIPROC_DIR"] = self._metrics_dir
+
+        from prometheus_client import CollectorRegistry
+        from prometheus_client.multiprocess import MultiProcessCollector
+
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry)
+        return registry
+
+    def run(self):
+        registry = None
+        if self.args.metrics:
+            registry = self._init_metrics()
+        self.minitor._start(self.args, serve_metrics=False)
+        if registry is not None:
+            self.minitor._serve_metrics(self.args.metrics_port, registry=registry)
+        self._update_monitors()
+
+        exit_on_sigterm()
+        try:
+            for shard in range(self.workers):
+                self._start_worker(shard)
+            self._loop()
+        finally:
+            self._stop_workers()
+            self.minitor._maybe_save_state(force=True)
+            if self._metrics_dir is not None:
+                shutil.rmtree(self._metrics_dir, ignore_errors=True)
+
+    def _loop(self):
+        minitor = self.minitor
+        while True:
+            self._handle_events(POLL_INTERVAL)
+            self._restart_workers()
+            minitor._drain_wake()
+            if minitor._should_reload() and minitor._reload():
+                self._update_monitors()
+                self._signal_workers(signal.SIGHUP)
+            minitor._maybe_save_state()
+
+    def _update_monitors(self):
+        self._monitors = {monitor.name: monitor for monitor in self.minitor.monitors}
+
+    def _start_worker(self, shard):
+        """Starts a worker with the current state of its shard"""
+        states = {
+            name: dump_monitor_state(monitor)
+            for name, monitor in self._monitors.items()
+            if shard_for(monitor.group, self.workers) == shard
+        }
+        process = self._context.Process(
+            target=run_worker,
+            args=(self._worker_args, shard, states, self._events),
+            name="minitor-worker-{}".format(shard),
+            daemon=True,
+        )
+        process.start()
+        self._processes[shard] = process
+        self._logger.info("Started worker %d with pid %d", shard, process.pid)
+
+    def _restart_workers(self):
+        """Restarts any workers that have exited"""
+        for shard, process in list(self._processes.items()):
+            if process.is_alive():
+                continue
+            self._logger.error(
+                "Worker %d exited with code %s. Restarting",
+                shard,
+                process.exitcode,
+            )
+            self._mark_dead(process)
+            self._start_worker(shard)
+
+    def _signal_workers(self, signum):
+        for process in self._processes.values():
+            if process.is_alive():
+                os.kill(process.pid, signum)
+
+    def _stop_workers(self):
+        for process in self._processes.values():
+            process.terminate()
+        for process in self._processes.values():
+            process.join(STOP_TIMEOUT)
+            self._mark_dead(process)
+
+    def _mark_dead(self, process):
+        """Removes per process metrics for a worker that has exited"""
+        if self.args.metrics:
+            from prometheus_client import multiprocess
+
+            multiprocess.mark_process_dead(process.pid)
+
+    def _handle_events(self, timeout):
+        """Handles all results from workers, waiting up to timeout for one"""
+        try:
+            event = self._events.get(timeout=timeout)
+        except Empty:
+            return
+        while True:
+            self._handle_event(event)
+            try:
+                event = self._events.get_nowait()
+            except Empty:
+                return
+
+    def _handle_event(self, event):
+        if event[0] == EVENT_STATE:
+            for name, state in event[1].items():
+                self._load_state(name, state)
+        elif event[0] == EVENT_ALERT:
+            _, name, message, state = event
+            monitor = self._load_state(name, state)
+            if monitor is not None:
+                self.minitor._handle_minitor_alert(MinitorAlert(message, monitor))
+
+    def _load_state(self, name, state):
+        """Updates the coordinator's copy of a Monitor. Returns the Monitor"""
+        monitor = self._monitors.get(name)
+        if monitor is None:
+            # The Monitor was removed by a reload since the worker sent this
+            return None
+        load_monitor_state(monitor, state)
+        return monitor
@@ -36,6 +36,7 @@ setup(
     keywords="minitor monitoring alerting",
     packages=find_packages(
         exclude=[
+            "benchmarks",
             "contrib",
             "docs",
             "examples",
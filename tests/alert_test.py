@@ -1,9 +1,17 @@
+import asyncio
 from datetime import datetime
+from subprocess import CalledProcessError
+from time import sleep
 from unittest.mock import patch
 
 import pytest
+from prometheus_client import CollectorRegistry
+from prometheus_client import Histogram
 
 from minitor.main import Alert
+from minitor.main import AlertCoalescer
+from minitor.main import AlertDispatcher
+from minitor.main import InvalidAlertException
 from minitor.main import Monitor
 from tests.util import assert_called_once_with
 
@@ -53,3 +61,207 @@ class TestAlert(object):
                 "Last success was " + expected_success + "\n"
                 "Last output was: beep boop",
             )
+
+    def test_alert_async(self, monitor, echo_alert):
+        monitor.alert_count = 1
+        monitor.last_output = "beep boop"
+        monitor.total_failure_count = 1
+        with patch.object(echo_alert._logger, "error") as mock_error:
+            asyncio.run(echo_alert.alert_async("Exception message", monitor))
+            assert_called_once_with(
+                mock_error,
+                "Dummy Monitor has failed 1 time(s)!\n"
+                "We have alerted 1 time(s)\n"
+                "Last success was Never\n"
+                "Last output was: beep boop",
+            )
+
+    def test_alert_last_status(self, monitor):
+        alert = Alert("status", {"command": ["echo", "{last_status}"]})
+        monitor.last_status = "timeout"
+        with patch.object(alert._logger, "error") as mock_error:
+            alert.alert("Exception message", monitor)
+            assert_called_once_with(mock_error, "timeout")
+
+    @pytest.mark.parametrize("timeout", [0, -1, "invalid"])
+    def test_alert_invalid_timeout(self, timeout):
+        with pytest.raises(InvalidAlertException):
+            Alert("log", {"command": ["true"], "timeout": timeout})
+
+    def test_alert_retries(self, monitor):
+        alert = Alert("fail", {"command": ["false"], "retries": 2})
+        with patch("minitor.main.sleep") as mock_sleep:
+            with pytest.raises(CalledProcessError):
+                alert.alert("Exception message", monitor)
+            # Backoff should double with each retry
+            assert [c.args[0] for c in mock_sleep.call_args_list] == [1, 2]
+
+    def test_alert_retry_success(self, monitor):
+        alert = Alert("retry", {"command": ["true"], "retries": 2})
+        with patch("minitor.main.sleep") as mock_sleep:
+            alert.alert("Exception message", monitor)
+            assert mock_sleep.call_count == 0
+
+    @pytest.mark.parametrize(
+        "config",
+        [{"retries": "invalid"}, {"retry_backoff": -1}, {"retry_backoff": "1"}],
+    )
+    def test_alert_invalid_retries(self, config):
+        with pytest.raises(InvalidAlertException):
+            Alert("log", dict({"command": ["true"]}, **config))
+
+    def test_alert_duration(self, monitor):
+        registry = CollectorRegistry()
+        histogram = Histogram(
+            "alert_duration", "Alert duration", ["alert"], registry=registry
+        )
+        alert = Alert("timed", {"command": ["true"]}, duration_histogram=histogram)
+        alert.alert("Exception message", monitor)
+        assert (
+            registry.get_sample_value("alert_duration_count", {"alert": "timed"}) == 1
+        )
+
+    @pytest.mark.parametrize(
+        "command",
+        [["echo", "{monitr_name}"], "echo {0}", ["echo", "{alert_count:q}"]],
+    )
+    def test_alert_invalid_template(self, command):
+        with pytest.raises(InvalidAlertException):
+            Alert("typo", {"command": command})
+
+    def test_alert_unused_variables(self, monitor):
+        alert = Alert("name", {"command": ["echo", "{monitor_name}"]})
+        monitor.last_success = datetime(2018, 4, 10)
+        with patch.object(Alert, "_format_datetime") as mock_format:
+            assert alert._monitor_command("Down", monitor) == ["echo", "Dummy Monitor"]
+            assert not mock_format.called
+
+    @pytest.mark.parametrize(
+        "command",
+        [
+            "echo {alert_message}",
+            "echo '{alert_message}'",
+            'echo "{alert_message}"',
+            'echo "Said: {alert_message}"',
+        ],
+    )
+    def test_alert_shell_escape(self, monitor, command):
+        alert = Alert("shell", {"command": command})
+        message = 'it\'s $(echo unsafe) `id` \\ "done";'
+        with patch.object(alert._logger, "error") as mock_error:
+            alert.alert(message, monitor)
+            output = mock_error.call_args.args[0].strip()
+        assert output.endswith(message)
+
+
+class TestAlertDispatcher(object):
+    @pytest.fixture
+    def monitor(self):
+        return Monitor({"name": "Dummy Monitor", "command": ["echo", "foo"]})
+
+    def test_dispatch(self, monitor):
+        alert = Alert("echo", {"command": ["echo", "{monitor_name} {alert_count}"]})
+        dispatcher = AlertDispatcher(2)
+        dispatcher.start()
+
+        monitor.alert_count = 1
+        with patch.object(alert._logger, "error") as mock_error:
+            assert dispatcher.submit(alert, "Exception message", monitor)
+            # Variables should be captured when the alert is submitted
+            monitor.alert_count = 2
+            dispatcher.join()
+            assert_called_once_with(mock_error, "Dummy Monitor 1")
+
+    def test_dispatch_failure(self, monitor):
+        failing = Alert("fail", {"command": ["false"]})
+        dispatcher = AlertDispatcher(1)
+        dispatcher.start()
+        with patch.object(dispatcher._logger, "error") as mock_error:
+            dispatcher.submit(failing, "Exception message", monitor)
+            dispatcher.join()
+            assert mock_error.call_count == 1
+
+    def test_dispatch_invalid_command(self, monitor):
+        invalid = Alert("invalid", {"command": ["echo", "{last_output}"]})
+        alert = Alert("echo", {"command": ["echo", "{monitor_name}"]})
+        monitor.last_output = "a\0b"
+        dispatcher = AlertDispatcher(1)
+        dispatcher.start()
+        with patch.object(dispatcher._logger, "error") as mock_dispatch_error:
+            with patch.object(alert._logger, "error") as mock_error:
+                dispatcher.submit(invalid, "Exception message", monitor)
+                # The worker keeps delivering alerts after one fails
+                dispatcher.submit(alert, "Exception message", monitor)
+                dispatcher.join()
+                assert mock_dispatch_error.call_count == 1
+                assert_called_once_with(mock_error, "Dummy Monitor")
+
+    def test_queue_full(self, monitor):
+        alert = Alert("echo", {"command": ["true"]})
+        # Not started, so nothing will be taken off the queue
+        dispatcher = AlertDispatcher(1, queue_size=1)
+        assert dispatcher.submit(alert, "Exception message", monitor)
+        assert not dispatcher.submit(alert, "Exception message", monitor)
+        assert dispatcher.qsize() == 1
+
+
+class TestAlertCoalescer(object):
+    @pytest.fixture
+    def alert(self):
+        return Alert(
+            "digest",
+            {
+                "command": ["echo", "{monitor_count}: {monitor_names}"],
+                # Long enough that the window will not close during the test
+                "coalesce_window": 60,
+            },
+        )
+
+    @pytest.fixture
+    def monitors(self):
+        return [
+            Monitor({"name": "Monitor {}".format(i), "command": ["true"]})
+            for i in range(3)
+        ]
+
+    def test_first_alert_immediate(self, alert, monitors):
+        sent = []
+        coalescer = AlertCoalescer(lambda alert, command: sent.append(command))
+        assert not coalescer.add(alert, "Down", monitors[0])
+        coalescer.flush(alert)
+        assert sent == []
+
+    def test_coalesce(self, alert, monitors):
+        sent = []
+        coalescer = AlertCoalescer(lambda alert, command: sent.append(command))
+        assert not coalescer.add(alert, "Down", monitors[0])
+        assert coalescer.add(alert, "Down", monitors[1])
+        assert coalescer.add(alert, "Down", monitors[2])
+        assert coalescer.add(alert, "Still down", monitors[2])
+        coalescer.flush(alert)
+        assert sent == [["echo", "2: Monitor 1, Monitor 2"]]
+
+        # The window stays open after a flush with buffered alerts
+        assert coalescer.add(alert, "Down", monitors[0])
+        coalescer.flush(alert)
+        coalescer.flush(alert)
+        assert len(sent) == 2
+        assert not coalescer.add(alert, "Down", monitors[0])
+
+    def test_window_closes(self, alert, monitors):
+        sent = []
+        alert.coalesce_window = 0.01
+        coalescer = AlertCoalescer(lambda alert, command: sent.append(command))
+        coalescer.add(alert, "Down", monitors[0])
+        coalescer.add(alert, "Down", monitors[1])
+        for _ in range(100):
+            if sent:
+                break
+            sleep(0.01)
+        assert sent == [["echo", "1: Monitor 1"]]
+
+    def test_single_monitor_variables(self, alert, monitors):
+        assert alert._monitor_command("Down", monitors[0]) == [
+            "echo",
+            "1: Monitor 0",
+        ]
@@ -0,0 +1,155 @@
+import json
+from time import monotonic
+from time import sleep
+from unittest.mock import patch
+
+import pytest
+
+from minitor.cluster import Cluster
+from minitor.cluster import CLUSTER_PATH
+from minitor.cluster import HashRing
+from minitor.main import Minitor
+from minitor.main import MinitorCollector
+from minitor.main import Monitor
+from minitor.main import Scheduler
+from minitor.server import RoutingApp
+from minitor.server import start_server
+from minitor.status import StatusApp
+from tests.scheduler_test import FakeClock
+
+
+NAMES = ["Monitor {}".format(i) for i in range(1000)]
+
+
+def not_found(environ, start_response):
+    start_response("404 Not Found", [])
+    return [b""]
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+class TestHashRing(object):
+    def test_owner(self):
+        assert HashRing([]).owner("Monitor") is None
+        ring = HashRing(["a", "b", "c"])
+        owners = [ring.owner(name) for name in NAMES]
+        assert owners == [HashRing(["c", "b", "a"]).owner(name) for name in NAMES]
+        # Keys are spread roughly evenly between nodes
+        for node in ("a", "b", "c"):
+            assert 200 < owners.count(node) < 467
+
+    def test_remove_node(self):
+        before = HashRing(["a", "b", "c"])
+        after = HashRing(["a", "b"])
+        for name in NAMES:
+            # Only keys owned by the removed node move
+            if before.owner(name) != "c":
+                assert after.owner(name) == before.owner(name)
+
+
+class TestCluster(object):
+    def test_live_nodes(self, clock):
+        cluster = Cluster("a", ["a", "b", "c"], interval=1, clock=clock)
+        assert cluster.peers == ["b", "c"]
+        assert all(cluster.owns(name) for name in NAMES[:10])
+
+        with patch.object(cluster, "_poll", side_effect=lambda peer: peer == "b"):
+            cluster.heartbeat()
+        assert cluster.live_nodes() == {"a", "b"}
+        owned = [name for name in NAMES if cluster.owns(name)]
+        assert 0 < len(owned) < len(NAMES)
+
+        # Peers that stop answering are dropped after the timeout
+        clock.now += 3
+        with patch.object(cluster, "_poll", return_value=False):
+            cluster.heartbeat()
+            assert cluster.live_nodes() == {"a", "b"}
+            clock.now += 1
+            cluster.heartbeat()
+        assert cluster.live_nodes() == {"a"}
+        assert all(cluster.owns(name) for name in NAMES)
+
+    def test_heartbeat(self, clock):
+        servers, apps = [], []
+        for _ in range(2):
+            app = RoutingApp(not_found)
+            servers.append(start_server(0, app, addr="127.0.0.1"))
+            apps.append(app)
+        nodes = ["127.0.0.1:{}".format(server.server_port) for server in servers]
+        clusters = []
+        for node, app in zip(nodes, apps):
+            cluster = Cluster(node, nodes, interval=1, clock=clock)
+            app.add_route(CLUSTER_PATH, cluster.wsgi_app)
+            clusters.append(cluster)
+
+        try:
+            for cluster in clusters:
+                cluster.heartbeat()
+                assert cluster.live_nodes() == set(nodes)
+            # Both nodes agree on which node owns each monitor
+            for name in NAMES[:100]:
+                assert clusters[0].owns(name) != clusters[1].owns(name)
+
+            servers[1].shutdown()
+            servers[1].server_close()
+            clock.now += 5
+            clusters[0].heartbeat()
+            assert clusters[0].live_nodes() == {nodes[0]}
+        finally:
+            servers[0].shutdown()
+            servers[0].server_close()
+
+    def test_heartbeat_slow_peers(self, clock):
+        peers = ["b", "c", "d", "e"]
+        cluster = Cluster("a", ["a"] + peers, interval=1, clock=clock)
+
+        def poll(peer):
+            sleep(0.5)
+            return peer != "e"
+
+        # Peers are polled at once, so a round takes as long as the slowest
+        start = monotonic()
+        with patch.object(cluster, "_poll", side_effect=poll):
+            cluster.heartbeat()
+        assert monotonic() - start < 1.5
+        assert cluster.live_nodes() == {"a", "b", "c", "d"}
+
+    def test_pop_due(self, clock):
+        minitor = Minitor()
+        minitor._cluster = Cluster("a", ["b"], interval=1, clock=clock)
+        minitor.monitors = [
+            Monitor({"name": name, "command": ["true"]}) for name in NAMES[:20]
+        ]
+        # Nothing is checked until the first heartbeat finds the other nodes
+        assert minitor._pop_due(Scheduler(minitor.monitors, clock=clock)) == []
+
+        with patch.object(minitor._cluster, "_poll", return_value=True):
+            minitor._cluster.heartbeat()
+        due = minitor._pop_due(Scheduler(minitor.monitors, clock=clock))
+        assert 0 < len(due) < 20
+        assert all(minitor._cluster.owns(monitor.name) for monitor in due)
+
+    def test_report_owned(self, clock):
+        minitor = Minitor()
+        minitor._cluster = Cluster("a", ["b"], interval=1, clock=clock)
+        minitor.monitors = [
+            Monitor({"name": name, "command": ["true"]}) for name in NAMES[:20]
+        ]
+        status = StatusApp(minitor)
+        assert json.loads(status.index())["monitors"] == []
+
+        with patch.object(minitor._cluster, "_poll", return_value=True):
+            minitor._cluster.heartbeat()
+        owned = [m.name for m in minitor.monitors if minitor._cluster.owns(m.name)]
+        assert 0 < len(owned) < 20
+        reported = [m["name"] for m in json.loads(status.index())["monitors"]]
+        assert reported == owned
+        assert status.detail(owned[0]) is not None
+        unowned = next(m.name for m in minitor.monitors if m.name not in owned)
+        assert status.detail(unowned) is None
+
+        up = next(iter(MinitorCollector(minitor).collect()))
+        assert [sample.labels["monitor"] for sample in up.samples] == owned
@@ -0,0 +1,73 @@
+import os
+import stat
+from unittest.mock import patch
+
+import pytest
+
+from minitor.config_cache import config_key
+from minitor.config_cache import ConfigCache
+from minitor.main import Minitor
+
+
+CONFIG = (
+    "check_interval: 10\n"
+    "monitors:\n"
+    "  - name: Env\n"
+    "    command: [echo, '${MINITOR_TEST_VALUE:-default}']\n"
+)
+
+
+class TestConfigCache(object):
+    @pytest.fixture
+    def cache(self, tmp_path):
+        return ConfigCache(str(tmp_path / "config-cache.json"))
+
+    def test_config_key(self):
+        key = config_key(CONFIG, {})
+        assert key == config_key(CONFIG, {"UNRELATED": "1"})
+        assert key != config_key(CONFIG, {"MINITOR_TEST_VALUE": "1"})
+        assert key != config_key(CONFIG + "\n", {})
+
+    def test_save_and_load(self, cache):
+        config = {"monitors": [{"name": "Cached", "command": ["true"]}]}
+        assert cache.load("key") is None
+        assert cache.save("key", config)
+        assert cache.load("key") == config
+        assert cache.load("other") is None
+
+    def test_save_private(self, cache):
+        # A left over temporary file should not keep its mode either
+        with open(cache.path + ".tmp", "w"):
+            pass
+        os.chmod(cache.path + ".tmp", 0o644)
+        assert cache.save("key", {"secret": "value"})
+        assert stat.S_IMODE(os.stat(cache.path).st_mode) == 0o600
+
+    @pytest.mark.parametrize("config", [{1: "int key"}, {"value": object()}])
+    def test_save_not_json(self, cache, config):
+        assert not cache.save("key", config)
+        assert cache.load("key") is None
+
+    def test_load_invalid(self, cache):
+        with open(cache.path, "w") as f:
+            f.write("not json")
+        assert cache.load("key") is None
+
+    def test_setup_with_cache(self, cache, tmp_path):
+        config = tmp_path / "config.yml"
+        config.write_text(CONFIG)
+        minitor = Minitor()
+        minitor._config_cache = cache
+        minitor._setup(str(config))
+        assert minitor.monitors[0].command == ["echo", "default"]
+
+        # The cached config is used without parsing YAML
+        with patch("minitor.main.load_yaml") as mock_load:
+            minitor._setup(str(config))
+            mock_load.assert_not_called()
+        assert minitor.monitors[0].command == ["echo", "default"]
+
+        # Changing a referenced env var invalidates the cache
+        with patch.dict("os.environ", {"MINITOR_TEST_VALUE": "changed"}):
+            minitor._setup(str(config))
+        assert minitor.monitors[0].command == ["echo", "changed"]
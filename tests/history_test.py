@@ -0,0 +1,39 @@
+from minitor.history import ResultHistory
+
+
+class TestResultHistory(object):
+    def test_append(self):
+        history = ResultHistory(3)
+        assert history.entries() == []
+        history.append(1.0, "success", 0.5, 0)
+        history.append(2.0, "timeout")
+        assert len(history) == 2
+        assert history.entries() == [
+            (1.0, "success", 0.5, 0),
+            (2.0, "timeout", None, None),
+        ]
+
+    def test_replaces_oldest(self):
+        history = ResultHistory(3)
+        for i in range(5):
+            history.append(float(i), "failure", 0.1, i)
+        assert len(history) == 3
+        assert [entry[0] for entry in history.entries()] == [2.0, 3.0, 4.0]
+        assert history.entries()[-1] == (4.0, "failure", 0.1, 4)
+
+    def test_load(self):
+        history = ResultHistory(2)
+        history.append(1.0, "success", 0.5, 0)
+        history.load(
+            [
+                (2.0, "failure", 0.1, 1),
+                (3.0, "success", None, 0),
+                (4.0, "timeout", 5.0, None),
+            ]
+        )
+        assert history.entries() == [
+            (3.0, "success", None, 0),
+            (4.0, "timeout", 5.0, None),
+        ]
+        history.append(5.0, "success", 0.2, 0)
+        assert [entry[0] for entry in history.entries()] == [4.0, 5.0]
@@ -1,8 +1,30 @@
+import asyncio
 import os
+import subprocess
+import sys
+import threading
+from subprocess import TimeoutExpired
+from time import monotonic
 from unittest.mock import patch
 
+import pytest
+from prometheus_client import CollectorRegistry
+from prometheus_client import Counter
+
+from minitor import main
+from minitor.main import Alert
+from minitor.main import async_call_output
 from minitor.main import call_output
+from minitor.main import command_key
+from minitor.main import ENGINE_ASYNCIO
+from minitor.main import ENGINE_THREAD
+from minitor.main import InvalidMonitorException
 from minitor.main import Minitor
+from minitor.main import MinitorCollector
+from minitor.main import Monitor
+from minitor.main import OutputBuffer
+from minitor.main import Scheduler
+from tests.scheduler_test import FakeClock
 
 
 class TestMinitor(object):
@@ -16,6 +38,143 @@ class TestMinitor(object):
         assert output.startswith(b"ls: ")
         assert ex is not None
 
+    def test_async_call_output(self):
+        output, ex = asyncio.run(async_call_output(["echo", "test"]))
+        assert output == b"test"
+        assert ex is None
+
+        output, ex = asyncio.run(async_call_output(["ls", "--not-a-real-flag"]))
+        assert output.startswith(b"ls: ")
+        assert ex is not None
+
+        # Shell form should merge stderr into stdout
+        output, ex = asyncio.run(
+            async_call_output("echo foo; echo bar >&2; exit 2", shell=True)
+        )
+        assert output == b"foo\nbar"
+        assert ex.returncode == 2
+
+    def test_call_output_timeout(self):
+        # Background children of shell commands should be killed as well,
+        # otherwise they would hold the output pipe open
+        start = monotonic()
+        output, ex = call_output(
+            "echo started; sleep 10 & wait",
+            shell=True,
+            timeout=0.2,
+        )
+        assert monotonic() - start < 5
+        assert output == b"started"
+        assert isinstance(ex, TimeoutExpired)
+
+        output, ex = call_output(["echo", "test"], timeout=5)
+        assert output == b"test"
+        assert ex is None
+
+    def test_async_call_output_timeout(self):
+        start = monotonic()
+        output, ex = asyncio.run(
+            async_call_output(
+                "echo started; sleep 10 & wait",
+                shell=True,
+                timeout=0.2,
+            )
+        )
+        assert monotonic() - start < 5
+        assert isinstance(ex, TimeoutExpired)
+
+    def test_setup_timeout(self, tmp_path):
+        config = tmp_path / "config.yml"
+        config.write_text(
+            "timeout: 5\n"
+            "monitors:\n"
+            "  - name: Default\n"
+            "    command: [ 'true' ]\n"
+            "  - name: Override\n"
+            "    command: [ 'true' ]\n"
+            "    timeout: 1\n"
+            "alerts:\n"
+            "  notify:\n"
+            "    command: [ 'true' ]\n"
+        )
+        minitor = Minitor()
+        minitor._setup(str(config))
+        assert [monitor.timeout for monitor in minitor.monitors] == [5, 1]
+        assert minitor.alerts["notify"].timeout == 5
+        assert minitor.alerts["log"].timeout is None
+
+        config.write_text("timeout: -1\n")
+        with pytest.raises(InvalidMonitorException):
+            minitor._setup(str(config))
+
+    def test_setup_history_size(self, tmp_path):
+        config = tmp_path / "config.yml"
+        config.write_text(
+            "monitors:\n"
+            "  - name: Default\n"
+            "    command: [ 'true' ]\n"
+            "  - name: Override\n"
+            "    command: [ 'true' ]\n"
+            "    history_size: 0\n"
+        )
+        minitor = Minitor()
+        minitor._setup(str(config))
+        assert minitor.monitors[0].history.size == 10
+        assert minitor.monitors[1].history is None
+
+        config.write_text("history_size: -1\n")
+        with pytest.raises(InvalidMonitorException):
+            minitor._setup(str(config))
+
+    @pytest.mark.parametrize(
+        "config",
+        [
+            "alert_workers: -1\n",
+            "alert_workers: two\n",
+            "alert_queue_size: 0\n",
+            "max_concurrency: four\n",
+            "max_concurrency: 0\n",
+        ],
+    )
+    def test_setup_invalid_concurrency_settings(self, tmp_path, config):
+        path = tmp_path / "config.yml"
+        path.write_text(config)
+        with pytest.raises(InvalidMonitorException):
+            Minitor()._setup(str(path))
+
+    @pytest.mark.parametrize(
+        "config",
+        ["spread_checks: 1\n", "max_spawn_rate: 0\n", "max_spawn_rate: fast\n"],
+    )
+    def test_setup_invalid_spawn_settings(self, tmp_path, config):
+        path = tmp_path / "config.yml"
+        path.write_text(config)
+        with pytest.raises(InvalidMonitorException):
+            Minitor()._setup(str(path))
+
+    def test_output_buffer(self):
+        buffer = OutputBuffer(4)
+        buffer.write(b"ab")
+        assert buffer.getvalue() == b"ab"
+        buffer.write(b"cdef")
+        assert buffer.truncated == 2
+        assert buffer.getvalue() == b"[... 2 bytes truncated ...]\ncdef"
+
+        buffer = OutputBuffer()
+        buffer.write(b"a" * 100)
+        assert buffer.getvalue() == b"a" * 100
+
+    def test_call_output_max_output(self):
+        output, ex = call_output("yes | head -n 100000", shell=True, max_output=10)
+        assert output == b"[... 199990 bytes truncated ...]\ny\ny\ny\ny\ny"
+        assert ex is None
+
+        output, ex = asyncio.run(
+            async_call_output("yes | head -n 100000; exit 1", shell=True, max_output=4)
+        )
+        assert output == b"[... 199996 bytes truncated ...]\ny\ny"
+        assert ex.returncode == 1
+
     def test_run(self):
         """Doesn't really check much, but a simple integration sanity test"""
         test_loop_count = 5
@@ -35,3 +194,534 @@ class TestMinitor(object):
             # Skip the loop, but run a single check
             for _ in range(test_loop_count):
                 minitor._check()
+
+    def test_check_concurrent(self):
+        minitor = Minitor()
+        minitor.max_concurrency = 4
+        minitor.alerts = {"log": Alert("log", {"command": ["true"]})}
+        minitor.monitors = [
+            Monitor(
+                {
+                    "name": "Monitor {}".format(i),
+                    "command": ["true"] if i % 2 else ["false"],
+                    "alert_after": 1,
+                }
+            )
+            for i in range(8)
+        ]
+        with patch.object(minitor, "_handle_minitor_alert") as mock_handle:
+            minitor._check()
+            # Only failing monitors should alert
+            assert mock_handle.call_count == 4
+
+        for i, monitor in enumerate(minitor.monitors):
+            assert monitor.last_check is not None
+            assert monitor.is_up() == bool(i % 2)
+
+        # Nothing is due, so nothing should be run again
+        with patch.object(Monitor, "run_command") as mock_run:
+            minitor._check()
+            assert mock_run.call_count == 0
+
+    def test_max_concurrency_arg(self):
+        minitor = Minitor()
+        args = minitor._parse_args(["--max-concurrency", "8"])
+        assert args.max_concurrency == 8
+        assert minitor._parse_args([]).max_concurrency is None
+        with pytest.raises(SystemExit):
+            minitor._parse_args(["--max-concurrency", "0"])
+
+    def test_check_async(self):
+        minitor = Minitor()
+        minitor.engine = ENGINE_ASYNCIO
+        minitor.max_concurrency = 4
+        minitor.alerts = {"log": Alert("log", {"command": ["true"]})}
+        minitor.monitors = [
+            Monitor(
+                {
+                    "name": "Monitor {}".format(i),
+                    "command": "true" if i % 2 else "false",
+                    "alert_after": 1,
+                }
+            )
+            for i in range(8)
+        ]
+        with patch.object(Alert, "alert_async") as mock_alert:
+            minitor._check()
+            # Only failing monitors should alert
+            assert mock_alert.call_count == 4
+
+        for i, monitor in enumerate(minitor.monitors):
+            assert monitor.last_check is not None
+            assert monitor.is_up() == bool(i % 2)
+
+    def test_check_provided_monitors(self):
+        minitor = Minitor()
+        minitor.alerts = {}
+        minitor.monitors = [
+            Monitor({"name": "Monitor {}".format(i), "command": ["true"]})
+            for i in range(2)
+        ]
+        minitor._check()
+        assert all(not monitor.should_check() for monitor in minitor.monitors)
+
+        # Monitors provided by the scheduler are checked even if not yet due
+        with patch.object(Monitor, "run_command", return_value=(b"", None)) as mock:
+            minitor._check(minitor.monitors[:1])
+            assert mock.call_count == 1
+
+    @pytest.mark.parametrize(
+        "depends_on",
+        [
+            {"A": ["Missing"]},
+            {"A": ["A"]},
+            {"A": ["B"], "B": ["C"], "C": ["A"]},
+        ],
+    )
+    def test_validate_depends_on(self, depends_on):
+        minitor = Minitor()
+        minitor.alerts = {"log": Alert("log", {"command": ["true"]})}
+        minitor.monitors = [
+            Monitor(
+                {
+                    "name": name,
+                    "command": ["true"],
+                    "depends_on": depends_on.get(name, []),
+                }
+            )
+            for name in ("A", "B", "C")
+        ]
+        with pytest.raises(InvalidMonitorException):
+            minitor._validate_monitors()
+
+    @pytest.mark.parametrize(
+        "engine,max_concurrency",
+        [(ENGINE_THREAD, 1), (ENGINE_THREAD, 2), (ENGINE_ASYNCIO, 2)],
+    )
+    def test_depends_on_same_batch(self, engine, max_concurrency):
+        minitor = Minitor()
+        minitor.engine = engine
+        minitor.max_concurrency = max_concurrency
+        minitor.alerts = {"log": Alert("log", {"command": ["true"]})}
+        minitor.monitors = [
+            Monitor(
+                {
+                    "name": "child",
+                    "command": ["false", "child"],
+                    "alert_after": 1,
+                    "depends_on": ["parent"],
+                }
+            ),
+            Monitor({"name": "parent", "command": ["false"], "alert_after": 1}),
+        ]
+        minitor._validate_monitors()
+
+        # The child is handled first, before its parent is known to be down
+        alerted = []
+
+        def alerts_for(minitor_alert):
+            alerted.append(minitor_alert.monitor.name)
+            return []
+
+        with patch.object(Minitor, "_alerts_for", side_effect=alerts_for):
+            minitor._check(minitor.monitors)
+        assert alerted == ["parent"]
+
+    def test_depends_on(self):
+        clock = FakeClock()
+        minitor = Minitor()
+        minitor.alerts = {"log": Alert("log", {"command": ["true"]})}
+        router, server, app = (
+            Monitor(
+                {
+                    "name": "Router",
+                    "command": ["false", "router"],
+                    "alert_after": 1,
+                    "alert_up": ["log"],
+                }
+            ),
+            Monitor(
+                {
+                    "name": "Server",
+                    "command": ["false", "server"],
+                    "alert_after": 1,
+                    "alert_up": ["log"],
+                    "depends_on": ["Router"],
+                }
+            ),
+            Monitor(
+                {
+                    "name": "App",
+                    "command": ["false", "app"],
+                    "alert_after": 1,
+                    "depends_on": ["Server"],
+                }
+            ),
+        )
+        minitor.monitors = [router, server, app]
+        minitor._validate_monitors()
+        assert app.group == server.group == router.group == "App"
+        scheduler = Scheduler(minitor.monitors, clock=clock)
+        assert len(minitor._pop_due(scheduler)) == 3
+
+        with patch.object(Alert, "alert") as mock_alert:
+            minitor._check([router])
+            assert mock_alert.call_count == 1
+            assert app.dependency_down() is router
+
+            # Alerts from dependents that fail at the same time are held back
+            minitor._check([server])
+            assert mock_alert.call_count == 1
+
+            # Only the router is checked while it is down
+            clock.now += 30
+            assert minitor._pop_due(scheduler) == [router]
+
+            # Dependents are checked as soon as the router is back up
+            router.command = ["true"]
+            server.command = ["true"]
+            clock.now += 30
+            due = minitor._pop_due(scheduler)
+            assert due == [router]
+            down = minitor._down_parents(due)
+            minitor._check(due)
+            minitor._recheck_dependents(scheduler, down)
+            assert mock_alert.call_count == 2
+            # The app waits for the server, which also failed
+            due = minitor._pop_due(scheduler)
+            assert due == [server]
+
+            # The up alert for a held back down alert is held back too
+            down = minitor._down_parents(due)
+            minitor._check(due)
+            minitor._recheck_dependents(scheduler, down)
+            assert mock_alert.call_count == 2
+            assert minitor._pop_due(scheduler) == [app]
+
+    @pytest.mark.parametrize(
+        "first,second,same",
+        [
+            (["echo", "foo bar"], "echo 'foo bar'", True),
+            (["sh", "-c", "true"], "sh -c true", True),
+            (["/bin/sh", "-c", "echo $HOME"], "echo $HOME", True),
+            (["echo", "$HOME"], "echo $HOME", False),
+            (["env"], "FOO=bar env", False),
+            # Newlines separate commands in a shell
+            (["true", "false"], "true\nfalse", False),
+            (["/bin/sh", "-c", "true\nfalse"], "true\nfalse", True),
+            (["echo", "foo"], ["echo", "bar"], False),
+        ],
+    )
+    def test_command_key(self, first, second, same):
+        assert (command_key(first) == command_key(second)) == same
+
+    @pytest.mark.parametrize(
+        "engine,max_concurrency", [("thread", 1), ("thread", 2), (ENGINE_ASYNCIO, 2)]
+    )
+    def test_share_results(self, engine, max_concurrency):
+        registry = CollectorRegistry()
+        minitor = Minitor()
+        minitor.engine = engine
+        minitor.max_concurrency = max_concurrency
+        minitor.alerts = {"log": Alert("log", {"command": ["true"]})}
+        minitor.monitors = [
+            Monitor({"name": "Exec", "command": ["false"], "alert_after": 1}),
+            Monitor({"name": "Shell", "command": "false", "alert_after": 2}),
+            Monitor({"name": "Slow", "command": ["false"], "check_interval": 60}),
+            Monitor({"name": "Other", "command": ["true"]}),
+        ]
+        minitor._validate_monitors()
+        minitor._shared_check_counter = Counter(
+            "minitor_check_shared", "Shared", registry=registry
+        )
+
+        with patch.object(Minitor, "_alerts_for", return_value=[]) as mock_alerts:
+            minitor._check(minitor.monitors)
+        # Each command only ran once, but every Monitor got the result
+        assert registry.get_sample_value("minitor_check_shared_total") == 2
+        assert [monitor.total_failure_count for monitor in minitor.monitors] == [
+            1,
+            1,
+            1,
+            0,
+        ]
+        # Each Monitor still alerts on its own
+        assert mock_alerts.call_count == 1
+
+        # A recent result is used by Monitors that are checked again
+        with patch.object(Monitor, "run_command") as mock_run:
+            minitor._check(minitor.monitors[2:3])
+            assert not mock_run.called
+        assert minitor.monitors[2].total_failure_count == 2
+        assert registry.get_sample_value("minitor_check_shared_total") == 3
+
+    def test_failed_alert_continues(self):
+        minitor = Minitor()
+        minitor.alerts = {
+            "fail": Alert("fail", {"command": ["false"]}),
+            "log": Alert("log", {"command": ["true"]}),
+        }
+        monitor = Monitor(
+            {
+                "name": "Failing",
+                "command": ["false"],
+                "alert_after": 1,
+                "alert_down": ["fail", "log"],
+            }
+        )
+        minitor.monitors = [monitor]
+        with patch.object(minitor.alerts["log"], "alert") as mock_alert:
+            minitor._check()
+            assert mock_alert.call_count == 1
+
+    def test_invalid_alert_command_continues(self):
+        minitor = Minitor()
+        minitor.alerts = {
+            # Output with a NUL byte cannot be passed as an argument
+            "output": Alert("output", {"command": ["echo", "{last_output}"]}),
+            "log": Alert("log", {"command": ["true"]}),
+        }
+        minitor.monitors = [
+            Monitor(
+                {
+                    "name": "Failing",
+                    "command": "printf 'a\\0b'; false",
+                    "alert_after": 1,
+                    "alert_down": ["output", "log"],
+                }
+            )
+        ]
+        with patch.object(minitor.alerts["log"], "alert") as mock_alert:
+            minitor._check()
+            assert mock_alert.call_count == 1
+
+    def test_alert_workers(self):
+        minitor = Minitor()
+        minitor.alert_workers = 2
+        minitor.alerts = {"log": Alert("log", {"command": ["true"]})}
+        minitor.monitors = [
+            Monitor({"name": "Failing", "command": ["false"], "alert_after": 1})
+        ]
+        with patch.object(Alert, "send") as mock_send:
+            minitor._check()
+            minitor._alert_dispatcher.join()
+            assert mock_send.call_count == 1
+
+    def test_alert_retries_off_loop(self):
+        # Retrying alerts are sent by the dispatcher even without alert_workers
+        minitor = Minitor()
+        minitor.alerts = {
+            "log": Alert("log", {"command": ["true"]}),
+            "retry": Alert("retry", {"command": ["true"], "retries": 2}),
+        }
+        minitor.monitors = [
+            Monitor(
+                {
+                    "name": "Failing",
+                    "command": ["false"],
+                    "alert_after": 1,
+                    "alert_down": ["log", "retry"],
+                }
+            )
+        ]
+        threads = {}
+
+        def send(alert, command):
+            threads[alert.name] = threading.current_thread()
+
+        with patch.object(Alert, "send", autospec=True, side_effect=send):
+            minitor._check()
+            minitor._alert_dispatcher.join()
+        assert threads["log"] is threading.main_thread()
+        assert threads["retry"] is not threading.main_thread()
+
+    def test_coalesce_alerts(self):
+        minitor = Minitor()
+        minitor.alerts = {
+            "log": Alert("log", {"command": ["true"], "coalesce_window": 60}),
+        }
+        minitor.monitors = [
+            Monitor(
+                {"name": "Monitor {}".format(i), "command": ["false"], "alert_after": 1}
+            )
+            for i in range(3)
+        ]
+        with patch.object(Alert, "alert") as mock_alert, patch.object(
+            Alert, "send"
+        ) as mock_send:
+            minitor._check()
+            assert mock_alert.call_count == 1
+            minitor._alert_coalescer.flush(minitor.alerts["log"])
+            assert mock_send.call_count == 1
+
+    def test_reload(self, tmp_path):
+        config = tmp_path / "config.yml"
+        config.write_text(
+            "monitors:\n"
+            "  - name: Unchanged\n"
+            "    command: [ 'true' ]\n"
+            "  - name: Changed\n"
+            "    command: [ 'false' ]\n"
+            "  - name: Removed\n"
+            "    command: [ 'true' ]\n"
+        )
+        minitor = Minitor()
+        minitor.config_path = str(config)
+        minitor._setup(minitor.config_path)
+        minitor._validate_monitors()
+        unchanged, changed, _ = minitor.monitors
+        log_alert = minitor.alerts["log"]
+        minitor._check()
+        assert changed.total_failure_count == 1
+
+        config.write_text(
+            "monitors:\n"
+            "  - name: Unchanged\n"
+            "    command: [ 'true' ]\n"
+            "  - name: Changed\n"
+            "    command: [ 'false' ]\n"
+            "    alert_after: 10\n"
+            "  - name: Added\n"
+            "    command: [ 'true' ]\n"
+        )
+        assert minitor._reload()
+        assert [monitor.name for monitor in minitor.monitors] == [
+            "Unchanged",
+            "Changed",
+            "Added",
+        ]
+        assert minitor.monitors[0] is unchanged
+        assert minitor.alerts["log"] is log_alert
+        # Changed monitors are rebuilt, but keep their state
+        assert minitor.monitors[1] is not changed
+        assert minitor.monitors[1].alert_after == 10
+        assert minitor.monitors[1].total_failure_count == 1
+        assert minitor.monitors[1].last_check == changed.last_check
+        assert minitor.monitors[2].last_check is None
+
+    def test_reload_invalid(self, tmp_path):
+        config = tmp_path / "config.yml"
+        config.write_text(
+            "check_interval: 10\n"
+            "monitors:\n"
+            "  - name: Valid\n"
+            "    command: [ 'true' ]\n"
+        )
+        minitor = Minitor()
+        minitor.config_path = str(config)
+        minitor._setup(minitor.config_path)
+        monitors = minitor.monitors
+
+        config.write_text(
+            "check_interval: 20\n"
+            "monitors:\n"
+            "  - name: Invalid\n"
+            "    command: [ 'true' ]\n"
+            "    alert_down: [ not_real ]\n"
+        )
+        assert not minitor._reload()
+        assert minitor.monitors is monitors
+        assert minitor.check_interval == 10
+        # Nothing is kept for the rejected monitor
+        assert ("not_real",) not in main._alert_lists
+
+    def test_reload_prunes_shared_values(self, tmp_path):
+        config = tmp_path / "config.yml"
+        config.write_text(
+            "monitors:\n"
+            "  - name: Kept\n"
+            "    command: [ echo, kept ]\n"
+            "    alert_down: [ log ]\n"
+            "  - name: Removed\n"
+            "    command: [ echo, removed ]\n"
+            "    alert_down: [ log, removed ]\n"
+            "alerts:\n"
+            "  removed:\n"
+            "    command: [ 'true' ]\n"
+        )
+        minitor = Minitor()
+        minitor.config_path = str(config)
+        minitor._setup(minitor.config_path)
+        kept, removed = minitor.monitors
+
+        config.write_text(
+            "monitors:\n"
+            "  - name: Kept\n"
+            "    command: [ echo, kept ]\n"
+            "    alert_down: [ log ]\n"
+        )
+        assert minitor._reload()
+        assert minitor.monitors == [kept]
+        assert ("log",) in main._alert_lists
+        assert ("log", "removed") not in main._alert_lists
+        assert kept.command_key in main._command_keys
+        assert removed.command_key not in main._command_keys
+        # Equal values are still shared after pruning
+        key = command_key(["echo", "kept"], kept.timeout, kept.max_output)
+        assert key is kept.command_key
+
+    def test_request_reload(self, tmp_path):
+        config = tmp_path / "config.yml"
+        config.write_text("monitors: []\n")
+        minitor = Minitor()
+        minitor.config_path = str(config)
+        minitor.watch_config = True
+        minitor._init_reload()
+        assert not minitor._should_reload()
+
+        # A reload request should interrupt waiting
+        start = monotonic()
+        minitor._request_reload()
+        minitor._wait(5)
+        assert monotonic() - start < 5
+        assert minitor._should_reload()
+        assert not minitor._should_reload()
+
+        # Changes to the config file should be detected
+        config.write_text("monitors: []\ncheck_interval: 10\n")
+        os.utime(str(config), ns=(0, 0))
+        assert minitor._should_reload()
+
+    def test_minitor_collector(self):
+        registry = CollectorRegistry()
+        minitor = Minitor()
+        minitor.alerts = {}
+        minitor.monitors = [
+            Monitor({"name": "Failing", "command": ["false"], "alert_after": 5})
+        ]
+        registry.register(MinitorCollector(minitor))
+        labels = {"monitor": "Failing"}
+        assert registry.get_sample_value("minitor_monitor_failure_count", labels) == 0
+
+        minitor._check()
+        minitor._check(minitor.monitors)
+        assert registry.get_sample_value("minitor_monitor_failure_count", labels) == 2
+        assert registry.get_sample_value("minitor_monitor_up_count", labels) == 1
+        since = registry.get_sample_value("minitor_monitor_seconds_since_check", labels)
+        assert 0 <= since < 5
+        assert (
+            registry.get_sample_value("minitor_monitor_interval_seconds", labels) == 30
+        )
+        assert registry.get_sample_value("minitor_alert_queue_depth") == 0
+
+        # Removed monitors are no longer collected
+        minitor.monitors = []
+        assert (
+            registry.get_sample_value("minitor_monitor_failure_count", labels) is None
+        )
+
+    def test_lazy_imports(self):
+        # Optional modules are only imported when they are needed
+        subprocess.check_call(
+            [
+                sys.executable,
+                "-c",
+                "import sys, minitor.main; "
+                "assert 'prometheus_client' not in sys.modules; "
+                "assert 'yamlenv' not in sys.modules; "
+                "assert 'asyncio' not in sys.modules; "
+                "assert 'http.client' not in sys.modules; "
+                "assert 'ssl' not in sys.modules",
+            ],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        )
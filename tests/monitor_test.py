@@ -1,15 +1,26 @@
+import tracemalloc
 from datetime import datetime
+from subprocess import CalledProcessError
+from subprocess import TimeoutExpired
 from unittest.mock import patch
 
 import pytest
+from prometheus_client import CollectorRegistry
+from prometheus_client import Counter
+from prometheus_client import Histogram
 
 from minitor.main import InvalidMonitorException
+from minitor.main import Minitor
 from minitor.main import MinitorAlert
 from minitor.main import Monitor
 from minitor.main import validate_monitor_settings
 from tests.util import assert_called_once
 
 
+# Bytes allowed for each Monitor
+MONITOR_MEMORY_BUDGET = 1024
+
+
 class TestMonitor(object):
     @pytest.fixture
     def monitor(self):
@@ -34,12 +45,88 @@ class TestMonitor(object):
             {"alert_after": "invalid"},
             {"alert_every": "invalid"},
             {"check_interval": "invalid"},
+            {"timeout": 0},
+            {"timeout": -1},
+            {"timeout": "invalid"},
+            {"max_output": 0},
+            {"max_output": "invalid"},
         ],
     )
     def test_monitor_invalid_configuration(self, settings):
         with pytest.raises(InvalidMonitorException):
             validate_monitor_settings(settings)
 
+    @pytest.mark.parametrize(
+        "settings",
+        [
+            {"min_interval": 0},
+            {"min_interval": 60},
+            {"max_interval": 10},
+            {"max_interval": "invalid"},
+        ],
+    )
+    def test_monitor_invalid_intervals(self, settings):
+        with pytest.raises(InvalidMonitorException):
+            Monitor(
+                dict(
+                    {
+                        "name": "Sample Monitor",
+                        "command": ["echo", "foo"],
+                        "check_interval": 30,
+                    },
+                    **settings
+                )
+            )
+
+    @pytest.mark.parametrize("history_size", [-1, "10", True])
+    def test_monitor_invalid_history_size(self, history_size):
+        with pytest.raises(InvalidMonitorException):
+            Monitor(
+                {
+                    "name": "Sample Monitor",
+                    "command": ["echo", "foo"],
+                    "history_size": history_size,
+                }
+            )
+
+    def test_monitor_history(self):
+        monitor = Monitor(
+            {"name": "History", "command": ["echo", "foo"], "history_size": 2}
+        )
+        monitor.last_duration = 0.5
+        monitor.handle_result(b"foo", None)
+        monitor.handle_result(b"", CalledProcessError(3, ["echo", "foo"]))
+        monitor.last_duration = 1.0
+        monitor.handle_result(b"", TimeoutExpired(["echo", "foo"], 1))
+        entries = monitor.history.entries()
+        assert [entry[1:] for entry in entries] == [
+            ("failure", 0.5, 3),
+            ("timeout", 1.0, None),
+        ]
+        # Timestamps are on the wall clock
+        assert entries[-1][0] == pytest.approx(monitor.last_check.timestamp())
+
+        # History is kept when the config is reloaded
+        reloaded = Monitor(
+            {"name": "History", "command": ["echo", "foo"], "history_size": 1}
+        )
+        reloaded.copy_state(monitor)
+        assert reloaded.history.entries() == entries[-1:]
+        assert Monitor({"name": "None", "command": ["true"]}).history is None
+
+    @pytest.mark.parametrize("timeout", [None, 1, 0.5])
+    def test_monitor_valid_timeout(self, timeout):
+        validate_monitor_settings(
+            {
+                "name": "Timeout",
+                "command": ["echo", "foo"],
+                "check_interval": 1,
+                "alert_after": 1,
+                "alert_every": 1,
+                "timeout": timeout,
+            }
+        )
+
     @pytest.mark.parametrize(
         "alert_after",
         [1, 20],
@@ -113,19 +200,108 @@ class TestMonitor(object):
 
     def test_monitor_check_fail(self, monitor):
         assert monitor.last_output is None
-        with patch.object(monitor, "failure") as mock_failure:
+        with patch.object(Monitor, "failure") as mock_failure:
             monitor.command = ["ls", "--not-real"]
             assert not monitor.check()
             assert_called_once(mock_failure)
             assert monitor.last_output is not None
 
+    def test_monitor_check_timeout(self, monitor):
+        monitor.command = ["sleep", "10"]
+        monitor.timeout = 0.1
+        with patch.object(Monitor, "failure") as mock_failure:
+            assert not monitor.check()
+            assert_called_once(mock_failure)
+            assert monitor.last_status == "timeout"
+
+    def test_monitor_handle_result_status(self, monitor):
+        monitor.handle_result(b"", None)
+        assert monitor.last_status == "success"
+        monitor.alert_after = 2
+        monitor.handle_result(b"", TimeoutExpired(["sleep"], 1))
+        assert monitor.last_status == "timeout"
+
     def test_monitor_check_success(self, monitor):
         assert monitor.last_output is None
-        with patch.object(monitor, "success") as mock_success:
+        with patch.object(Monitor, "success") as mock_success:
             assert monitor.check()
             assert_called_once(mock_success)
             assert monitor.last_output is not None
 
+    def test_monitor_last_output_lazy(self, monitor):
+        monitor.handle_result(b"caf\xc3\xa9 \xc3", None)
+        assert isinstance(monitor._last_output, bytes)
+        assert monitor.last_output == "caf\u00e9 \ufffd"
+        assert isinstance(monitor._last_output, str)
+
+    def test_monitor_max_output(self, monitor):
+        monitor.command = "yes | head -n 100"
+        monitor.max_output = 4
+        monitor.check()
+        assert monitor.last_output == "[... 196 bytes truncated ...]\ny\ny"
+
+    def test_monitor_duration(self):
+        registry = CollectorRegistry()
+        histogram = Histogram(
+            "check_duration", "Check duration", ["monitor"], registry=registry
+        )
+        monitor = Monitor(
+            {"name": "Timed", "command": ["sleep", "0.05"]},
+            duration_histogram=histogram,
+        )
+        assert monitor.seconds_since_check() != monitor.seconds_since_check()
+        monitor.check()
+        assert monitor.last_duration >= 0.05
+        assert 0 <= monitor.seconds_since_check() < 5
+        assert (
+            registry.get_sample_value("check_duration_count", {"monitor": "Timed"}) == 1
+        )
+
+    def test_monitor_counter(self):
+        registry = CollectorRegistry()
+        counter = Counter(
+            "checks", "Checks", ["monitor", "status", "is_alert"], registry=registry
+        )
+        monitor = Monitor(
+            {"name": "Counted", "command": ["false"], "alert_after": 5},
+            counter=counter,
+        )
+        labels = {"monitor": "Counted", "status": "failure", "is_alert": "False"}
+        # Label children are bound up front so they are exported before a check
+        assert registry.get_sample_value("checks_total", labels) == 0
+        monitor.check()
+        assert registry.get_sample_value("checks_total", labels) == 1
+
+    def test_monitor_memory(self, tmp_path):
+        # Use the defaults that Minitor applies to configured Monitors
+        path = tmp_path / "config.yml"
+        path.write_text("monitors: []\n")
+        minitor = Minitor()
+        minitor._setup(str(path))
+        configs = [
+            dict(
+                minitor._monitor_defaults(),
+                name="Monitor {}".format(i),
+                command=["true"],
+            )
+            for i in range(1000)
+        ]
+        tracemalloc.start()
+        try:
+            start = tracemalloc.get_traced_memory()[0]
+            monitors = [Monitor(config) for config in configs]
+            for monitor in monitors:
+                monitor.handle_result(b"", None)
+            used = tracemalloc.get_traced_memory()[0] - start
+        finally:
+            tracemalloc.stop()
+        # Keep enough headroom to run tens of thousands of monitors
+        assert used / len(monitors) < MONITOR_MEMORY_BUDGET
+        assert len(monitors[0].history) == 1
+        # Monitors share their alert lists and logger
+        assert monitors[0].alert_down is monitors[1].alert_down
+        assert monitors[0]._logger is monitors[1]._logger
+
     @pytest.mark.parametrize("failure_count", [0, 1])
     def test_monitor_success(self, monitor, failure_count):
         monitor.alert_count = 0
@@ -148,3 +324,57 @@ class TestMonitor(object):
         assert monitor.alert_count == 0
         assert monitor.last_success is not None
         assert monitor.total_failure_count == 0
+
+    def test_monitor_adaptive_interval(self):
+        monitor = Monitor(
+            {
+                "name": "Adaptive",
+                "command": ["echo", "foo"],
+                "check_interval": 30,
+                "min_interval": 5,
+                "max_interval": 60,
+                "alert_after": 3,
+            }
+        )
+        assert monitor.interval == 30
+
+        # Stretches while checks succeed
+        monitor.success()
+        assert monitor.interval == 45
+        monitor.success()
+        monitor.success()
+        assert monitor.interval == 60
+
+        # Tightens until the failure is confirmed
+        monitor.failure()
+        assert monitor.interval == 5
+        monitor.failure()
+        assert monitor.interval == 5
+        with pytest.raises(MinitorAlert):
+            monitor.failure()
+        assert monitor.interval == 30
+
+        # Starts again from check_interval once back up
+        with pytest.raises(MinitorAlert):
+            monitor.success()
+        assert monitor.interval == 30
+
+    def test_monitor_adaptive_interval_alert_every(self):
+        monitor = Monitor(
+            {
+                "name": "Adaptive",
+                "command": ["echo", "foo"],
+                "check_interval": 30,
+                "min_interval": 5,
+                "alert_after": 2,
+            }
+        )
+        alerts = []
+        for i in range(1, 10):
+            try:
+                monitor.failure()
+            except MinitorAlert:
+                alerts.append(i)
+        # Backoff is counted in failures, unchanged by min_interval
+        assert alerts == [2, 3, 5, 9]
+        assert monitor.interval == 30
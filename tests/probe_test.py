@@ -0,0 +1,295 @@
+import socket
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from subprocess import TimeoutExpired
+
+import pytest
+
+from minitor.main import InvalidMonitorException
+from minitor.main import Monitor
+from minitor.probes import build_probe
+from minitor.probes import DnsProbe
+from minitor.probes import HttpProbe
+from minitor.probes import PersistentProbe
+from minitor.probes import ProbeFailure
+from minitor.probes import TcpProbe
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connection_count += 1
+
+    def do_GET(self):
+        status = 500 if self.path == "/error" else 200
+        body = b"hello"
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def http_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.connection_count = 0
+    thread = threading.Thread(
+        target=server.serve_forever,
+        kwargs={"poll_interval": 0.01},
+        daemon=True,
+    )
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def http_url(http_server):
+    return "http://127.0.0.1:{}".format(http_server.server_address[1])
+
+
+@pytest.fixture
+def tcp_server():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    yield server
+    server.close()
+
+
+class TestHttpProbe(object):
+    def test_success(self, http_url):
+        probe = HttpProbe({"url": http_url + "/"}, timeout=5)
+        output, ex = probe.run()
+        assert ex is None
+        assert output.startswith(b"HTTP 200 OK from " + http_url.encode())
+
+    def test_keep_alive(self, http_server, http_url):
+        probe = HttpProbe({"url": http_url + "/"}, timeout=5)
+        for _ in range(3):
+            _, ex = probe.run()
+            assert ex is None
+        assert http_server.connection_count == 1
+
+    def test_reconnect_after_close(self, http_server, http_url):
+        probe = HttpProbe({"url": http_url + "/"}, timeout=5)
+        probe.run()
+        # Simulate the server closing the idle connection
+        probe._connection.sock.shutdown(socket.SHUT_RDWR)
+        _, ex = probe.run()
+        assert ex is None
+        assert http_server.connection_count == 2
+
+    def test_unexpected_status(self, http_url):
+        probe = HttpProbe({"url": http_url + "/error"}, timeout=5)
+        output, ex = probe.run()
+        assert isinstance(ex, ProbeFailure)
+        assert b"HTTP 500" in output
+
+        probe = HttpProbe(
+            {"url": http_url + "/error", "expect_status": [500]},
+            timeout=5,
+        )
+        _, ex = probe.run()
+        assert ex is None
+
+    def test_connection_refused(self, tcp_server):
+        port = tcp_server.getsockname()[1]
+        tcp_server.close()
+        probe = HttpProbe({"url": "http://127.0.0.1:{}/".format(port)}, timeout=5)
+        _, ex = probe.run()
+        assert isinstance(ex, ProbeFailure)
+
+    def test_timeout(self, tcp_server):
+        # The server accepts the connection but never responds
+        url = "http://127.0.0.1:{}/".format(tcp_server.getsockname()[1])
+        probe = HttpProbe({"url": url}, timeout=0.1)
+        _, ex = probe.run()
+        assert isinstance(ex, TimeoutExpired)
+
+    def test_invalid_response(self, tcp_server):
+        def respond():
+            connection, _ = tcp_server.accept()
+            with connection:
+                connection.recv(1024)
+                connection.sendall(b"not http\r\n\r\n")
+
+        thread = threading.Thread(target=respond)
+        thread.start()
+        url = "http://127.0.0.1:{}/".format(tcp_server.getsockname()[1])
+        output, ex = HttpProbe({"url": url}, timeout=5).run()
+        thread.join()
+        assert isinstance(ex, ProbeFailure)
+        assert b"not http" in output
+
+    @pytest.mark.parametrize(
+        "settings",
+        [
+            {},
+            {"url": "ftp://example.com"},
+            {"url": "http://example.com", "expect_status": ["200"]},
+        ],
+    )
+    def test_invalid(self, settings):
+        with pytest.raises(ValueError):
+            HttpProbe(settings)
+
+
+class TestTcpProbe(object):
+    def test_success(self, tcp_server):
+        port = tcp_server.getsockname()[1]
+        output, ex = TcpProbe({"host": "127.0.0.1", "port": port}, timeout=5).run()
+        assert ex is None
+        assert output.startswith("Connected to 127.0.0.1:{}".format(port).encode())
+
+    def test_failure(self, tcp_server):
+        port = tcp_server.getsockname()[1]
+        tcp_server.close()
+        _, ex = TcpProbe({"host": "127.0.0.1", "port": port}, timeout=5).run()
+        assert isinstance(ex, ProbeFailure)
+
+    @pytest.mark.parametrize(
+        "settings",
+        [{"port": 80}, {"host": "localhost"}, {"host": "localhost", "port": 0}],
+    )
+    def test_invalid(self, settings):
+        with pytest.raises(ValueError):
+            TcpProbe(settings)
+
+
+class TestDnsProbe(object):
+    def test_success(self):
+        output, ex = DnsProbe({"name": "localhost"}, timeout=5).run()
+        assert ex is None
+        assert output.startswith(b"Resolved localhost to ")
+
+    def test_failure(self):
+        _, ex = DnsProbe({"name": "not-a-real-name.invalid"}, timeout=5).run()
+        assert isinstance(ex, ProbeFailure)
+
+
+COPROCESS = """
+import sys
+import time
+
+for line in sys.stdin:
+    request = line.strip()
+    if request == "fail":
+        print("2 broken", flush=True)
+    elif request == "hang":
+        time.sleep(10)
+    elif request == "crash":
+        sys.exit(3)
+    elif request == "flood":
+        sys.stdout.write("x" * 1024 * 1024)
+        sys.stdout.flush()
+        time.sleep(10)
+    else:
+        print("0 ok " + request, flush=True)
+"""
+
+
+@pytest.fixture
+def coprocess_command(tmp_path):
+    path = tmp_path / "coprocess.py"
+    path.write_text(COPROCESS)
+    return [sys.executable, str(path)]
+
+
+class TestPersistentProbe(object):
+    def test_success(self, coprocess_command):
+        probes = [
+            PersistentProbe({"command": coprocess_command, "request": request})
+            for request in ("a", "b")
+        ]
+        assert [probe.run() for probe in probes * 2] == [
+            (b"ok a", None),
+            (b"ok b", None),
+        ] * 2
+        # Probes with the same command share one running co-process
+        assert probes[0].coprocess is probes[1].coprocess
+        assert probes[0].coprocess.starts == 1
+
+    def test_failure(self, coprocess_command):
+        probe = PersistentProbe({"command": coprocess_command, "request": "fail"})
+        output, ex = probe.run()
+        assert output == b"broken"
+        assert isinstance(ex, ProbeFailure)
+
+    @pytest.mark.parametrize("request_line", ["crash", "hang", "flood"])
+    def test_restart(self, coprocess_command, request_line):
+        probe = PersistentProbe(
+            {"command": coprocess_command, "request": request_line}, timeout=0.5
+        )
+        output, ex = probe.run()
+        if request_line == "hang":
+            assert isinstance(ex, TimeoutExpired)
+        elif request_line == "flood":
+            # Output without a newline is not buffered without limit
+            assert isinstance(ex, ProbeFailure)
+            assert b"longer than" in output
+        else:
+            assert isinstance(ex, ProbeFailure)
+            assert b"exited with 3" in output
+
+        # The co-process is started again for the next request
+        probe.request = "again"
+        assert probe.run() == (b"ok again", None)
+        assert probe.coprocess.starts == 2
+        probe.coprocess.stop()
+
+    @pytest.mark.parametrize("settings", [{}, {"command": ["true"], "request": "a\nb"}])
+    def test_invalid(self, settings):
+        with pytest.raises(ValueError):
+            PersistentProbe(settings)
+
+
+class TestMonitorProbe(object):
+    def test_build_probe(self):
+        assert build_probe({"command": ["true"]}) is None
+        probe = build_probe({"tcp": {"host": "localhost", "port": 80}}, timeout=2)
+        assert isinstance(probe, TcpProbe)
+        assert probe.timeout == 2
+
+    def test_monitor_check(self, http_url):
+        monitor = Monitor(
+            {
+                "name": "Http Monitor",
+                "http": {"url": http_url + "/error", "expect_status": 200},
+                "alert_after": 2,
+            }
+        )
+        assert not monitor.check()
+        assert monitor.last_status == "failure"
+        assert "HTTP 500" in monitor.last_output
+
+    def test_monitor_persistent(self, coprocess_command):
+        monitor = Monitor(
+            {
+                "name": "Persistent Monitor",
+                "persistent": {"command": coprocess_command, "request": "fail"},
+                "alert_after": 2,
+            }
+        )
+        assert not monitor.check()
+        assert monitor.last_status == "failure"
+        assert monitor.last_output == "broken"
+
+    @pytest.mark.parametrize(
+        "settings",
+        [
+            {"tcp": {"host": "localhost"}},
+            {"command": ["true"], "dns": {"name": "localhost"}},
+        ],
+    )
+    def test_monitor_invalid(self, settings):
+        with pytest.raises(InvalidMonitorException):
+            Monitor(dict({"name": "Invalid"}, **settings))
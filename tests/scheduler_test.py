@@ -0,0 +1,181 @@
+import asyncio
+from datetime import datetime
+from datetime import timedelta
+from time import monotonic
+
+import pytest
+
+from minitor.main import Monitor
+from minitor.main import phase_offset
+from minitor.main import RateLimiter
+from minitor.main import Scheduler
+
+
+class FakeClock(object):
+    def __init__(self, now=100.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestScheduler(object):
+    @pytest.fixture
+    def clock(self):
+        return FakeClock()
+
+    @pytest.fixture
+    def monitors(self):
+        return [
+            Monitor(
+                {
+                    "name": "Monitor {}".format(interval),
+                    "command": ["echo", "foo"],
+                    "check_interval": interval,
+                }
+            )
+            for interval in (45, 60)
+        ]
+
+    def test_all_due_at_start(self, clock, monitors):
+        scheduler = Scheduler(monitors, clock=clock)
+        assert scheduler.time_until_next() == 0
+        assert scheduler.pop_due() == monitors
+        assert scheduler.pop_due() == []
+        assert len(scheduler) == 2
+
+    def test_wakes_at_next_deadline(self, clock, monitors):
+        scheduler = Scheduler(monitors, clock=clock)
+        scheduler.pop_due()
+
+        assert scheduler.time_until_next() == 45
+        clock.now += 45
+        assert scheduler.pop_due() == [monitors[0]]
+        assert scheduler.time_until_next() == 15
+        clock.now += 15
+        assert scheduler.pop_due() == [monitors[1]]
+
+    def test_lateness_does_not_drift(self, clock, monitors):
+        scheduler = Scheduler(monitors[:1], clock=clock)
+        scheduler.pop_due()
+
+        # Run 5s late and then the next deadline should be back in phase
+        clock.now += 50
+        assert scheduler.pop_due() == monitors[:1]
+        assert scheduler.lag == 5
+        assert scheduler.time_until_next() == 40
+
+    def test_skips_missed_deadlines(self, clock, monitors):
+        scheduler = Scheduler(monitors[:1], clock=clock)
+        scheduler.pop_due()
+
+        # Stall for several intervals and only check once
+        clock.now += 45 * 3 + 10
+        assert scheduler.pop_due() == monitors[:1]
+        assert scheduler.lag == 45 * 2 + 10
+        assert scheduler.pop_due() == []
+        assert scheduler.time_until_next() == 35
+
+    def test_empty(self, clock):
+        scheduler = Scheduler(clock=clock)
+        assert scheduler.time_until_next() is None
+        assert scheduler.pop_due() == []
+
+    def test_update(self, clock, monitors):
+        scheduler = Scheduler(monitors, clock=clock)
+        scheduler.pop_due()
+        clock.now += 10
+
+        added = Monitor(
+            {"name": "Added", "command": ["echo", "foo"], "check_interval": 60}
+        )
+        scheduler.update([monitors[0], added])
+        assert len(scheduler) == 2
+        # New monitors are due immediately and existing ones keep deadlines
+        assert scheduler.pop_due() == [added]
+        assert scheduler.time_until_next() == 35
+
+    def test_resume_from_last_check(self, clock, monitors):
+        monitors[0].last_check = datetime.now() - timedelta(seconds=10)
+        scheduler = Scheduler(monitors, clock=clock)
+        # Never checked monitors are due now and others resume their phase
+        assert scheduler.pop_due() == [monitors[1]]
+        assert 34 <= scheduler.time_until_next() <= 35
+
+    def test_spread(self, clock):
+        monitors = [
+            Monitor({"name": "Monitor {}".format(i), "command": ["true"]})
+            for i in range(100)
+        ]
+        scheduler = Scheduler(monitors, clock=clock, spread=True)
+        # First checks are spread across the interval rather than all at once
+        assert 0 < scheduler.time_until_next() < 30
+        clock.now += 15
+        first_half = len(scheduler.pop_due())
+        assert 25 < first_half < 75
+        clock.now += 15
+        assert first_half + len(scheduler.pop_due()) == 100
+
+        # Offsets are fixed for each name
+        assert phase_offset("Monitor 1") == phase_offset("Monitor 1")
+        assert 0 <= phase_offset("Monitor 1") < 1
+
+    def test_update_spread(self, clock, monitors):
+        scheduler = Scheduler(monitors[:1], clock=clock, spread=True)
+        added = Monitor({"name": "Added", "command": ["echo", "foo"]})
+        scheduler.update([monitors[0], added])
+        clock.now += phase_offset("Added") * 30
+        assert added in scheduler.pop_due()
+
+    def test_reschedule(self, clock):
+        monitor = Monitor(
+            {
+                "name": "Adaptive",
+                "command": ["false"],
+                "check_interval": 60,
+                "min_interval": 10,
+            }
+        )
+        scheduler = Scheduler([monitor], clock=clock)
+        assert scheduler.pop_due() == [monitor]
+        assert scheduler.time_until_next() == 60
+
+        # A failure moves the next check sooner, in phase with the last one
+        clock.now += 2
+        monitor.failure()
+        scheduler.reschedule([monitor])
+        assert scheduler.time_until_next() == 8
+        assert len(scheduler) == 1
+        clock.now += 8
+        assert scheduler.pop_due() == [monitor]
+        assert scheduler.pop_due() == []
+        assert scheduler.time_until_next() == 10
+
+        # Unchanged intervals keep their deadlines
+        scheduler.reschedule([monitor])
+        assert scheduler.time_until_next() == 10
+
+
+class TestRateLimiter(object):
+    def test_unlimited(self):
+        limiter = RateLimiter()
+        assert [limiter.reserve() for _ in range(3)] == [0, 0, 0]
+
+    def test_reserve(self):
+        clock = FakeClock()
+        limiter = RateLimiter(10, clock=clock)
+        assert [limiter.reserve() for _ in range(3)] == pytest.approx([0, 0.1, 0.2])
+        # Slots that pass unused are not saved up for a burst later
+        clock.now += 10
+        assert [limiter.reserve() for _ in range(2)] == pytest.approx([0, 0.1])
+
+    def test_acquire_async(self):
+        limiter = RateLimiter(100)
+
+        async def acquire():
+            for _ in range(5):
+                await limiter.acquire_async()
+
+        start = monotonic()
+        asyncio.run(acquire())
+        assert monotonic() - start >= 0.039
@@ -0,0 +1,67 @@
+import asyncio
+from subprocess import CalledProcessError
+from subprocess import TimeoutExpired
+
+import pytest
+
+from minitor import main
+from minitor.main import async_call_output
+from minitor.main import call_output
+from minitor.spawn_helper import SpawnHelper
+
+
+@pytest.fixture
+def helper():
+    helper = SpawnHelper()
+    helper.start()
+    yield helper
+    helper.stop()
+
+
+class TestSpawnHelper(object):
+    def test_call_output(self, helper):
+        assert helper.call_output(["echo", "foo"]) == (b"foo", None)
+        assert helper.call_output("echo $((1 + 1))", shell=True) == (b"2", None)
+
+        output, ex = helper.call_output(["sh", "-c", "echo bar; exit 3"])
+        assert output == b"bar"
+        assert isinstance(ex, CalledProcessError)
+        assert ex.returncode == 3
+
+    def test_timeout_and_max_output(self, helper):
+        output, ex = helper.call_output(["sleep", "5"], timeout=0.1)
+        assert isinstance(ex, TimeoutExpired)
+
+        output, ex = helper.call_output(["echo", "abcdef"], max_output=3)
+        assert output.endswith(b"ef")
+        assert b"truncated" in output
+
+    def test_concurrent(self, helper):
+        futures = [helper.submit(["sleep", "0.2"]) for _ in range(5)]
+        assert [future.result(timeout=1) for future in futures] == [(b"", None)] * 5
+
+    def test_restart(self, helper):
+        helper._proc.kill()
+        helper._proc.wait()
+        # Requests start the helper again if it has exited
+        assert helper.call_output(["echo", "back"]) == (b"back", None)
+
+    def test_missing_command(self, helper):
+        with pytest.raises(FileNotFoundError):
+            helper.call_output(["/does/not/exist"])
+
+    def test_main_call_output(self, helper, monkeypatch):
+        monkeypatch.setattr(main, "spawn_helper", helper)
+        submitted = []
+        submit = helper.submit
+
+        def tracked_submit(*args, **kwargs):
+            submitted.append(args[0])
+            return submit(*args, **kwargs)
+
+        monkeypatch.setattr(helper, "submit", tracked_submit)
+        assert call_output(["echo", "sync"]) == (b"sync", None)
+        assert asyncio.run(async_call_output(["echo", "async"])) == (b"async", None)
+        # Unsupported arguments are handled in this process
+        assert call_output(["echo", "direct"], env={}) == (b"direct", None)
+        assert submitted == [["echo", "sync"], ["echo", "async"]]
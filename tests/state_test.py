@@ -0,0 +1,139 @@
+import json
+import signal
+import subprocess
+import sys
+from datetime import datetime
+from time import monotonic
+from time import sleep
+
+import pytest
+
+from minitor.main import Monitor
+from minitor.state import StateStore
+
+
+class TestStateStore(object):
+    @pytest.fixture
+    def monitors(self):
+        return [
+            Monitor({"name": "Monitor {}".format(i), "command": ["true"]})
+            for i in range(2)
+        ]
+
+    @pytest.fixture
+    def store(self, tmp_path):
+        return StateStore(str(tmp_path / "state.json"), max_output=4)
+
+    def test_save_and_restore(self, store, monitors):
+        monitor = monitors[0]
+        monitor.alert_count = 2
+        monitor.total_failure_count = 5
+        monitor.last_check = datetime(2018, 4, 10, 1, 2, 3)
+        monitor.last_duration = 1.5
+        monitor.last_output = "beep boop"
+        monitor.last_status = "failure"
+        monitor.interval = 45
+        assert store.save(monitors)
+
+        restored = [
+            Monitor({"name": "Monitor {}".format(i), "command": ["true"]})
+            for i in range(3)
+        ]
+        assert StateStore(store.path).restore(restored) == 2
+        assert restored[0].alert_count == 2
+        assert restored[0].total_failure_count == 5
+        assert restored[0].last_check == datetime(2018, 4, 10, 1, 2, 3)
+        assert restored[0].last_duration == 1.5
+        assert restored[0].last_success is None
+        assert restored[0].last_status == "failure"
+        # Output is truncated to keep the snapshot small
+        assert restored[0].last_output == "boop"
+        assert not restored[0].is_up()
+        # Restored intervals are limited to the current config
+        assert restored[0].interval == 30
+        assert restored[2].last_check is None
+        assert restored[2].last_duration is None
+
+    def test_save_and_restore_history(self, store):
+        monitor = Monitor({"name": "Monitor", "command": ["true"], "history_size": 2})
+        monitor.last_duration = 0.5
+        monitor.handle_result(b"", None)
+        assert store.save([monitor])
+
+        restored = Monitor({"name": "Monitor", "command": ["true"], "history_size": 2})
+        assert StateStore(store.path).restore([restored]) == 1
+        assert restored.history.entries() == monitor.history.entries()
+
+    def test_save_only_when_changed(self, store, monitors):
+        assert store.save(monitors)
+        assert not store.save(monitors)
+
+        monitors[1].handle_result(b"", None)
+        assert store.save(monitors)
+        assert not store.save(monitors)
+
+        # Removing a monitor is also a change
+        assert store.save(monitors[:1])
+        with open(store.path) as f:
+            assert list(json.load(f)["monitors"]) == ["Monitor 0"]
+
+    @pytest.mark.parametrize(
+        "contents",
+        ["not json", '{"version": 0, "monitors": {}}'],
+    )
+    def test_load_invalid(self, store, contents):
+        with open(store.path, "w") as f:
+            f.write(contents)
+        assert store.load() == {}
+
+    def test_load_missing(self, store):
+        assert store.load() == {}
+
+    def test_restore_invalid_monitor(self, store, monitors):
+        with open(store.path, "w") as f:
+            json.dump({"version": 1, "monitors": {"Monitor 0": {}}}, f)
+        assert store.restore(monitors) == 0
+
+
+class TestSaveOnExit(object):
+    @pytest.mark.parametrize("args", [[], ["--workers", "1"]])
+    def test_save_on_sigterm(self, tmp_path, args):
+        alerted = tmp_path / "alerted"
+        state = tmp_path / "state.json"
+        config = tmp_path / "config.yml"
+        config.write_text(
+            "monitors:\n"
+            "  - name: Failing\n"
+            "    command: [ 'false' ]\n"
+            "    alert_after: 1\n"
+            "    alert_down: [ touch ]\n"
+            "alerts:\n"
+            "  touch:\n"
+            "    command: [ touch, {} ]\n".format(alerted)
+        )
+        proc = subprocess.Popen(
+            [
+                sys.executable,
+                "-c",
+                "import sys; from minitor.main import main; sys.exit(main())",
+                "--config",
+                str(config),
+                "--state-file",
+                str(state),
+                "--state-interval",
+                "3600",
+            ]
+            + args,
+        )
+        try:
+            deadline = monotonic() + 30
+            while not alerted.exists():
+                assert monotonic() < deadline
+                sleep(0.05)
+            proc.send_signal(signal.SIGTERM)
+            assert proc.wait(timeout=30) == 128 + signal.SIGTERM
+        finally:
+            proc.kill()
+            proc.wait()
+        saved = json.loads(state.read_text())["monitors"]["Failing"]
+        assert saved["total_failure_count"] >= 1
@@ -0,0 +1,82 @@
+import json
+from subprocess import CalledProcessError
+from urllib.error import HTTPError
+from urllib.parse import quote
+from urllib.request import urlopen
+
+import pytest
+
+from minitor.main import Minitor
+from minitor.main import Monitor
+from minitor.server import RoutingApp
+from minitor.server import start_server
+from minitor.status import STATUS_PATH
+from minitor.status import StatusApp
+from tests.cluster_test import not_found
+
+
+@pytest.fixture
+def minitor():
+    minitor = Minitor()
+    minitor.monitors = [
+        Monitor({"name": name, "command": ["true"], "history_size": 2})
+        for name in ("Server", "Ünicode")
+    ]
+    return minitor
+
+
+class TestStatusApp(object):
+    def test_cached(self, minitor):
+        app = StatusApp(minitor)
+        index = app.index()
+        detail = app.detail("Server")
+        assert app.index() is index
+        assert app.detail("Server") is detail
+        assert app.detail("Missing") is None
+
+        # Responses are made again once a Monitor is checked
+        minitor.monitors[0].handle_result(b"ok", None)
+        assert app.index() is not index
+        assert app.detail("Server") is not detail
+
+        # Or once Monitors are reloaded
+        index = app.index()
+        minitor.monitors = list(minitor.monitors)
+        assert app.index() is not index
+
+    def test_serve(self, minitor):
+        server_monitor = minitor.monitors[0]
+        server_monitor.last_duration = 0.25
+        server_monitor.handle_result(b"ok", None)
+        server_monitor.last_duration = 0.5
+        server_monitor.handle_result(b"down", CalledProcessError(2, ["true"]))
+
+        app = RoutingApp(not_found)
+        app.add_route(STATUS_PATH, StatusApp(minitor))
+        server = start_server(0, app, addr="127.0.0.1")
+        url = "http://127.0.0.1:{}{}".format(server.server_port, STATUS_PATH)
+        try:
+            with urlopen(url) as response:
+                index = json.load(response)
+            with urlopen(url + "/Server") as response:
+                detail = json.load(response)
+            with urlopen(url + "/" + quote("Ünicode")) as response:
+                assert json.load(response)["name"] == "Ünicode"
+            with pytest.raises(HTTPError) as e:
+                urlopen(url + "/Missing")
+            assert e.value.code == 404
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        assert [status["name"] for status in index["monitors"]] == [
+            "Server",
+            "Ünicode",
+        ]
+        assert index["monitors"][0]["last_status"] == "failure"
+        assert "history" not in index["monitors"][0]
+        assert detail["last_output"] == "down"
+        assert [
+            (entry["status"], entry["duration"], entry["exit_code"])
+            for entry in detail["history"]
+        ] == [("success", 0.25, 0), ("failure", 0.5, 2)]
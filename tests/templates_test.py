@@ -0,0 +1,91 @@
+import subprocess
+
+import pytest
+
+from minitor.templates import CommandTemplate
+from minitor.templates import Template
+
+
+FIELDS = {"name", "count"}
+
+
+class TestTemplate(object):
+    def test_render(self):
+        template = Template("{name} failed {count:>3} times {{ok}}", FIELDS)
+        assert template.fields == {"name", "count"}
+        assert template.render({"name": "Test", "count": 5}) == (
+            "Test failed   5 times {ok}"
+        )
+
+    @pytest.mark.parametrize(
+        "source",
+        ["{unknown}", "{}", "{name.upper}", "{name[0]}", "{name", "{name:{count}}"],
+    )
+    def test_invalid(self, source):
+        with pytest.raises(ValueError):
+            Template(source, FIELDS)
+
+    @pytest.mark.parametrize(
+        "source,expected",
+        [
+            ("echo {name}", "echo 'a'\"'\"'b $c'"),
+            ("echo '{name}'", "echo 'a'\"'\"'b $c'"),
+            ('echo "{name}"', 'echo "a\'b \\$c"'),
+            ("echo \\'{name}", "echo \\''a'\"'\"'b $c'"),
+        ],
+    )
+    def test_shell_escape(self, source, expected):
+        template = Template(source, FIELDS, shell=True)
+        assert template.render({"name": "a'b $c"}) == expected
+
+    @pytest.mark.parametrize(
+        "source",
+        [
+            "printf %s {name}",
+            'printf %s "$(printf %s {name})"',
+            'printf %s "$(printf %s "{name}")"',
+            "printf %s \"$(printf %s '{name}')\"",
+            "(printf %s {name})",
+            "true $(true) # ok\nprintf %s {name}",
+            "true $((1 + (2))); printf %s {name}",
+            'true "`true`"; printf %s {name}',
+            "printf %s {name} # {{name}}",
+        ],
+    )
+    def test_shell_escape_contexts(self, source):
+        # Values are passed through literally wherever a field is allowed
+        value = 'a\'b "c" $(echo x) `echo y` \\ ) # \n;echo z'
+        command = Template(source, FIELDS, shell=True).render({"name": value})
+        output = subprocess.check_output(["/bin/sh", "-c", command])
+        assert output.decode() == value
+
+    @pytest.mark.parametrize(
+        "source",
+        [
+            "echo `echo {name}`",
+            'echo "`echo {name}`"',
+            "echo $(( {count} + 1 ))",
+            "echo $'{name}'",
+            "echo ok # {name}",
+            'echo "$(echo ok) # {name}" | cat <<EOF\n{name}\nEOF',
+            "cat <<EOF\n{name}\nEOF",
+            "echo \\{name}",
+            'echo "\\{name}"',
+        ],
+    )
+    def test_shell_unsafe_contexts(self, source):
+        with pytest.raises(ValueError):
+            Template(source, FIELDS, shell=True)
+
+
+class TestCommandTemplate(object):
+    def test_exec_form(self):
+        template = CommandTemplate(["sleep", 1, "{name}"], FIELDS)
+        assert not template.shell
+        assert template.fields == {"name"}
+        assert template.render({"name": "a'b"}) == ["sleep", "1", "a'b"]
+
+    def test_shell_form(self):
+        template = CommandTemplate("echo {count}", FIELDS)
+        assert template.shell
+        assert template.render({"count": 2}) == "echo 2"
@@ -0,0 +1,166 @@
+from queue import Queue
+from time import monotonic
+from unittest.mock import patch
+
+import pytest
+
+from minitor.main import Alert
+from minitor.main import Minitor
+from minitor.main import Monitor
+from minitor.workers import Coordinator
+from minitor.workers import EVENT_ALERT
+from minitor.workers import EVENT_STATE
+from minitor.workers import shard_for
+from minitor.workers import ShardStateReporter
+from minitor.workers import WorkerMinitor
+
+
+CONFIG = (
+    "check_interval: 1\n"
+    "monitors:\n"
+    "  - name: Monitor 0\n"
+    "    command: [echo, zero]\n"
+    "  - name: Monitor 1\n"
+    "    command: [echo, one]\n"
+    "  - name: Monitor 2\n"
+    "    command: [echo, two]\n"
+)
+
+# Shards for the first few monitor names when split 4 ways
+SHARDS = [1, 3, 1, 3]
+
+
+@pytest.fixture
+def config(tmp_path):
+    path = tmp_path / "config.yml"
+    path.write_text(CONFIG)
+    return str(path)
+
+
+def get_events(queue):
+    events = []
+    while not queue.empty():
+        events.append(queue.get_nowait())
+    return events
+
+
+class TestShards(object):
+    def test_shard_for(self):
+        names = ["Monitor {}".format(i) for i in range(100)]
+        shards = [shard_for(name, 4) for name in names]
+        # Shards must not depend on hash randomization in each process
+        assert shards[:4] == SHARDS
+        assert set(shards) == {0, 1, 2, 3}
+
+    def test_worker_setup(self, config):
+        monitors = []
+        for shard in range(2):
+            minitor = WorkerMinitor(shard, 2, Queue())
+            minitor._setup(config)
+            monitors.extend(monitor.name for monitor in minitor.monitors)
+        assert sorted(monitors) == ["Monitor 0", "Monitor 1", "Monitor 2"]
+
+    def test_worker_setup_depends_on(self, tmp_path):
+        path = tmp_path / "config.yml"
+        path.write_text(
+            CONFIG.replace(
+                "[echo, one]\n", "[echo, one]\n    depends_on: [Monitor 0]\n"
+            )
+        )
+        minitor = WorkerMinitor(SHARDS[1], 4, Queue())
+        minitor._setup(str(path))
+        # Monitors that depend on each other are checked by the same worker
+        assert minitor.monitors == []
+
+        minitor = WorkerMinitor(SHARDS[0], 4, Queue())
+        minitor._setup(str(path))
+        minitor._validate_monitors()
+        names = [monitor.name for monitor in minitor.monitors]
+        assert names == ["Monitor 0", "Monitor 1", "Monitor 2"]
+        assert minitor.monitors[1].parents == (minitor.monitors[0],)
+
+    def test_state_reporter(self):
+        events = Queue()
+        reporter = ShardStateReporter(events)
+        monitor = Monitor({"name": "Reported", "command": ["true"]})
+        assert not reporter.save([monitor])
+
+        monitor.handle_result(b"output", None)
+        assert reporter.save([monitor])
+        assert not reporter.save([monitor])
+        ((event, states),) = get_events(events)
+        assert event == EVENT_STATE
+        assert states["Reported"]["last_output"] == "output"
+
+    def test_worker_alert(self, config):
+        events = Queue()
+        minitor = WorkerMinitor(0, 1, events)
+        minitor._setup(config)
+        monitor = minitor.monitors[0]
+        monitor.alert_after = 1
+        monitor.alert_every = 1
+        monitor.command = ["false"]
+        minitor._check([monitor])
+
+        alerts = [event for event in get_events(events) if event[0] == EVENT_ALERT]
+        assert len(alerts) == 1
+        _, name, message, state = alerts[0]
+        assert name == "Monitor 0"
+        assert message == "Monitor 0 check has failed 1 times"
+        assert state["alert_count"] == 1
+
+
+class TestCoordinator(object):
+    @pytest.fixture
+    def coordinator(self, config):
+        minitor = Minitor()
+        args = minitor._parse_args(["--config", config, "--workers", "2"])
+        coordinator = Coordinator(minitor, args)
+        minitor._start(args)
+        coordinator._update_monitors()
+        yield coordinator
+        coordinator._stop_workers()
+
+    def test_handle_alert(self, coordinator):
+        state = {
+            "alert_count": 1,
+            "last_check": None,
+            "last_output": "failed",
+            "last_status": "failure",
+            "last_success": None,
+            "total_failure_count": 4,
+        }
+        with patch.object(Alert, "alert") as mock_alert:
+            coordinator._handle_event(
+                (EVENT_ALERT, "Monitor 1", "Monitor 1 check has failed", state)
+            )
+            coordinator._handle_event((EVENT_STATE, {"Removed": state}))
+        mock_alert.assert_called_once()
+        message, monitor = mock_alert.call_args[0]
+        assert message == "Monitor 1 check has failed"
+        assert monitor.last_output == "failed"
+        assert not monitor.is_up()
+
+    def test_restart_worker(self, coordinator):
+        for shard in range(2):
+            coordinator._start_worker(shard)
+
+        def wait_for_checks():
+            for monitor in coordinator.minitor.monitors:
+                monitor.last_check_time = None
+            end = monotonic() + 30
+            while monotonic() < end:
+                coordinator._handle_events(0.1)
+                if all(m.last_check for m in coordinator.minitor.monitors):
+                    return
+            pytest.fail("Workers did not check all monitors")
+
+        wait_for_checks()
+        assert coordinator.minitor.monitors[1].last_output == "one"
+
+        process = coordinator._processes[0]
+        process.kill()
+        process.join()
+        coordinator._restart_workers()
+        assert coordinator._processes[0] is not process
+        wait_for_checks()